@@ -0,0 +1,201 @@
+"""异步数据库访问
+
+db.py 的函数都是同步的，由调用者提供连接，适合一次性的命令行操作，
+但在 asyncio 中直接调用会阻塞事件循环。这里提供一个异步的外观 (facade):
+
+- 写操作交给一个专门的写入线程，通过队列排队，连续的多个写请求合并在一个事务中提交
+  (每个请求一个保存点，出错时只回滚该请求);
+- 读操作使用一个只读连接池，多个协程可以同时读取，不必等待写入。
+
+数据库使用 WAL 模式，这样读取与写入互不阻塞。
+
+用法:
+
+    async with AsyncDB() as adb:
+        feeds = await adb.read(db.get_subs_list)
+        await adb.write(db.update_entries, feed_id, entries)
+
+read/write 的第一个参数是 db.py 中的函数 (或其他以 conn 为最后一个参数的函数),
+其余参数按原样传入，连接由 AsyncDB 提供。
+"""
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import queue
+import sqlite3
+import threading
+from typing import Any, Callable, Final, TypeVar
+from . import compress
+from . import db
+from . import stmt
+from .model import Feed, FeedEntry
+
+Conn = sqlite3.Connection
+T = TypeVar("T")
+
+DefaultReaders: Final[int] = 4  # 只读连接的数量
+WriteBatchSize: Final[int] = 100  # 一个事务最多合并多少个写请求
+
+
+class WriteRequest:
+    def __init__(self, fn: Callable[..., Any], args: tuple) -> None:
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+
+
+def connect_readonly() -> Conn:
+    """只读连接，不执行迁移 (由写入线程的 db.connect_db 负责)。
+
+    连接在线程池中使用，但同一时间只有一个线程使用同一个连接。
+    """
+    uri = db.db_path.as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(stmt.Attach_news, (db.news_path.as_uri() + "?mode=ro",))
+    compress.register(conn)
+    return conn
+
+
+class AsyncDB:
+    def __init__(self, readers: int = DefaultReaders) -> None:
+        self.n_readers = readers
+        self._requests: queue.Queue[WriteRequest | None] = queue.Queue()
+        self._writer: threading.Thread | None = None
+        self._writer_ready: Future = Future()
+        self._readers: asyncio.Queue[Conn] = asyncio.Queue()
+        self._reader_conns: list[Conn] = []
+        self._executor = ThreadPoolExecutor(readers, thread_name_prefix="aiodb-read")
+
+    async def __aenter__(self) -> "AsyncDB":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """先启动写入线程 (打开数据库、迁移、切换到 WAL 模式), 再打开只读连接。"""
+        self._writer = threading.Thread(
+            target=self._write_loop, name="aiodb-write", daemon=True
+        )
+        self._writer.start()
+        await asyncio.wrap_future(self._writer_ready)
+
+        loop = asyncio.get_running_loop()
+        for _ in range(self.n_readers):
+            conn = await loop.run_in_executor(self._executor, connect_readonly)
+            self._reader_conns.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        """等待已排队的写请求全部完成后关闭。"""
+        if self._writer is not None:
+            self._requests.put(None)
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+        self._executor.shutdown(wait=True)
+        for conn in self._reader_conns:
+            conn.close()
+        self._reader_conns.clear()
+
+    async def read(self, fn: Callable[..., T], *args: Any) -> T:
+        """在只读连接上执行 fn(*args, conn). 连接都在使用中时，等待空闲的连接。"""
+        conn = await self._readers.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, conn))
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def write(self, fn: Callable[..., T], *args: Any) -> T:
+        """在写入线程中执行 fn(*args, conn), 提交后返回结果 (或抛出 fn 的异常)。"""
+        if self._writer is None:
+            raise RuntimeError("AsyncDB is not started")
+        req = WriteRequest(fn, args)
+        self._requests.put(req)
+        return await asyncio.wrap_future(req.future)
+
+    def _write_loop(self) -> None:
+        try:
+            conn = db.connect_db()
+            for schema in ("main", "news"):
+                conn.execute(stmt.Set_journal_wal.format(schema=schema))
+        except Exception as e:
+            self._writer_ready.set_exception(e)
+            return
+        self._writer_ready.set_result(None)
+
+        while True:
+            batch = self._next_batch()
+            self._write_batch(batch, conn)
+            if batch[-1] is None:
+                break
+        conn.close()
+
+    def _next_batch(self) -> list[WriteRequest | None]:
+        """阻塞等待第一个请求，再取出已排队的请求 (最多 WriteBatchSize 个)。"""
+        batch = [self._requests.get()]
+        while batch[-1] is not None and len(batch) < WriteBatchSize:
+            try:
+                batch.append(self._requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: list[WriteRequest | None], conn: Conn) -> None:
+        done: list[tuple[WriteRequest, Any]] = []
+        for req in batch:
+            if req is None:
+                break
+            # 有些函数内部会提交 (with conn), 因此每个请求都要检查是否在事务中。
+            if not conn.in_transaction:
+                conn.execute(stmt.Begin_request)
+            conn.execute(stmt.Savepoint_request)
+            try:
+                result = req.fn(*req.args, conn)
+            except Exception as e:
+                self._rollback_request(conn)
+                req.future.set_exception(e)
+                continue
+            if conn.in_transaction:
+                conn.execute(stmt.Release_request)
+            done.append((req, result))
+
+        # 提交后才通知调用者，这样调用者之后的读取一定能看到写入的结果。
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for req, _ in done:
+                req.future.set_exception(e)
+            return
+        for req, result in done:
+            req.future.set_result(result)
+
+    @staticmethod
+    def _rollback_request(conn: Conn) -> None:
+        if not conn.in_transaction:
+            return  # 函数内部已提交或已回滚
+        try:
+            conn.execute(stmt.Rollback_request)
+            conn.execute(stmt.Release_request)
+        except sqlite3.OperationalError:
+            # 函数内部提交后又开始了新的事务，保存点已不存在。
+            conn.rollback()
+
+    # 以下是常用操作的快捷方式
+
+    async def get_subs_list(self, feed_id: str = "") -> list[Feed]:
+        return await self.read(lambda conn: db.get_subs_list(conn, feed_id))
+
+    async def get_news_by_feed(self, feed_id: str, limit: int) -> list[FeedEntry]:
+        return await self.read(db.get_news_by_feed, feed_id, limit)
+
+    async def update_entries(self, feed_id: str, entries: list[FeedEntry]) -> None:
+        await self.write(db.update_entries, feed_id, entries)
+
+    async def read_unread_news(self, feed_id: str, limit: int) -> list[FeedEntry]:
+        """会把消息标记为已读，因此是写操作。"""
+        return await self.write(db.read_unread_news, feed_id, limit)
@@ -0,0 +1,96 @@
+"""在线备份
+
+使用 SQLite 的备份 API (sqlite3.Connection.backup), 每次只复制一部分数据页，
+复制之间短暂休息，因此不会长时间锁住数据库，即使正在更新订阅 (比如 cron 定时执行
+'ago news -u all') 也可以安全地备份。如果备份过程中数据库被修改，SQLite 会自动从头复制，
+得到的总是某一时刻的完整快照。
+
+每次备份在目标文件夹中新建一个以时间命名的子文件夹，包含 pypelago.db, pypelago-news.db
+以及 pypelago-archive.db (如果有)。先写入临时文件夹，全部完成后再改名，
+因此未完成的备份不会被当作正常的备份。可选择只保留最近的 N 次备份。
+"""
+
+from pathlib import Path
+import re
+import shutil
+import sqlite3
+from typing import Final
+import arrow
+from result import Err, Ok, Result
+from . import db
+from .retention import archive_path
+
+StepPages: Final[int] = 1024  # 每一步复制多少页 (默认页大小 4 KB, 即 4 MB)
+StepSleep: Final[float] = 0.05  # 每一步之后休息几秒，让其他连接有机会写入
+ProgressStep: Final[int] = 10  # 每完成百分之几打印一次进度
+
+StampFormat: Final[str] = "YYYYMMDD-HHmmss"
+StampPattern: Final = re.compile(r"^\d{8}-\d{6}$")
+PartialSuffix: Final[str] = ".partial"
+
+
+def source_files() -> list[Path]:
+    return [p for p in (db.db_path, db.news_path, archive_path) if p.exists()]
+
+
+def backup_file(src_path: Path, dst_path: Path, verbose: bool = False) -> None:
+    last = -ProgressStep
+
+    def progress(_status: int, remaining: int, total: int) -> None:
+        nonlocal last
+        percent = (total - remaining) * 100 // total if total else 100
+        if verbose and percent >= last + ProgressStep:
+            print(f"  {src_path.name}: {percent}% ({total - remaining}/{total} pages)")
+            last = percent
+
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=StepPages, progress=progress, sleep=StepSleep)
+    finally:
+        dst.close()
+        src.close()
+
+
+def backup_all(dest: str, keep: int = 0, verbose: bool = False) -> Result[Path, str]:
+    """备份到 dest/<时间>/, 返回该文件夹。keep > 0 时只保留最近的 keep 次备份。"""
+    dest_dir = Path(dest)
+    if dest_dir.exists() and not dest_dir.is_dir():
+        return Err(f"Not a directory: {dest_dir}")
+
+    target = dest_dir.joinpath(arrow.now().format(StampFormat))
+    if target.exists():
+        return Err(f"Exists: {target}")
+    partial = target.with_name(target.name + PartialSuffix)
+    partial.mkdir(parents=True, exist_ok=True)
+
+    try:
+        for src_path in source_files():
+            if verbose:
+                print(f"Backing up {src_path} ...")
+            backup_file(src_path, partial.joinpath(src_path.name), verbose)
+    except sqlite3.Error as e:
+        shutil.rmtree(partial)
+        return Err(str(e))
+
+    partial.rename(target)
+    for old in rotate(dest_dir, keep):
+        if verbose:
+            print(f"Removed old backup {old}")
+    return Ok(target)
+
+
+def list_backups(dest_dir: Path) -> list[Path]:
+    """从旧到新排列，只包括已完成的备份。"""
+    dirs = [p for p in dest_dir.iterdir() if p.is_dir() and StampPattern.match(p.name)]
+    return sorted(dirs, key=lambda p: p.name)
+
+
+def rotate(dest_dir: Path, keep: int) -> list[Path]:
+    """删除较早的备份，只保留最近的 keep 次，返回被删除的文件夹。keep <= 0 时不删除。"""
+    if keep <= 0:
+        return []
+    old = list_backups(dest_dir)[:-keep]
+    for p in old:
+        shutil.rmtree(p)
+    return old
@@ -0,0 +1,856 @@
+"""性能测试工具
+
+生成一个包含大量消息的临时数据库 (合成数据)，然后对 stmt.py 中的每条 SQL
+执行 'EXPLAIN QUERY PLAN' 并计时，如果某条 SQL 对大表进行全表扫描或
+使用临时 B-tree 排序，则视为不合格。
+
+用法: ago db -explain (或 python -m ipelago.bench)
+
+另外 'ago db -bench-compress' 比较订阅消息内容压缩前后的数据库体积与读取速度，
+'ago db -bench-atom' 比较生成 atom.xml 时挑选消息的两种方法，
+'ago db -bench-publish' 测试发布 (生成 HTML/RSS) 的耗时、写入量及内存峰值。
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import io
+from itertools import islice
+import multiprocessing
+from pathlib import Path
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from typing import Final, Iterator
+from . import compress
+from . import db
+from . import model
+from . import publish
+from . import stmt
+from .migrate import migrate
+from .model import (
+    Bucket,
+    FavBucketID,
+    Feed,
+    FeedEntry,
+    FeedSizeLimit,
+    PrivateBucketID,
+    PublicBucketID,
+    byte_len,
+)
+from .shortid import base_repr, str36
+
+Conn = sqlite3.Connection
+
+DefaultEntries: Final[int] = 100_000
+FeedsN: Final[int] = 50
+TagsN: Final[int] = 2000
+Years: Final[int] = 3
+
+# 这些表很小 (行数与订阅源数量相当)，全表扫描也不要紧。
+SmallTables: Final[set[str]] = {
+    "feed",
+    "metadata",
+    "sqlite_master",
+    "expired",
+    "content_dict",  # 通常只有一个字典
+}
+
+# 已知无法避免全表扫描或临时排序的 SQL, 以及原因。修复后应从这里删除。
+KnownIssues: Final[dict[str, str]] = {
+    "Count_entry_content": "substring LIKE '%x%' is checked on every row",
+    "Count_news_content": "substring LIKE '%x%' is checked on every row",
+    "Search_entry_content": "substring LIKE '%x%' is checked on every row",
+    "Get_by_tag": "sorts the entries of one tag by published",
+    "Get_by_tag_bucket": "sorts the entries of one tag by published",
+    "Get_all_tags": "pages through every tag (LIMIT/OFFSET)",
+    "Get_all_tags_by_count": "pages through every tag (LIMIT/OFFSET)",
+    "Get_all_tags_by_recent": "pages through every tag (LIMIT/OFFSET)",
+    "Count_all_tags": "counts every tag",
+    "Get_tags_by_prefix_by_count": "sorts the tags of one prefix by count",
+    "Get_tags_by_prefix_by_recent": "sorts the tags of one prefix by last_used",
+    "Get_tags_contain": "substring LIKE '%x%' is checked on every tag",
+    "Get_tags_contain_by_count": "substring LIKE '%x%' is checked on every tag",
+    "Get_tags_contain_by_recent": "substring LIKE '%x%' is checked on every tag",
+    "Fill_tag_dict": "rebuilds tag_dict from the whole tag table",
+    "Archive_expired_tag_dict": "groups the tags of expired entries only",
+    "Export_news_entries": "exports every news entry",
+}
+
+# 只检查这几种 SQL, 其他的 (比如 CREATE, PRAGMA, SQL 片段) 跳过。
+StatementPrefixes: Final[tuple[str, ...]] = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+@dataclass
+class PlanResult:
+    name: str
+    plan: list[str]
+    full_scan: list[str]  # 被全表扫描的表
+    temp_btree: list[str]
+    seconds: float
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not (self.full_scan or self.temp_btree or self.error)
+
+
+def rfc3339(dt: datetime) -> str:
+    return dt.isoformat(timespec="seconds")
+
+
+def random_dates(n: int, seed: int = 0) -> list[str]:
+    """在最近 Years 年内生成 n 个不重复的时间，从旧到新排序。"""
+    rng = random.Random(seed)
+    tz = timezone(timedelta(hours=8))
+    end = datetime(2026, 1, 1, tzinfo=tz)
+    span = Years * 365 * 24 * 3600
+    seconds = sorted(rng.sample(range(span), n))
+    return [rfc3339(end - timedelta(seconds=span - s)) for s in seconds]
+
+
+def tag_name(i: int) -> str:
+    return f"tag{base_repr(i, 36).lower()}"
+
+
+def random_tags(rng: random.Random) -> list[str]:
+    """大致符合 Zipf 分布，少数标签被大量使用。"""
+    k = rng.choice([0, 0, 1, 1, 1, 2, 2, 3])
+    return list({tag_name(int(rng.paretovariate(1.0)) % TagsN) for _ in range(k)})
+
+
+def random_content(rng: random.Random, tags: list[str]) -> str:
+    words = ["ipelago", "microblog", "python", "sqlite", "rss", "feed", "hello"]
+    n = rng.randint(3, 60)
+    body = " ".join(rng.choice(words) for _ in range(n))
+    return body + "".join(f" #{tag} " for tag in tags)
+
+
+def iter_synthetic(n: int, seed: int = 0) -> Iterator[tuple[dict, list[str]]]:
+    """生成 (entry, tags), 约 60% 订阅消息，20% 公开，10% 隐私，10% 收藏。"""
+    rng = random.Random(seed)
+    buckets = [Bucket.News] * 6 + [Bucket.Public] * 2 + [Bucket.Private, Bucket.Fav]
+    bucket_ids = {
+        Bucket.Public: PublicBucketID,
+        Bucket.Private: PrivateBucketID,
+        Bucket.Fav: FavBucketID,
+    }
+    for i, published in enumerate(random_dates(n, seed)):
+        bucket = rng.choice(buckets)
+        if bucket is Bucket.News:
+            feed_n = rng.randrange(FeedsN)
+            entry = dict(
+                id=f"{base_repr(i, 36)}-N",
+                content=random_content(rng, []),
+                link=f"https://example.com/{i}",
+                published=published,
+                feed_id=f"feed{feed_n}",
+                feed_name=f"Feed {feed_n}",
+                bucket=bucket.name,
+                unread=int(rng.random() < 0.05),
+                dup=0,
+            )
+            entry |= model.story_keys(entry["id"], entry["content"], entry["link"])
+            yield entry, []
+        else:
+            tags = random_tags(rng)
+            entry = dict(
+                id=str36(int(published[:4]), i),
+                content=random_content(rng, tags),
+                link="",
+                published=published,
+                feed_id=bucket_ids[bucket],
+                feed_name="",
+                bucket=bucket.name,
+            )
+            yield entry, tags
+
+
+def create_news_db(path: Path) -> None:
+    with sqlite3.connect(path) as news_conn:
+        news_conn.execute(stmt.Set_auto_vacuum_incremental)
+        news_conn.executescript(stmt.Create_news_tables)
+        migrate(news_conn, verbose=False, news=True)
+    news_conn.close()
+
+
+def init_bench_db(path: Path) -> Conn:
+    """创建一个与正式数据库结构相同的空数据库 (包括 FeedsN 个订阅源)。
+
+    订阅消息与正式环境一样保存在同一目录下的 news 数据库中。
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(stmt.Set_auto_vacuum_incremental)
+    conn.executescript(stmt.Create_tables)
+    news_path = path.with_name(db.news_filename)
+    create_news_db(news_path)
+    conn.execute(stmt.Attach_news, (str(news_path),))
+    migrate(conn, verbose=False)
+    compress.register(conn)
+    db.init_cfg(conn)
+    db.init_current_id(conn)
+    db.init_my_feeds("Benchmark", conn)
+    for i in range(FeedsN):
+        conn.execute(
+            stmt.Insert_feed,
+            dict(
+                id=f"feed{i}",
+                feed_link=f"https://example.com/feed{i}.xml",
+                website="",
+                title=f"Feed {i}",
+                author_name="",
+                updated=rfc3339(datetime.now(timezone.utc)),
+                notes="",
+                parser="Base",
+            ),
+        )
+    return conn
+
+
+def new_bench_db(path: Path, n: int = DefaultEntries, seed: int = 0) -> Conn:
+    """创建一个与正式数据库结构相同的数据库，并填充 n 条合成消息。"""
+    conn = init_bench_db(path)
+    tags: list[dict] = []
+    entries: list[dict] = []
+    news: list[dict] = []
+    for entry, entry_tags in iter_synthetic(n, seed):
+        if entry["bucket"] == Bucket.News.name:
+            news.append(entry)
+        else:
+            entries.append(entry)
+        tags.extend({"name": name, "entry_id": entry["id"]} for name in entry_tags)
+        if len(entries) + len(news) >= 10_000:
+            conn.executemany(stmt.Insert_entry, entries)
+            conn.executemany(stmt.Insert_news_entry, news)
+            conn.executemany(stmt.Insert_tag, tags)
+            entries, news, tags = [], [], []
+    conn.executemany(stmt.Insert_entry, entries)
+    conn.executemany(stmt.Insert_news_entry, news)
+    conn.executemany(stmt.Insert_tag, tags)
+    conn.execute(stmt.Fill_tag_dict)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def sample_values(conn: Conn) -> dict:
+    """各参数名对应的示例值 (取自合成数据)。"""
+    mine = conn.execute(stmt.Get_entries_limit, {"bucket": "Public", "limit": 1})
+    news = conn.execute(stmt.Get_news_limit, {"limit": 1})
+    my_id = mine.fetchone()["id"]
+    news_row = news.fetchone()
+    feed_id = conn.execute(stmt.Get_subs_list).fetchone()["id"]
+    tag = conn.execute(stmt.Get_all_tags_by_count, {"limit": 1, "offset": 0})
+    tag_row = tag.fetchone()
+    return dict(
+        id=my_id,
+        oldid=news_row["id"],
+        newid=my_id + "Z",
+        entry_id=my_id,
+        feed_id=feed_id,
+        feed_name="Feed",
+        feed_link="https://example.com/new",
+        name=tag_row["name"] if tag_row else "tag1",
+        lower="tag1",
+        upper="tag2",
+        last_used=news_row["published"],
+        published=news_row["published"],
+        bucket=Bucket.News.name,
+        content="sqlite",
+        title="Feed",
+        limit=9,
+        offset=0,
+        count=100,
+        value="",
+        parser="Base",
+        updated=news_row["published"],
+        # LIKE 的参数与 db.py 中的用法相同: 按日期是前缀匹配，其他是包含匹配。
+        like_published=news_row["published"][:7] + "%",
+        like_content="%sqlite%",
+        like_title="%Feed%",
+        like_name="%tag1%",
+    )
+
+
+NamedParam: Final = re.compile(r"(?<!:)(LIKE\s+)?:([A-Za-z_]\w*)")
+PositionalParam: Final = re.compile(r"(?:(\w+)\s*(=|LIKE)\s*)?\?")
+
+
+def sample_of(name: str, op: str, samples: dict) -> str:
+    if op.strip().upper() == "LIKE":
+        name = "like_" + name
+    return samples.get(name, "x")
+
+
+def statement_params(query: str, samples: dict) -> dict | tuple:
+    """根据参数名 (或 '?' 前面的列名) 选取示例值，LIKE 的参数带有通配符。
+
+    INSERT 使用新的 id 与标签名，以免违反唯一约束。
+    """
+    if query.upper().startswith("INSERT"):
+        samples = samples | dict(id="NEW-ID", name="new-tag")
+    names = NamedParam.findall(query)
+    if names:
+        return {name: sample_of(name, op, samples) for op, name in names}
+    params = PositionalParam.findall(query)
+    return tuple(sample_of(col, op, samples) for col, op in params)
+
+
+def statements() -> Iterator[tuple[str, str]]:
+    """Return (name, query) of every SQL statement constant in stmt.py."""
+    for name, value in vars(stmt).items():
+        if not name[0].isupper() or not isinstance(value, str):
+            continue
+        query = value.strip()
+        if "{" in query or not query.upper().startswith(StatementPrefixes):
+            continue  # 模板、DDL 等
+        yield name, query
+
+
+# 表名可能带有数据库名，比如 news.entry. 'SCAN ... USING [COVERING] INDEX' 没有
+# 约束条件，只是按索引的顺序逐行读取，同样是全表扫描 (有约束条件的是 SEARCH)，
+# 但部分索引 (CREATE INDEX ... WHERE) 只包含符合条件的行，扫描它不算全表扫描。
+ScanPattern: Final = re.compile(
+    r"^SCAN (?:\w+\.)?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+)| USING|$)"
+)
+
+
+def partial_indexes(conn: Conn) -> set[str]:
+    names = set()
+    for row in conn.execute(stmt.Get_database_list).fetchall():
+        query = stmt.Get_partial_indexes.format(schema=row[1])
+        names.update(r[0] for r in conn.execute(query))
+    return names
+
+
+def check_statement(
+    name: str, query: str, samples: dict, conn: Conn, partial: set[str] = set()
+) -> PlanResult:
+    param = statement_params(query, samples)
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + query, param).fetchall()
+    except sqlite3.Error as e:
+        return PlanResult(name, [], [], [], 0, error=str(e))
+
+    plan = [row["detail"] for row in rows]
+    full_scan = []
+    for detail in plan:
+        m = ScanPattern.match(detail)
+        if m and m.group(1) not in SmallTables and m.group(2) not in partial:
+            full_scan.append(m.group(1))
+    temp_btree = [d for d in plan if "TEMP B-TREE" in d]
+
+    # 在事务中执行再回滚，这样写操作也能计时而不会改变数据。
+    start = time.perf_counter()
+    try:
+        conn.execute("SAVEPOINT bench")
+        conn.execute(query, param).fetchall()
+    except sqlite3.Error as e:
+        return PlanResult(name, plan, full_scan, temp_btree, 0, error=str(e))
+    finally:
+        conn.execute("ROLLBACK TO bench")
+        conn.execute("RELEASE bench")
+    seconds = time.perf_counter() - start
+    return PlanResult(name, plan, full_scan, temp_btree, seconds)
+
+
+def prepare_context(conn: Conn, archive_path: Path) -> None:
+    """有些 SQL 需要临时表 expired 与归档数据库。"""
+    conn.execute(stmt.Create_temp_expired)
+    with sqlite3.connect(archive_path) as archive:
+        archive.executescript(stmt.Create_tables)
+        migrate(archive, verbose=False)
+    archive.close()
+    conn.commit()
+    conn.execute(stmt.Attach_archive, (str(archive_path),))
+
+
+def explain_all(conn: Conn, tmp_dir: Path) -> list[PlanResult]:
+    prepare_context(conn, tmp_dir.joinpath("archive.db"))
+    samples = sample_values(conn)
+    partial = partial_indexes(conn)
+    return [
+        check_statement(name, query, samples, conn, partial)
+        for name, query in statements()
+    ]
+
+
+def print_results(results: list[PlanResult], verbose: bool) -> int:
+    """Return the number of failed statements (不包括 KnownIssues)."""
+    failed = 0
+    for r in results:
+        if r.ok:
+            status = "ok"
+        elif r.name in KnownIssues:
+            status = "known"
+        else:
+            status = "FAIL"
+            failed += 1
+        print(f"{status:5} {r.seconds * 1000:9.3f} ms  {r.name}")
+        if r.error:
+            print(f"      error: {r.error}")
+        if status == "FAIL" or verbose:
+            if r.full_scan:
+                print(f"      full scan: {', '.join(r.full_scan)}")
+            for detail in r.plan:
+                print(f"      | {detail}")
+        if status == "known" and verbose:
+            print(f"      ({KnownIssues[r.name]})")
+
+    print(f"\n{len(results)} statements, {failed} failed.")
+    return failed
+
+
+def run_explain(n: int = DefaultEntries, verbose: bool = False) -> int:
+    """Return the number of failed statements."""
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        print(f"Creating a synthetic database with {n} entries ...")
+        start = time.perf_counter()
+        conn = new_bench_db(tmp_dir.joinpath(db.db_filename), n)
+        print(f"Done in {time.perf_counter() - start:.1f}s\n")
+        results = explain_all(conn, tmp_dir)
+        conn.close()
+    return print_results(results, verbose)
+
+
+CompressVariants: Final[list[str]] = ["plain", "zlib", "zlib+dict"]
+LookupN: Final[int] = 1000
+
+
+@dataclass
+class CompressResult:
+    variant: str
+    size: int  # bytes
+    lookup_us: float  # 按 id 读取一条消息 (含解压) 的平均耗时
+    scan_ms: float  # 搜索全部消息内容 (每条都要解压) 的耗时
+
+
+def news_samples(n: int) -> list[dict]:
+    """优先使用真实的订阅消息 (如果有的话)，否则使用合成数据。"""
+    if db.news_path.exists():
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        conn.execute(stmt.Attach_news, (str(db.news_path),))
+        compress.register(conn)
+        rows = conn.execute(stmt.Get_news_limit, {"limit": n}).fetchall()
+        conn.close()
+        if len(rows) >= compress.MinTrainSamples:
+            print(f"Using {len(rows)} entries from {db.news_path}")
+            return [
+                dict(row) | {"content": compress.unpack(row["content"])} for row in rows
+            ]
+
+    print(f"Using {n} synthetic news entries")
+    entries = (entry for entry, _ in iter_synthetic(n * 2))
+    return [e for e in entries if e["bucket"] == Bucket.News.name][:n]
+
+
+def new_news_db(path: Path, entries: list[dict]) -> Conn:
+    create_news_db(path)
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.executescript(stmt.Create_tables)  # 订阅消息需要引用 main.feed
+    conn.execute(stmt.Attach_news, (str(path),))
+    migrate(conn, verbose=False)
+    compress.register(conn)
+    with conn:
+        conn.executemany(stmt.Insert_news_entry, entries)
+    return conn
+
+
+def compress_variant(variant: str, conn: Conn) -> None:
+    if variant == "zlib":
+        # 不使用字典，每条消息单独压缩 (仅用于对比)
+        rows = conn.execute(stmt.Get_news_content_batch, {"rowid": 0, "limit": -1})
+        params = [
+            {"rowid": row[0], "content": compress.compress(row[1], compress.NoDict)}
+            for row in rows
+        ]
+        with conn:
+            conn.executemany(stmt.Update_news_content, params)
+    elif variant == "zlib+dict":
+        compress.new_dict(conn).unwrap()
+        compress.repack_all(conn)
+
+
+def bench_compress_variant(
+    variant: str, entries: list[dict], tmp_dir: Path
+) -> CompressResult:
+    path = tmp_dir.joinpath(f"news-{variant.replace('+', '-')}.db")
+    conn = new_news_db(path, entries)
+    compress_variant(variant, conn)
+    conn.execute("VACUUM news")
+    size = path.stat().st_size
+
+    rng = random.Random(0)
+    ids = [rng.choice(entries)["id"] for _ in range(LookupN)]
+    start = time.perf_counter()
+    for entry_id in ids:
+        row = conn.execute("SELECT * FROM news.entry WHERE id=?", (entry_id,)).fetchone()
+        model.new_entry_from(row)
+    lookup_us = (time.perf_counter() - start) / LookupN * 1_000_000
+
+    start = time.perf_counter()
+    conn.execute(stmt.Count_news_content, {"content": "%sqlite%"}).fetchone()
+    scan_ms = (time.perf_counter() - start) * 1000
+    conn.close()
+    return CompressResult(variant, size, lookup_us, scan_ms)
+
+
+def run_compress(n: int = DefaultEntries) -> list[CompressResult]:
+    entries = news_samples(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            bench_compress_variant(variant, entries, Path(tmp))
+            for variant in CompressVariants
+        ]
+
+    plain = results[0].size
+    print(f"\n{'variant':10} {'size':>10} {'ratio':>6} {'lookup':>12} {'scan':>10}")
+    for r in results:
+        print(
+            f"{r.variant:10} {r.size / 1024 / 1024:8.2f}MB {r.size / plain:6.2f}"
+            f" {r.lookup_us:9.1f} us {r.scan_ms:7.1f} ms"
+        )
+    return results
+
+
+AtomFeedsN: Final[int] = 50  # 生成多少个 RSS 进行比较
+
+
+@dataclass
+class AtomResult:
+    method: str
+    ms: float  # 平均每个 RSS 的耗时
+    entries: float  # 平均每个 RSS 包含的消息条数
+    size: float  # 平均体积 (KB, UTF-8)
+    over_limit: int  # 超出 FeedSizeLimit 的 RSS 个数
+
+
+def random_long_content(rng: random.Random) -> str:
+    """中英文混合的消息，长度接近 EntrySizeLimit, 使 RSS 超出体积上限。"""
+    words = ["ipelago", "微博客", "python", "数据库", "rss", "订阅", "你好世界"]
+    content = ""
+    limit = rng.randint(model.EntrySizeLimit * 3 // 4, model.EntrySizeLimit)
+    while True:
+        word = rng.choice(words) + " "
+        if byte_len(content + word) > limit:
+            return content.strip()
+        content += word
+
+
+def atom_samples(seed: int = 0) -> list[list[FeedEntry]]:
+    rng = random.Random(seed)
+    samples = []
+    for i in range(AtomFeedsN):
+        dates = random_dates(publish.atom_entries_limit, seed + i)
+        entries = [
+            FeedEntry(
+                entry_id=str36(2025, j),
+                content=random_long_content(rng),
+                link="",
+                published=published,
+                feed_id=PublicBucketID,
+                feed_name="",
+                bucket=Bucket.Public.name,
+            )
+            for j, published in enumerate(reversed(dates))
+        ]
+        samples.append(entries)
+    return samples
+
+
+def render_atom_halving(feed: Feed, entries: list[FeedEntry]) -> str:
+    """旧的方法 (仅用于对比): 整个 RSS 超出上限 (按字符数计算) 时，消息减半再全部重新渲染。"""
+    tmpl = publish.get_jinja_env("").get_template(publish.atom_xml)
+    while True:
+        context = dict(feed_uuid=publish.get_feed_uuid(feed), feed=feed)
+        rss = tmpl.render(context | dict(entries=entries))
+        if len(rss) <= FeedSizeLimit:
+            return rss
+        entries = entries[: len(entries) // 2]
+
+
+def render_atom_fit(feed: Feed, entries: list[FeedEntry]) -> str:
+    return publish.render_atom_rss("", publish.atom_xml, feed, entries)
+
+
+def check_atom_fit(feed: Feed, entries: list[FeedEntry], rss: str) -> bool:
+    """检查挑选结果是否最优: 不超出上限，并且再多一条消息就会超出。"""
+    n = rss.count("<entry>")
+    if byte_len(rss) > FeedSizeLimit:
+        return False
+    if n == len(entries):
+        return True
+    tmpl = publish.get_jinja_env("").get_template(publish.atom_xml)
+    context = dict(feed_uuid=publish.get_feed_uuid(feed), feed=feed)
+    more = tmpl.render(context | dict(entries=entries[: n + 1]))
+    return byte_len(more) > FeedSizeLimit
+
+
+def run_atom() -> list[AtomResult]:
+    """Return the results of the old and the new method."""
+    feed = Feed(
+        feed_id=PublicBucketID,
+        feed_link="https://example.com/atom.xml",
+        website="https://example.com",
+        title="Bench",
+        author_name="Bench",
+        updated=rfc3339(datetime.now(timezone.utc)),
+    )
+    samples = atom_samples()
+    methods = [("halving", render_atom_halving), ("fit", render_atom_fit)]
+    results = []
+    not_optimal = 0
+    for method, render in methods:
+        render(feed, samples[0])  # 预热 (编译模板)
+        start = time.perf_counter()
+        outputs = [render(feed, entries) for entries in samples]
+        seconds = time.perf_counter() - start
+        sizes = [byte_len(rss) for rss in outputs]
+        results.append(
+            AtomResult(
+                method=method,
+                ms=seconds / len(samples) * 1000,
+                entries=sum(rss.count("<entry>") for rss in outputs) / len(samples),
+                size=sum(sizes) / len(samples) / 1024,
+                over_limit=sum(size > FeedSizeLimit for size in sizes),
+            )
+        )
+        if method == "fit":
+            not_optimal = sum(
+                not check_atom_fit(feed, entries, rss)
+                for entries, rss in zip(samples, outputs)
+            )
+
+    print(f"{len(samples)} feeds, {publish.atom_entries_limit} entries each,", end="")
+    print(f" limit {FeedSizeLimit / 1024:.0f} KB\n")
+    print(f"{'method':8} {'time':>10} {'entries':>8} {'size':>9} {'over':>5}")
+    for r in results:
+        print(
+            f"{r.method:8} {r.ms:7.2f} ms {r.entries:8.1f} {r.size:6.1f} KB"
+            f" {r.over_limit:5}"
+        )
+    print(f"\nNot optimal: {not_optimal}")
+    return results
+
+
+# 自带的模板、复制的模板文件夹 (相当于 '-tmpl')
+PublishVariants: Final[list[str]] = ["default", "custom"]
+PublishScenarios: Final[list[str]] = ["full", "no-op", "one-post"]
+PublishSizes: Final[list[int]] = [10_000, 100_000, 1_000_000]
+
+
+@dataclass
+class PublishResult:
+    templates: str
+    scenario: str
+    seconds: float
+    files: int  # 实际写入的文件数
+    size: int  # 实际写入的字节数
+    peak: int  # 进程的内存峰值 (bytes), 包括 Python 及各模块本身
+    publish_mem: int  # 其中发布所增加的部分 (峰值减去发布前的内存)
+
+
+def iter_public(n: int, seed: int = 0) -> Iterator[tuple[dict, list[str]]]:
+    """生成 n 条公开消息 (entry, tags)，约 10% 是接近体积上限的中英文长消息。"""
+    rng = random.Random(seed)
+    for i, published in enumerate(random_dates(n, seed)):
+        tags = random_tags(rng)
+        if rng.random() < 0.1:
+            tags = []
+            content = random_long_content(rng)
+        else:
+            content = random_content(rng, tags)
+        entry = dict(
+            id=str36(int(published[:4]), i),
+            content=content,
+            link="",
+            published=published,
+            feed_id=PublicBucketID,
+            feed_name="",
+            bucket=Bucket.Public.name,
+        )
+        yield entry, tags
+
+
+def new_public_db(path: Path, n: int, seed: int = 0) -> Conn:
+    """创建一个只有 n 条公开消息的数据库，并填写发布所需的微博客信息。"""
+    conn = init_bench_db(path)
+    conn.execute(stmt.Update_my_feed_title, ("Bench",))
+    conn.execute(stmt.Update_my_feed_author, ("Bench",))
+    conn.execute(stmt.Update_my_feed_link, ("https://example.com/atom.xml",))
+    conn.execute(stmt.Update_my_feed_website, ("https://example.com",))
+    items = iter_public(n, seed)
+    while batch := list(islice(items, 10_000)):
+        conn.executemany(stmt.Insert_entry, [entry for entry, _ in batch])
+        conn.executemany(
+            stmt.Insert_tag,
+            [{"name": tag, "entry_id": e["id"]} for e, tags in batch for tag in tags],
+        )
+    conn.execute(stmt.Fill_tag_dict)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def add_public_post(k: int, conn: Conn) -> None:
+    """发布一条比全部合成消息都新的消息 (与 'ago post' 一样更新 feed.updated)。"""
+    entry = dict(
+        id=str36(2026, k),
+        content=f"new post {k} #bench ",
+        link="",
+        published=rfc3339(datetime(2026, 1, 1, k, tzinfo=timezone.utc)),
+        feed_id=PublicBucketID,
+        feed_name="",
+        bucket=Bucket.Public.name,
+    )
+    conn.execute(stmt.Insert_entry, entry)
+    conn.execute(stmt.Insert_tag, {"name": "bench", "entry_id": entry["id"]})
+    conn.commit()
+    db.update_my_feed_date(conn)
+
+
+def snapshot(folder: Path) -> dict[str, tuple[int, int, int]]:
+    """{文件名: (inode, 修改时间, 体积)}, 文件被写入 (替换) 后 inode 及修改时间都会改变。"""
+    files = {}
+    if folder.exists():
+        for f in folder.iterdir():
+            st = f.stat()
+            files[f.name] = (st.st_ino, st.st_mtime_ns, st.st_size)
+    return files
+
+
+def proc_status(name: str) -> int:
+    """读取 /proc/self/status 中的内存数值 (bytes), 比如 VmRSS, VmHWM (峰值)。"""
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(name + ":"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def reset_peak_rss() -> bool:
+    """Linux 可以重置进程的内存峰值 (VmHWM)，其他系统返回 False."""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def publish_once(
+    db_path: str, tmpl_folder: str, dst_dir: str
+) -> tuple[float, int, int]:
+    """在 bench_publish 新建的进程中执行，返回 (耗时, 内存峰值, 发布所增加的内存)。
+
+    进程启动 (导入各模块) 时的峰值可能比发布时还高，因此发布前先重置峰值。
+    不能重置时 (非 Linux) 改用 tracemalloc, 只统计 Python 分配的内存，并且会使耗时增加。
+    使用单个进程渲染 (jobs=1)，这样内存峰值包括渲染的部分。
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    news_path = Path(db_path).with_name(db.news_filename)
+    conn.execute(stmt.Attach_news, (str(news_path),))
+    compress.register(conn)
+    limit = db.get_cfg(conn).unwrap()["web_page_n"]
+    use_rss = reset_peak_rss()
+    if not use_rss:
+        tracemalloc.start()
+    base = proc_status("VmRSS") if use_rss else 0
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        publish.publish_html_rss(
+            conn, limit, dst_dir, tmpl_folder, force=True, full=False, jobs=1
+        )
+    seconds = time.perf_counter() - start
+    if use_rss:
+        peak = proc_status("VmHWM")
+    else:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    conn.close()
+    return seconds, peak, peak - base
+
+
+def bench_publish(
+    templates: str, scenario: str, tmpl_folder: str, dst_dir: Path, db_path: Path
+) -> PublishResult:
+    """每种情况都在一个新的进程 (spawn) 中发布，这样各自的内存峰值互不影响。"""
+    before = snapshot(dst_dir)
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=spawn) as executor:
+        future = executor.submit(publish_once, str(db_path), tmpl_folder, str(dst_dir))
+        seconds, peak, publish_mem = future.result()
+
+    after = snapshot(dst_dir)
+    written = [name for name, info in after.items() if before.get(name) != info]
+    size = sum(after[name][2] for name in written)
+    return PublishResult(
+        templates, scenario, seconds, len(written), size, peak, publish_mem
+    )
+
+
+def run_publish(sizes: list[int] = PublishSizes) -> list[PublishResult]:
+    """对 n 条公开消息测试三种情况: 第一次发布、没有变化时再次发布、新增一条消息后再次发布。
+
+    每种情况分别使用自带的模板及复制的模板文件夹 (相当于 '-tmpl') 各测试一次。
+    sizes 中的每个 n 各用一个新的数据库。
+    """
+    results = []
+    for n in sizes:
+        results += run_publish_size(n)
+    return results
+
+
+def run_publish_size(n: int) -> list[PublishResult]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        print(f"Creating a synthetic database with {n} public entries ...")
+        start = time.perf_counter()
+        db_path = tmp_dir.joinpath(db.db_filename)
+        conn = new_public_db(db_path, n)
+        print(f"Done in {time.perf_counter() - start:.1f}s\n")
+
+        custom = tmp_dir.joinpath("templates")
+        shutil.copytree(publish.get_src_dir(""), custom)
+        folders = dict(default="", custom=str(custom))
+        for k, templates in enumerate(PublishVariants):
+            dst_dir = tmp_dir.joinpath(f"public-{templates}")
+            for scenario in PublishScenarios:
+                if scenario == "one-post":
+                    add_public_post(k, conn)
+                r = bench_publish(
+                    templates, scenario, folders[templates], dst_dir, db_path
+                )
+                results.append(r)
+                print_publish_result(r)
+        conn.close()
+    print()
+    return results
+
+
+def print_publish_result(r: PublishResult) -> None:
+    if r.templates == PublishVariants[0] and r.scenario == PublishScenarios[0]:
+        print(
+            f"{'templates':9} {'scenario':8} {'time':>9}"
+            f" {'written':>8} {'bytes':>10} {'peak mem':>10} {'publish':>10}"
+        )
+    print(
+        f"{r.templates:9} {r.scenario:8} {r.seconds:7.2f} s {r.files:8}"
+        f" {r.size / 1024 / 1024:7.2f} MB {r.peak / 1024 / 1024:7.1f} MB"
+        f" {r.publish_mem / 1024 / 1024:7.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(1 if run_explain() else 0)
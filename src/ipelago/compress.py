@@ -0,0 +1,170 @@
+"""订阅消息内容压缩
+
+订阅消息的内容 (每条最多 1 KB) 单独压缩效果很差，因为每条消息都太短了。
+采用共享字典 (zlib preset dictionary) 可以大幅提高压缩率：先从已有的消息中训练出字典，
+保存在 news 数据库的 content_dict 表中，以后每条消息都用该字典压缩。
+
+压缩是可选的，训练字典之前不压缩。压缩后的内容以 BLOB 保存在原来的 content 列中，
+开头两个字节是字典 id (0 表示不使用字典)，未压缩的内容仍是 TEXT, 因此新旧数据可以混合存在。
+
+写入时在 db.insert_entries 中压缩，读取时在 model.new_entry_from 中解压，
+SQL 中需要内容的地方 (比如搜索) 使用 unpack_content(content).
+"""
+
+from collections import Counter
+import re
+import sqlite3
+import struct
+from typing import Final, Iterable
+import zlib
+import arrow
+from result import Err, Ok, Result
+from . import stmt
+
+Conn = sqlite3.Connection
+
+Header: Final = struct.Struct(">H")  # 字典 id
+NoDict: Final[int] = 0
+Level: Final[int] = 9
+DictSize: Final[int] = 32 * 1024  # zlib 的窗口大小，字典再大也没用
+TrainSampleSize: Final[int] = 5000  # 训练字典时最多使用多少条消息
+MinTrainSamples: Final[int] = 100
+RepackBatchSize: Final[int] = 2000
+ProgressStep: Final[int] = 100_000  # 每处理多少行打印一次进度
+
+# 按空白及常见标点切分，得到的片段用于统计。
+Piece: Final = re.compile(r"[^\s,.;:!?，。；：！？、]+[\s,.;:!?，。；：！？、]*")
+
+_dicts: dict[int, bytes] = {}  # 已加载的字典 {id: zdict}
+_active: int = NoDict  # 压缩时使用的字典 id, NoDict 表示不压缩
+
+
+def load_dicts(conn: Conn) -> None:
+    global _active
+    _dicts.clear()
+    for row in conn.execute(stmt.Get_content_dicts):
+        _dicts[row[0]] = row[1]
+    _active = max(_dicts, default=NoDict)
+
+
+def register(conn: Conn) -> None:
+    """加载字典，并注册 SQL 函数 unpack_content."""
+    load_dicts(conn)
+    register_unpack(conn)
+
+
+def register_unpack(conn: Conn) -> None:
+    """只注册 SQL 函数，不加载字典 (比如归档数据库，其中的内容都未压缩)。"""
+    conn.create_function("unpack_content", 1, unpack, deterministic=True)
+
+
+def compress(text: str, dict_id: int, zdict: bytes | None = None) -> bytes:
+    data = text.encode()
+    if zdict is None:
+        return Header.pack(dict_id) + zlib.compress(data, Level)
+    c = zlib.compressobj(Level, zdict=zdict)
+    return Header.pack(dict_id) + c.compress(data) + c.flush()
+
+
+def pack(text: str) -> str | bytes:
+    """用当前字典压缩，如果未启用压缩或压缩后反而更大，则返回原文。"""
+    if _active == NoDict:
+        return text
+    data = compress(text, _active, _dicts[_active])
+    return data if len(data) < len(text.encode()) else text
+
+
+def unpack(content: str | bytes | None) -> str | None:
+    if not isinstance(content, bytes):
+        return content
+    (dict_id,) = Header.unpack_from(content)
+    if dict_id == NoDict:
+        return zlib.decompress(content[Header.size :]).decode()
+    d = zlib.decompressobj(zdict=_dicts[dict_id])
+    return (d.decompress(content[Header.size :]) + d.flush()).decode()
+
+
+def train_dict(samples: Iterable[str], size: int = DictSize) -> bytes:
+    """zlib 没有训练字典的功能，这里采用简单的方法:
+
+    统计在多条消息中重复出现的片段，按 (出现次数 × 长度) 排序，
+    越常用的片段越靠近字典末尾 (距离越近，编码越短)。
+    """
+    counter: Counter[str] = Counter()
+    for text in samples:
+        counter.update(set(Piece.findall(text)))
+
+    pieces = []
+    total = 0
+    by_score = sorted(counter.items(), key=lambda x: x[1] * len(x[0]), reverse=True)
+    for piece, count in by_score:
+        if count < 2:
+            break
+        n = len(piece.encode())
+        if total + n > size:
+            continue
+        pieces.append(piece)
+        total += n
+    return "".join(reversed(pieces)).encode()
+
+
+def new_dict(conn: Conn, sample_size: int = TrainSampleSize) -> Result[int, str]:
+    """从最近的订阅消息中训练字典并保存，返回新字典的 id."""
+    rows = conn.execute(stmt.Get_news_content_sample, {"limit": sample_size})
+    samples = [unpack(row[0]) for row in rows]
+    if len(samples) < MinTrainSamples:
+        return Err(f"Too few news entries to train a dictionary (< {MinTrainSamples})")
+
+    zdict = train_dict(samples)
+    with conn:
+        cursor = conn.execute(
+            stmt.Insert_content_dict,
+            {"zdict": zdict, "created": arrow.now().format("YYYY-MM-DD HH:mm:ss")},
+        )
+    load_dicts(conn)
+    return Ok(cursor.lastrowid)
+
+
+def need_repack(content: str | bytes) -> bool:
+    if isinstance(content, bytes):
+        return Header.unpack_from(content)[0] != _active
+    return _active != NoDict
+
+
+def repack_all(conn: Conn, verbose: bool = False) -> int:
+    """用当前字典重新压缩全部订阅消息 (未启用压缩时则全部解压)，返回处理的条数。
+
+    分批执行，每批一个事务。完成后删除不再使用的字典。
+    """
+    n = 0
+    rowid = 0
+    while True:
+        rows = conn.execute(
+            stmt.Get_news_content_batch, {"rowid": rowid, "limit": RepackBatchSize}
+        ).fetchall()
+        if not rows:
+            break
+        rowid = rows[-1][0]
+        params = [
+            {"rowid": row[0], "content": pack(unpack(row[1]))}
+            for row in rows
+            if need_repack(row[1])
+        ]
+        with conn:
+            conn.executemany(stmt.Update_news_content, params)
+        n_before = n
+        n += len(params)
+        if verbose and n // ProgressStep > n_before // ProgressStep:
+            print(f"updated {n} rows ...")
+
+    with conn:
+        conn.execute(stmt.Delete_content_dicts_except, {"id": _active})
+    load_dicts(conn)
+    return n
+
+
+def disable(conn: Conn, verbose: bool = False) -> int:
+    """解压全部订阅消息，并删除全部字典。"""
+    global _active
+    _active = NoDict
+    return repack_all(conn, verbose)
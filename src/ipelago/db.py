@@ -5,6 +5,7 @@ from typing import Any, Final, Iterable
 import arrow
 from result import Ok, Err, Result
 from appdirs import AppDirs
+from . import compress
 from . import model
 from .model import (
     OK,
@@ -16,7 +17,10 @@ from .model import (
     FeedEntry,
     PrivateBucketID,
     PublicBucketID,
+    TagClause,
+    extract_tags,
 )
+from .migrate import LatestVersion, get_schema_version, migrate
 from .shortid import first_id, parse_id
 from . import stmt
 
@@ -25,24 +29,72 @@ Day: Final[int] = 24 * Hour
 UpdateRateLimit: Final[int] = 1 * Day
 
 db_filename: Final[str] = "pypelago.db"
+news_filename: Final[str] = "pypelago-news.db"  # 订阅消息 (News) 另外保存
 app_config_name: Final[str] = "app-config"
 current_id_name: Final[str] = "current-id"
 
 app_dirs = AppDirs("pypelago", "github-ahui2016")
 app_config_dir = Path(app_dirs.user_config_dir)
 db_path = app_config_dir.joinpath(db_filename)
+news_path = app_config_dir.joinpath(news_filename)
 
 NoResultError = "database-no-result"
 
 Conn = sqlite3.Connection
 
+TagCount = tuple[str, int]  # (name, count)
+
+MinPrefixLen: Final[int] = 4  # 显示消息 ID 时，至少显示几个字符
+PrefixMatchLimit: Final[int] = 10  # 按前缀查找消息时，最多返回几条
+
 
 def connect_db() -> Conn:
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
+    attach_news(conn)
+    compress.register(conn)  # 迁移时可能需要解压
+    migrate(conn)
+    if get_schema_version(conn) is not None:  # 未初始化时没有 feed 表
+        load_feed_cache(conn)
     return conn
 
 
+def load_feed_cache(conn: Conn) -> None:
+    """订阅源很少，全部缓存起来，添加、删除、修改订阅源后需要重新加载。
+
+    先更新再删除多余的，不清空缓存，以免其他线程 (见 aiodb) 读取时找不到订阅源。
+    """
+    cache = {
+        row["key"]: (row["id"], row["title"])
+        for row in conn.execute(stmt.Get_feed_keys)
+    }
+    model.feed_cache.update(cache)
+    for key in model.feed_cache.keys() - cache.keys():
+        del model.feed_cache[key]
+
+
+def attach_news(conn: Conn) -> None:
+    """订阅消息保存在另一个数据库 (news) 中，与我的消息分开，
+
+    这样频繁更新订阅时不会影响我的消息所在的数据页，备份我的消息也更方便。
+    news 数据库只有 entry 相关的表 (见 stmt.Create_news_tables)。
+
+    只有新建的或版本较旧的 news 数据库才需要另开一个连接执行迁移。
+    """
+    conn.execute(stmt.Attach_news, (str(news_path),))
+    if get_schema_version(conn, "news") == LatestVersion:
+        return
+
+    conn.execute(stmt.Detach_news)
+    with sqlite3.connect(news_path) as news_conn:
+        if get_schema_version(news_conn) is None:
+            news_conn.execute(stmt.Set_auto_vacuum_incremental)
+            news_conn.executescript(stmt.Create_news_tables)
+        migrate(news_conn, verbose=False, news=True)
+    news_conn.close()
+    conn.execute(stmt.Attach_news, (str(news_path),))
+
+
 def connExec(
     conn: Conn, query: str, param: Iterable[Any], many: bool = False
 ) -> Result[int, str]:
@@ -87,10 +139,19 @@ def update_current_id(cid: str, conn: Conn) -> None:
 
 
 def get_next_id(conn: Conn) -> str:
+    return reserve_ids(1, conn)[0]
+
+
+def reserve_ids(n: int, conn: Conn) -> list[str]:
+    """一次预留 n 个 ID, 只需读写一次 current-id."""
     cid = get_current_id(conn).unwrap()
-    nid = parse_id(cid).next_id()
-    update_current_id(nid, conn)
-    return nid
+    ids = []
+    for _ in range(n):
+        cid = parse_id(cid).next_id()
+        ids.append(cid)
+    if ids:
+        update_current_id(ids[-1], conn)
+    return ids
 
 
 def init_current_id(conn: Conn) -> None:
@@ -130,7 +191,9 @@ def init_app(name: str) -> str:
     if db_path.exists():
         return "不可重复初始化"
     with connect_db() as conn:
+        conn.execute(stmt.Set_auto_vacuum_incremental)
         conn.executescript(stmt.Create_tables)
+        migrate(conn, verbose=False)
         init_cfg(conn)
         init_current_id(conn)
         init_my_feeds(name, conn)
@@ -179,9 +242,7 @@ def get_news_next(cursor: str, conn: Conn) -> Result[FeedEntry, str]:
     row = conn.execute(stmt.Get_news_next_entry, {"published": cursor}).fetchone()
     if not row:
         # 回到最新一条消息
-        row = conn.execute(
-            stmt.Get_entries_limit, {"bucket": Bucket.News.name, "limit": 1}
-        ).fetchone()
+        row = conn.execute(stmt.Get_news_limit, {"limit": 1}).fetchone()
 
     if not row:
         return Err(NoResultError)
@@ -189,20 +250,25 @@ def get_news_next(cursor: str, conn: Conn) -> Result[FeedEntry, str]:
     return Ok(model.new_entry_from(row))
 
 
+def date_range(date: str) -> dict:
+    """返回 {lower, upper}, 使 [lower, upper) 恰好包含以 date 开头的发布时间。"""
+    if not date:
+        return {"lower": "", "upper": "\U0010ffff"}
+    return {"lower": date, "upper": date[:-1] + chr(ord(date[-1]) + 1)}
+
+
 def get_by_date(date: str, limit: int, bucket: str, conn: Conn) -> list[FeedEntry]:
     result: list[FeedEntry] = []
-    for row in conn.execute(
-        stmt.Get_by_date, {"bucket": bucket, "published": date + "%", "limit": limit}
-    ):
+    param = date_range(date) | {"bucket": bucket, "limit": limit}
+    for row in conn.execute(stmt.Get_by_date, param):
         result.append(model.new_entry_from(row))
     return result
 
 
 def get_by_date_my_buckets(date: str, limit: int, conn: Conn) -> list[FeedEntry]:
     result: list[FeedEntry] = []
-    for row in conn.execute(
-        stmt.Get_by_date_my_buckets, {"published": date + "%", "limit": limit}
-    ):
+    param = date_range(date) | {"limit": limit}
+    for row in conn.execute(stmt.Get_by_date_my_buckets, param):
         result.append(model.new_entry_from(row))
     return result
 
@@ -211,8 +277,7 @@ def count_by_date_buckets(date: str, buckets: list[str], conn: Conn) -> int:
     total = 0
     for bucket in buckets:
         row = conn.execute(
-            stmt.Count_by_date,
-            {"bucket": bucket, "published": date + "%"},
+            stmt.Count_by_date, date_range(date) | {"bucket": bucket}
         ).fetchone()
         if row:
             total += row[0]
@@ -230,13 +295,8 @@ def count_all_entries(buckets: list[str], conn: Conn) -> int:
     return total
 
 
-def get_public_limit(cursor: str, limit: int, conn: Conn) -> list[FeedEntry]:
-    result: list[FeedEntry] = []
-    for row in conn.execute(
-        stmt.Get_public_limit, {"published": cursor, "limit": limit}
-    ):
-        result.append(model.new_entry_from(row))
-    return result
+def count_news_by_feed(feed_id: str, conn: Conn) -> int:
+    return conn.execute(stmt.Count_news_by_feed_id, (feed_id,)).fetchone()[0]
 
 
 def get_news_by_feed(feed_id: str, limit: int, conn: Conn) -> list[FeedEntry]:
@@ -313,9 +373,46 @@ def check_before_update_one(
                 )
 
 
-def insert_entries(entries: list[FeedEntry], conn: Conn) -> None:
+def insert_entries(
+    entries: list[FeedEntry], conn: Conn, read_links: set[str] | None = None
+) -> None:
+    """插入订阅消息 (保存在 news 数据库中，如已训练字典则压缩内容)。
+
+    新消息标记为未读，但 read_links 中的链接视为已读 (更新订阅源时保留已读状态)。
+    """
+    read_links = read_links or set()
     item_list = [entry.to_dict() for entry in entries]
-    conn.executemany(stmt.Insert_entry, item_list)
+    seen: dict[str, str] = {}  # 本批消息的 {link_hash 或 fingerprint: story}
+    for item in item_list:
+        item |= find_story(item, seen, conn)
+        item["content"] = compress.pack(item["content"])
+        # 重复消息不进入未读队列
+        item["unread"] = 0 if item["dup"] or item["link"] in read_links else 1
+    conn.executemany(stmt.Insert_news_entry, item_list)
+    for feed_id in {entry.feed_id for entry in entries}:
+        conn.execute(stmt.Refresh_feed_unread, (feed_id,))
+
+
+def find_story(item: dict, seen: dict[str, str], conn: Conn) -> dict:
+    """如果已有同一篇文章 (链接或内容相同) 的主消息，则作为其重复消息。"""
+    keys = model.story_keys(item["id"], item["content"], item["link"])
+    hashes = [h for h in (keys["link_hash"], keys["fingerprint"]) if h]
+    story = next((seen[h] for h in hashes if h in seen), None)
+    if story is None and hashes:
+        story = conn.execute(stmt.Get_story_by_hash, keys).fetchone()["story"]
+
+    if story is None:
+        keys["dup"] = 0
+    else:
+        keys["story"], keys["dup"] = story, 1
+    for h in hashes:
+        seen.setdefault(h, keys["story"])
+    return keys
+
+
+def promote_duplicates(conn: Conn) -> None:
+    """删除订阅消息后执行，以免重复消息失去主消息。"""
+    conn.execute(stmt.Promote_orphan_duplicates)
 
 
 def delete_entries(feed_id: str, conn: Conn) -> None:
@@ -323,8 +420,12 @@ def delete_entries(feed_id: str, conn: Conn) -> None:
 
 
 def update_entries(feed_id: str, entries: list[FeedEntry], conn: Conn) -> None:
+    rows = conn.execute(stmt.Get_read_links, (feed_id,))
+    read_links = {row["link"] for row in rows if row["link"]}
     delete_entries(feed_id, conn)
-    insert_entries(entries, conn)
+    # 先插入再处理重复消息，这样本源仍有的文章会重新成为主消息 (story 不变)。
+    insert_entries(entries, conn, read_links)
+    promote_duplicates(conn)
     updated = arrow.now().format(RFC3339)
     connExec(
         conn, stmt.Update_feed_updated, {"updated": updated, "id": feed_id}
@@ -364,6 +465,7 @@ def subscribe_feed(feed_link: str, title: str, parser: str, conn: Conn) -> str:
             parser=parser,
         ),
     )
+    load_feed_cache(conn)
     return feed_id
 
 
@@ -372,8 +474,11 @@ def delete_feed(feed_id: str, conn: Conn) -> str:
     if not row:
         return f"Not Found: {feed_id}"
 
-    conn.execute(stmt.Delete_feed, (feed_id,))
+    # 先删除消息，因为消息通过 feed.key 找到所属的源。
     delete_entries(feed_id, conn)
+    promote_duplicates(conn)
+    conn.execute(stmt.Delete_feed, (feed_id,))
+    load_feed_cache(conn)
     return "OK. 已删除"
 
 
@@ -381,12 +486,13 @@ def update_feed_id(newid: str, oldid: str, conn: Conn) -> Result[str, str]:
     if oldid.upper() == newid.upper():
         return OK
 
+    # 订阅消息通过 feed.key 引用订阅源，因此只需要更新 feed 表的一行。
     param = {"newid": newid, "oldid": oldid}
     err = connExec(conn, stmt.Update_feed_id, param).err()
     if err:
         return Err(err)
 
-    connExec(conn, stmt.Update_entry_feed_id, param).unwrap()
+    load_feed_cache(conn)
     return OK
 
 
@@ -395,41 +501,130 @@ def update_feed_title(title: str, feed_id: str, conn: Conn) -> Result[str, str]:
     if err:
         return Err(err)
 
-    connExec(
-        conn, stmt.Update_entry_feed_name, {"feed_name": title, "feed_id": feed_id}
-    ).unwrap()
+    load_feed_cache(conn)
     return OK
 
 
+def prefix_range(prefix: str) -> dict:
+    return {
+        "lower": prefix,
+        "upper": prefix_upper_bound(prefix),
+        "limit": PrefixMatchLimit,
+    }
+
+
 def get_entry_by_prefix(prefix: str, conn: Conn) -> list[FeedEntry]:
-    rows = conn.execute(stmt.Get_entry_by_id_prefix, (prefix + "%",)).fetchall()
-    if not rows:
+    """在 main 与 news 两个数据库中查找，最多返回 PrefixMatchLimit 条消息。"""
+    if not prefix:
         return []
-
-    return [model.new_entry_from(row) for row in rows]
+    param = prefix_range(prefix)
+    rows = conn.execute(stmt.Get_entry_by_id_prefix, param).fetchall()
+    rows += conn.execute(stmt.Get_news_by_id_prefix, param).fetchall()
+    entries = [model.new_entry_from(row) for row in rows]
+    entries.sort(key=lambda entry: entry.entry_id.upper())
+    return entries[:PrefixMatchLimit]
 
 
 def get_entry_in_bucket(bucket: str, prefix: str, conn: Conn) -> list[FeedEntry]:
-    rows = conn.execute(
-        stmt.Get_entry_in_bucket, {"bucket": bucket, "id": prefix + "%"}
-    ).fetchall()
-
-    if not rows:
+    """最多返回 PrefixMatchLimit 条消息。"""
+    if not prefix:
         return []
+    param = prefix_range(prefix)
+    if bucket == Bucket.News.name:
+        rows = conn.execute(stmt.Get_news_by_id_prefix, param).fetchall()
+    else:
+        param["bucket"] = bucket
+        rows = conn.execute(stmt.Get_entry_in_bucket, param).fetchall()
     return [model.new_entry_from(row) for row in rows]
 
 
+def common_prefix_len(a: str, b: str) -> int:
+    n = 0
+    for x, y in zip(a.upper(), b.upper()):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def shortest_prefix(entry_id: str, conn: Conn) -> str:
+    """返回能唯一确定该消息的最短前缀 (至少 MinPrefixLen 个字符)。
+
+    只需与按 id 排序的前一个和后一个 id 比较，每个数据库两次索引查找即可。
+    """
+    n = 0
+    for query in (stmt.Get_prev_entry_id, stmt.Get_next_entry_id):
+        row = conn.execute(query, {"id": entry_id}).fetchone()
+        if row[0]:
+            n = max(n, common_prefix_len(entry_id, row[0]))
+    return entry_id[: max(n + 1, MinPrefixLen)]
+
+
+def fill_short_ids(entries: list[FeedEntry], conn: Conn) -> list[FeedEntry]:
+    """填充只用于显示的信息：最短唯一前缀，以及订阅消息的其他来源。"""
+    for entry in entries:
+        entry.short_id = shortest_prefix(entry.entry_id, conn)
+        if entry.bucket == Bucket.News.name:
+            entry.sources = get_story_sources(entry, conn)
+    return entries
+
+
+def get_story_sources(entry: FeedEntry, conn: Conn) -> list[str]:
+    """Return the names of the other feeds of the same story."""
+    sources: list[str] = []
+    for row in conn.execute(stmt.Get_story_sources, {"id": entry.entry_id}):
+        name = model.feed_cache.get(row["feed_key"], ("", row["link"]))[1]
+        if name != entry.feed_name and name not in sources:
+            sources.append(name)
+    return sources
+
+
 def move_to_fav(entry_id: str, conn: Conn) -> str:
-    newid = get_next_id(conn)
-    connExec(conn, stmt.Move_entry_to_fav, {"oldid": entry_id, "newid": newid}).unwrap()
+    """把订阅消息从 news 数据库移动到 main 数据库 (在同一个事务中完成)。"""
+    with conn:
+        newid = get_next_id(conn)
+        connExec(
+            conn, stmt.Copy_news_to_fav, {"oldid": entry_id, "newid": newid}
+        ).unwrap()
+        connExec(conn, stmt.Delete_news_entry, (entry_id,)).unwrap()
+        promote_duplicates(conn)
+        conn.execute(stmt.Refresh_all_unread)
     return newid
 
 
+def read_unread_news(feed_id: str, limit: int, conn: Conn) -> list[FeedEntry]:
+    """按时间从旧到新取出最多 limit 条未读消息，并标记为已读。
+
+    feed_id 为空时不限订阅源。只涉及本页的消息，与历史消息的数量无关。
+    """
+    if feed_id:
+        param = {"feed_id": feed_id, "limit": limit}
+        rows = conn.execute(stmt.Get_unread_news_by_feed, param).fetchall()
+    else:
+        rows = conn.execute(stmt.Get_unread_news, {"limit": limit}).fetchall()
+
+    counts: dict[int, int] = {}
+    for row in rows:
+        if row["feed_key"] is not None:
+            counts[row["feed_key"]] = counts.get(row["feed_key"], 0) + 1
+    with conn:
+        conn.executemany(stmt.Mark_news_read, [(row["id"],) for row in rows])
+        conn.executemany(
+            stmt.Decrease_feed_unread, [{"key": k, "n": n} for k, n in counts.items()]
+        )
+    return [model.new_entry_from(row) for row in rows]
+
+
+def count_unread(conn: Conn) -> int:
+    return conn.execute(stmt.Count_all_unread).fetchone()[0]
+
+
 def get_recent_entries(bucket: str, limit: int, conn: Conn) -> list[FeedEntry]:
-    entries = []
-    for row in conn.execute(stmt.Get_entries_limit, {"bucket": bucket, "limit": limit}):
-        entries.append(model.new_entry_from(row))
-    return entries
+    if bucket == Bucket.News.name:
+        rows = conn.execute(stmt.Get_news_limit, {"limit": limit})
+    else:
+        rows = conn.execute(stmt.Get_entries_limit, {"bucket": bucket, "limit": limit})
+    return [model.new_entry_from(row) for row in rows]
 
 
 def toggle_entry_bucket(entry: FeedEntry, conn: Conn) -> Result[FeedEntry, str]:
@@ -452,11 +647,17 @@ def toggle_entry_bucket(entry: FeedEntry, conn: Conn) -> Result[FeedEntry, str]:
 
 def delete_one_entry(entry_id: str, conn: Conn) -> Result[int, str]:
     match connExec(conn, stmt.Delete_entry, (entry_id,)):
-        case Err(e):
-            return Err(e)
+        case Err():
+            # 不在 main 数据库中，则是订阅消息 (订阅消息没有标签)。
+            r = connExec(conn, stmt.Delete_news_entry, (entry_id,))
+            promote_duplicates(conn)
+            conn.execute(stmt.Refresh_all_unread)
+            return r
         case Ok():
             row = conn.execute(stmt.Count_tag_by_entry_id, (entry_id,)).fetchone()
             if row[0]:
+                conn.execute(stmt.Decrease_tag_dict_by_entry_id, (entry_id,))
+                conn.execute(stmt.Delete_unused_tags)
                 return connExec(conn, stmt.Delete_tag_entry, (entry_id,))
             else:
                 return OK
@@ -478,8 +679,38 @@ def update_my_feed_date(conn: Conn) -> None:
     ).unwrap()
 
 
+def insert_my_entries(entries: list[FeedEntry], conn: Conn) -> int:
+    """批量插入我的消息 (包括标签)，返回标签的数量。"""
+    conn.executemany(
+        stmt.Insert_my_entry,
+        [
+            {
+                "id": entry.entry_id,
+                "content": entry.content,
+                "published": entry.published,
+                "feed_id": entry.feed_id,
+                "bucket": entry.bucket,
+            }
+            for entry in entries
+        ],
+    )
+    pairs = []
+    last_used = []
+    for entry in entries:
+        for name in extract_tags(entry.content):
+            pairs.append({"name": name, "entry_id": entry.entry_id})
+            last_used.append({"name": name, "last_used": entry.published})
+    conn.executemany(stmt.Upsert_tag_dict, last_used)
+    conn.executemany(stmt.Insert_tag, pairs)
+    return len(pairs)
+
+
 def insert_tags(names: list[str], entry_id: str, conn: Conn) -> Result[int, str]:
     pairs = [{"name": name, "entry_id": entry_id} for name in names]
+    now = arrow.now().format(RFC3339)
+    conn.executemany(
+        stmt.Upsert_tag_dict, [{"name": name, "last_used": now} for name in names]
+    )
     return connExec(conn, stmt.Insert_tag, pairs, many=True)
 
 
@@ -503,6 +734,67 @@ def count_by_tag(name: str, bucket: str, conn: Conn) -> int:
     return row[0]
 
 
+def get_tag_count(name: str, conn: Conn) -> int:
+    row = conn.execute(stmt.Get_tag_count, (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_by_tag_query(
+    clauses: list[TagClause], limit: int, bucket: str, conn: Conn
+) -> tuple[int, list[FeedEntry]]:
+    """多标签查询，用一条 SQL 同时得到结果总数与结果 (最多 limit 条)。
+
+    Return (total, entries).
+    """
+    param: dict = {"limit": limit}
+    sub_queries = []
+    for clause in clauses:
+        # 按标签使用次数从少到多排序，从最稀有的标签开始查找。
+        counts = {name: get_tag_count(name, conn) for name in clause.include}
+        if 0 in counts.values():
+            continue  # 某个标签不存在，这组条件不可能有结果。
+        include = sorted(counts, key=lambda name: counts[name])
+
+        names = []
+        for name in include + clause.exclude:
+            key = f"tag{len(param)}"
+            param[key] = name
+            names.append(key)
+        n = len(include)
+        joins = "".join(
+            stmt.Tag_query_join.format(i=i, name=names[i]) for i in range(1, n)
+        )
+        excludes = "".join(
+            stmt.Tag_query_exclude.format(name=name) for name in names[n:]
+        )
+        sub_queries.append(
+            stmt.Tag_query_clause.format(joins=joins, name=names[0], excludes=excludes)
+        )
+
+    if not sub_queries:
+        return 0, []
+
+    where = ""
+    if bucket != "All":
+        where = stmt.Tag_query_bucket
+        param["bucket"] = bucket
+    query = stmt.Get_by_tag_query.format(
+        clauses=" UNION ".join(sub_queries), bucket=where
+    )
+    rows = conn.execute(query, param).fetchall()
+    if not rows:
+        return 0, []
+    return rows[0]["total"], [model.new_entry_from(row) for row in rows]
+
+
+def has_news_db(conn: Conn) -> bool:
+    """归档数据库的连接附加的 news 是空的内存数据库，订阅消息在 main.entry 中。"""
+    for row in conn.execute(stmt.Get_database_list):
+        if row[1] == "news":
+            return row[2] != ""
+    return False
+
+
 def search_entry_content(
     keyword: str, limit: int, bucket: str, conn: Conn
 ) -> list[FeedEntry]:
@@ -510,6 +802,10 @@ def search_entry_content(
         rows = conn.execute(
             stmt.Search_entry_content, {"content": "%" + keyword + "%", "limit": limit}
         )
+    elif bucket == Bucket.News.name and has_news_db(conn):
+        rows = conn.execute(
+            stmt.Search_news_content, {"content": "%" + keyword + "%", "limit": limit}
+        )
     else:
         rows = conn.execute(
             stmt.Search_entry_content_bucket,
@@ -523,6 +819,10 @@ def count_entry_content(keyword: str, bucket: str, conn: Conn) -> list[FeedEntry
         row = conn.execute(
             stmt.Count_entry_content, {"content": "%" + keyword + "%"}
         ).fetchone()
+    elif bucket == Bucket.News.name and has_news_db(conn):
+        row = conn.execute(
+            stmt.Count_news_content, {"content": "%" + keyword + "%"}
+        ).fetchone()
     else:
         row = conn.execute(
             stmt.Count_entry_content_bucket,
@@ -531,11 +831,69 @@ def count_entry_content(keyword: str, bucket: str, conn: Conn) -> list[FeedEntry
     return row[0]
 
 
-def get_all_tags(conn: Conn) -> list[str]:
-    rows = conn.execute(stmt.Get_all_tags)
-    return ["#" + row[0] for row in rows]
+def prefix_upper_bound(prefix: str) -> str:
+    """返回 prefix 的上界，使 [prefix, upper) 恰好包含以 prefix 开头的字符串。
+
+    由于 NOCASE 只忽略 ASCII 字母的大小写，因此先把 ASCII 字母转为小写再计算上界。
+    """
+    prefix = "".join(c.lower() if c.isascii() else c for c in prefix)
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
 
 
-def get_tags_by_name(name: str, conn: Conn) -> list[str]:
-    rows = conn.execute(stmt.Get_one_tag, ("%" + name + "%",))
-    return ["#" + row[0] for row in rows]
+def sort_tags_query(sort: str, by_name: str, by_count: str, by_recent: str) -> str:
+    match sort:
+        case "count":
+            return by_count
+        case "recent":
+            return by_recent
+        case _:
+            return by_name
+
+
+def get_all_tags(
+    conn: Conn, sort: str = "name", limit: int = -1, offset: int = 0
+) -> tuple[int, list[TagCount]]:
+    """Return (total, tags). limit 为 -1 时返回全部标签。"""
+    query = sort_tags_query(
+        sort, stmt.Get_all_tags, stmt.Get_all_tags_by_count, stmt.Get_all_tags_by_recent
+    )
+    total = conn.execute(stmt.Count_all_tags).fetchone()[0]
+    rows = conn.execute(query, {"limit": limit, "offset": offset})
+    return total, [(row["name"], row["count"]) for row in rows]
+
+
+def get_tags_by_name(
+    name: str, conn: Conn, sort: str = "name", limit: int = -1, offset: int = 0
+) -> tuple[int, list[TagCount]]:
+    """先列出以 name 开头的标签，再列出其他包含 name 的标签，两部分各自按 sort 排序。
+
+    Return (total, tags). limit 为 -1 时返回全部符合条件的标签。
+    """
+    if not name:
+        return get_all_tags(conn, sort, limit, offset)
+
+    param = {"lower": name, "upper": prefix_upper_bound(name), "name": f"%{name}%"}
+    prefix_total = conn.execute(stmt.Count_tags_by_prefix, param).fetchone()[0]
+    contain_total = conn.execute(stmt.Count_tags_contain, param).fetchone()[0]
+
+    query = sort_tags_query(
+        sort,
+        stmt.Get_tags_by_prefix,
+        stmt.Get_tags_by_prefix_by_count,
+        stmt.Get_tags_by_prefix_by_recent,
+    )
+    rows = conn.execute(query, param | {"limit": limit, "offset": offset})
+    tags = [(row["name"], row["count"]) for row in rows]
+
+    if limit < 0 or len(tags) < limit:
+        rest = -1 if limit < 0 else limit - len(tags)
+        query = sort_tags_query(
+            sort,
+            stmt.Get_tags_contain,
+            stmt.Get_tags_contain_by_count,
+            stmt.Get_tags_contain_by_recent,
+        )
+        page = {"limit": rest, "offset": max(offset - prefix_total, 0)}
+        rows = conn.execute(query, param | page)
+        tags += [(row["name"], row["count"]) for row in rows]
+    return prefix_total + contain_total, tags
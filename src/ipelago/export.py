@@ -0,0 +1,194 @@
+"""导出/导入 JSONL, 每行一条记录: {"table": 表名, "row": {列名: 值}}
+
+导出与导入都采用生成器逐行处理，内存占用不随数据量增长。
+"""
+
+from itertools import groupby, islice
+import json
+from pathlib import Path
+import sqlite3
+from typing import Final, Iterable, Iterator, TextIO
+from result import Err, Ok, Result
+from . import compress
+from . import stmt
+from .db import current_id_name
+from .migrate import fill_feed_keys, fill_story_keys, schema_version_name
+from .model import Bucket
+from .shortid import parse_id
+
+Conn = sqlite3.Connection
+Record = tuple[str, dict]  # (table, row)
+
+# 按此顺序导出，导入时先有 feed 再有 entry, 先有 entry 再有 tag.
+ExportTables: Final[list[str]] = ["metadata", "feed", "entry", "tag"]
+
+# 订阅消息保存在 news 数据库中，导出时与 main.entry 合并为 entry 表，
+# 导入时再按 bucket 分开。
+NewsTable: Final[str] = "news.entry"
+
+ImportChunkSize: Final[int] = 5000  # 每次 executemany 的行数
+ImportTxRows: Final[int] = 200_000  # 每个事务最多包含多少行
+ProgressStep: Final[int] = 100_000  # 每处理多少行打印一次进度
+
+
+def iter_table(table: str, conn: Conn) -> Iterator[Record]:
+    cursor = conn.execute(stmt.Export_table.format(table=table))
+    for row in cursor:
+        if table == "metadata" and row["name"] == schema_version_name:
+            continue  # 数据库版本由 migrate 管理，不导出
+        yield table, dict(row)
+
+
+def iter_news(conn: Conn) -> Iterator[Record]:
+    for row in conn.execute(stmt.Export_news_entries):
+        row = dict(row)
+        row["content"] = compress.unpack(row["content"])
+        yield "entry", row
+
+
+def iter_records(conn: Conn) -> Iterator[Record]:
+    for table in ExportTables:
+        yield from iter_table(table, conn)
+        if table == "entry":
+            yield from iter_news(conn)
+
+
+def route_news(records: Iterator[Record]) -> Iterator[Record]:
+    """把订阅消息导入到 news 数据库 (如已训练字典则压缩内容)。
+
+    订阅源的 key 由本数据库分配，因此忽略导入文件中的 key.
+    """
+    for table, row in records:
+        if table == "feed":
+            row.pop("key", None)
+        if table == "entry" and row.get("bucket") == Bucket.News.name:
+            table = NewsTable
+            if "content" in row:
+                row["content"] = compress.pack(row["content"])
+        yield table, row
+
+
+def newer_id(a: str, b: str) -> str:
+    ida, idb = parse_id(a), parse_id(b)
+    return a if (ida.year, ida.n) >= (idb.year, idb.n) else b
+
+
+def filter_metadata(records: Iterator[Record], conn: Conn) -> Iterator[Record]:
+    """导入时忽略 schema-version (否则导入旧的导出文件会使数据库版本倒退),
+    current-id 则保留较大的一个，以免新分配的 ID 与已有的 ID 重复。
+    """
+    for table, row in records:
+        if table == "metadata":
+            name = row.get("name")
+            if name == schema_version_name:
+                continue
+            if name == current_id_name and "value" in row:
+                cid = conn.execute(stmt.Get_metadata, (name,)).fetchone()
+                if cid is not None:
+                    row["value"] = newer_id(cid[0], row["value"])
+        yield table, row
+
+
+def write_jsonl(records: Iterable[Record], f: TextIO) -> int:
+    """Return the number of records."""
+    n = 0
+    for table, row in records:
+        f.write(json.dumps({"table": table, "row": row}, ensure_ascii=False))
+        f.write("\n")
+        n += 1
+        if n % ProgressStep == 0:
+            print(f"exported {n} rows ...")
+    return n
+
+
+def export_jsonl(conn: Conn, filename: str) -> int:
+    with open(filename, "w", encoding="utf-8") as f:
+        return write_jsonl(iter_records(conn), f)
+
+
+def read_jsonl(f: TextIO) -> Iterator[Record]:
+    for i, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            yield item["table"], item["row"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"line {i}: {e}")
+
+
+def chunks(records: Iterator[Record], size: int) -> Iterator[tuple[str, list[dict]]]:
+    """把连续的同一个表的记录分成若干块，每块最多 size 行。"""
+    for table, group in groupby(records, key=lambda r: r[0]):
+        rows = (row for _, row in group)
+        while chunk := list(islice(rows, size)):
+            yield table, chunk
+
+
+def table_columns(table: str, conn: Conn) -> set[str]:
+    return {row["name"] for row in conn.execute(stmt.Table_info.format(table=table))}
+
+
+def insert_query(table: str, row: dict, columns: set[str]) -> Result[str, str]:
+    unknown = set(row) - columns
+    if unknown:
+        return Err(f"Unknown columns in table {table}: {', '.join(sorted(unknown))}")
+    names = ", ".join(row)
+    values = ", ".join(":" + name for name in row)
+    if table == "feed":
+        updates = ", ".join(f"{name}=excluded.{name}" for name in row)
+        query = stmt.Import_feed_row.format(names=names, values=values, updates=updates)
+        return Ok(query)
+    query = stmt.Import_row.format(table=table, names=names, values=values)
+    return Ok(query)
+
+
+def import_records(records: Iterator[Record], conn: Conn) -> Result[int, str]:
+    """Return the number of imported rows.
+
+    采用 INSERT OR REPLACE, 因此 ID 保持不变，重复导入同一个文件也不会产生重复数据。
+    """
+    columns = {table: table_columns(table, conn) for table in ExportTables}
+    columns[NewsTable] = columns["entry"]
+    n = 0
+    tx_rows = 0
+    records = route_news(filter_metadata(records, conn))
+    try:
+        for table, rows in chunks(records, ImportChunkSize):
+            if table not in columns:
+                conn.rollback()
+                return Err(f"Unknown table: {table}")
+            match insert_query(table, rows[0], columns[table]):
+                case Err(e):
+                    conn.rollback()
+                    return Err(e)
+                case Ok(query):
+                    conn.executemany(query, rows)
+
+            n_before = n
+            n += len(rows)
+            tx_rows += len(rows)
+            if tx_rows >= ImportTxRows:
+                conn.commit()
+                tx_rows = 0
+            if n // ProgressStep > n_before // ProgressStep:
+                print(f"imported {n} rows ...")
+
+        fill_feed_keys(conn)
+        fill_story_keys(conn)
+        conn.execute(stmt.Refresh_all_unread)
+        conn.execute(stmt.Delete_tag_dict)
+        conn.execute(stmt.Fill_tag_dict)
+        conn.commit()
+    except (ValueError, sqlite3.Error) as e:
+        conn.rollback()
+        return Err(str(e))
+    return Ok(n)
+
+
+def import_jsonl(conn: Conn, filename: str) -> Result[int, str]:
+    if not Path(filename).exists():
+        return Err(f"Not Found: {filename}")
+    with open(filename, "r", encoding="utf-8") as f:
+        return import_records(read_jsonl(f), conn)
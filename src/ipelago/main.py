@@ -1,9 +1,15 @@
+from pathlib import Path
 from typing import Any, cast
 import click
 import pyperclip
 from result import Err, Ok, Result
 from . import stmt
+from . import backup
+from . import compress
 from . import db
+from . import export
+from . import migrate
+from . import retention
 from .gui import tk_my_feed_info, tk_post_msg
 from .model import AppConfig, Bucket, my_bucket
 from .publish import check_before_publish, publish_html_rss, publish_show_info
@@ -63,6 +69,8 @@ def show_info(ctx: click.Context, _, value):
     click.echo(f"[database] {db.db_path}")
 
     with db.connect_db() as conn:
+        version = migrate.get_schema_version(conn)
+        click.echo(f"[schema version] {version}")
         cfg = db.get_cfg(conn).unwrap()
         click.echo(f"[Zen Mode Always ON] {cfg['zen_mode']}")
         click.echo(f"[http_proxy] {cfg['http_proxy']}")
@@ -186,12 +194,20 @@ def init_command(name: str):
     type=click.Path(exists=True),
     help="Send the content of the file.",
 )
+@click.option(
+    "batch",
+    "-batch",
+    type=click.Path(exists=True),
+    help="Post messages from a JSONL file or a folder.",
+)
 @click.argument("msg", nargs=-1)
 @click.option(
     "pri", "-pri", "--private", is_flag=True, help="Specify the private island"
 )
 @click.pass_context
-def post(ctx: click.Context, msg: Any, filename: str, gui: bool, pri: bool):
+def post(
+    ctx: click.Context, msg: Any, filename: str, batch: str, gui: bool, pri: bool
+):
     """Post a message. (发送消息)
 
     Examples:
@@ -201,9 +217,17 @@ def post(ctx: click.Context, msg: Any, filename: str, gui: bool, pri: bool):
     ago post              (默认发送系统剪贴板的内容)
 
     ago post -g           (打开 GUI 窗口写微博客)
+
+    ago post -batch ./notes.jsonl (批量发送，每行一条消息，例如 {"content": "abc"})
+
+    ago post -batch ./notes/      (批量发送，文件夹内每个文件一条消息)
     """
     check_init(ctx)
 
+    if batch:
+        util.post_batch(Path(batch), my_bucket(pri))
+        ctx.exit()
+
     if gui:
         check_tk(tk_post_msg(pri))
         ctx.exit()
@@ -385,6 +409,35 @@ def tl(
     "page_n", "-n", "--page-n", type=int, help="How many items are shown per page."
 )
 @click.option("force", "-force", is_flag=True, help="Confirm overwrite.")
+@click.option(
+    "full", "-full", is_flag=True, help="Re-render all pages, ignore the manifest."
+)
+@click.option(
+    "archives",
+    "-archive",
+    is_flag=True,
+    help="Also generate archive pages by month and by tag.",
+)
+@click.option(
+    "search",
+    "-search",
+    is_flag=True,
+    help="Also generate a search page and its index.",
+)
+@click.option(
+    "precompress",
+    "-gz",
+    "--precompress",
+    is_flag=True,
+    help="Also write .gz (and .br if Brotli is installed) files.",
+)
+@click.option(
+    "jobs",
+    "-jobs",
+    type=int,
+    default=0,
+    help="How many processes render pages (0: number of CPUs, 1: no pool).",
+)
 @click.pass_context
 def publish(
     ctx: click.Context,
@@ -398,6 +451,11 @@ def publish(
     tmpl_folder: str,
     page_n: int,
     force: bool,
+    full: bool,
+    archives: bool,
+    search: bool,
+    precompress: bool,
+    jobs: int,
 ):
     """Publish your microblog to HTML/RSS (生成 HTML 及 RSS 文件)
 
@@ -412,6 +470,8 @@ def publish(
     等发布到到网上后找到正确的网址，再回头修改。
 
     Website 可以填写任意网址，通常是你的个人网站或博客的网址。
+
+    再次发布时只重新生成有变化的页面，可使用 '-full' 全部重新生成。
     """
     check_init(ctx)
 
@@ -438,7 +498,18 @@ def publish(
             publish_show_info(conn)
         else:
             check(ctx, check_before_publish(conn), False)
-            publish_html_rss(conn, page_n, output, tmpl_folder, force)
+            publish_html_rss(
+                conn,
+                page_n,
+                output,
+                tmpl_folder,
+                force,
+                full,
+                jobs,
+                precompress,
+                archives,
+                search,
+            )
 
 
 def toggle_link(ctx: click.Context, _, value):
@@ -469,6 +540,13 @@ def toggle_link(ctx: click.Context, _, value):
 @click.option("update", "-u", "--update", help="Update a feed.")
 @click.option("first", "-first", is_flag=True, help="Read the latest message.")
 @click.option("next", "-next", is_flag=True, help="Read the next message.")
+@click.option(
+    "unread",
+    "-unread",
+    is_flag=False,
+    flag_value="all",
+    help="Read unread messages (oldest first) of all feeds or a feed.",
+)
 @click.option(
     "goto_date", "-go", "--goto", help="Move the cursor to a date(YYYY-MM-DD)"
 )
@@ -492,6 +570,7 @@ def news(
     show_list: bool,
     first: bool,
     next: bool,
+    unread: str,
     goto_date: str,
     limit: int,
     force: bool,
@@ -510,6 +589,10 @@ def news(
     ago news -u all     (批量更新全部源)
 
     ago news -u r92p72  (更新 id 为 R92P72 的源)
+
+    ago news -unread    (从旧到新阅读未读消息，阅读后标记为已读)
+
+    ago news -unread r92p72 -limit 20 (阅读指定源的未读消息，每次最多 20 条)
     """
     check_init(ctx)
 
@@ -532,6 +615,9 @@ def news(
             util.update_one_feed(update, parser, force, conn)
         elif like:
             util.move_to_fav(like, conn)
+        elif unread:
+            feed = "" if unread.upper() == "ALL" else unread
+            util.print_unread_news(feed, limit, cfg["news_show_link"], conn)
         elif new_id:
             check_id(ctx, feed_id)
             """这是既有 new_id 也有 feed_id 的情形"""
@@ -539,6 +625,7 @@ def news(
                 click.echo("ID 不允许设置为 'all'")
             else:
                 check(ctx, db.update_feed_id(new_id, feed_id, conn), False)
+                retention.rename_feed(new_id, feed_id, conn)
                 util.print_subs_list(conn, new_id)
         elif new_name:
             check_id(ctx, feed_id)
@@ -547,8 +634,9 @@ def news(
             util.print_subs_list(conn, feed_id)
         elif feed_id:
             """这是只有 feed_id, 没有 new_name 没有 new_id 的情形"""
-            total = conn.execute(stmt.Count_by_feed_id, (feed_id,)).fetchone()[0]
+            total = db.count_news_by_feed(feed_id, conn)
             entries = db.get_news_by_feed(feed_id, limit, conn)
+            db.fill_short_ids(entries, conn)
             if total > 0:
                 print(
                     f"\nTotal {total} items in [ID:{feed_id}], showing {len(entries)} items.\n"
@@ -558,6 +646,7 @@ def news(
             util.print_subs_list(conn, delete)
             click.confirm("Confirm deletion (确认删除)", abort=True)
             click.echo(db.delete_feed(delete, conn))
+            retention.delete_feed(delete, conn)
         elif goto_date:
             util.news_cursor_goto(goto_date, conn)
         elif first:
@@ -618,9 +707,22 @@ def copy(ctx: click.Context, entry_id: str, link: bool):
     help="Search in the specific bucket only.",
 )
 @click.option("all_tags", "--all-tags", is_flag=True, help="List out all tags.")
+@click.option(
+    "sort",
+    "-sort",
+    default="name",
+    type=click.Choice(["name", "count", "recent"], case_sensitive=False),
+    help="Sort the tags by name/count/recent (used with '--all-tags').",
+)
+@click.option(
+    "page", "-page", type=int, help="Show a page of tags (used with '--all-tags')."
+)
 @click.option(
     "all_feeds", "-feeds", "--all-feeds", is_flag=True, help="List out all feeds."
 )
+@click.option(
+    "archive", "-archive", is_flag=True, help="Search in the archive as well."
+)
 @click.pass_context
 def search(
     ctx: click.Context,
@@ -630,7 +732,10 @@ def search(
     is_tag: bool,
     is_contain: bool,
     all_tags: bool,
+    sort: str,
+    page: int,
     all_feeds: bool,
+    archive: bool,
 ):
     """Search entries by a tag or a keyword.
 
@@ -641,6 +746,12 @@ def search(
     ago search -tag abc (只搜索标签 'abc')
 
     ago search -contain abc (不搜索标签，只搜索内容包含 'abc' 的消息)
+
+    ago search abc -archive (同时搜索归档消息)
+
+    ago search --all-tags -sort count -page 2 (按使用次数排序，列出第 2 页标签)
+
+    ago search py --all-tags -sort recent (列出包含 'py' 的标签，最近使用的排在前面)
     """
     check_init(ctx)
 
@@ -655,22 +766,270 @@ def search(
             limit = cfg["cli_page_n"]
 
         if all_tags:
-            if keyword:
-                tags = db.get_tags_by_name(keyword, conn)
-            else:
-                tags = db.get_all_tags(conn)
-            print(f'Found {len(tags)} tags: {" ".join(tags)}\n')
+            util.print_tags(keyword, sort.lower(), page, limit, conn)
         elif all_feeds:
             if keyword:
                 util.print_feeds_by_title(conn, keyword)
             else:
                 util.print_subs_list(conn)
-        elif is_tag:
-            util.search_by_tag(keyword, limit, bucket, conn)
-        elif is_contain:
-            util.search_contains(keyword, limit, bucket, conn)
         else:
-            util.search_tag_and_contains(keyword, limit, bucket, conn)
+            if is_tag:
+                search_func = util.search_by_tag
+            elif is_contain:
+                search_func = util.search_contains
+            else:
+                search_func = util.search_tag_and_contains
+            search_func(keyword, limit, bucket, conn)
+            if archive:
+                util.search_archive(search_func, keyword, limit, bucket)
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.option("show_list", "-l", "--list", is_flag=True, help="List all policies.")
+@click.option("feed_id", "-feed", help="Set the policy of a feed.")
+@click.option(
+    "bucket",
+    "-bucket",
+    type=click.Choice(["news", "public", "private", "fav"], case_sensitive=False),
+    help="Set the policy of a bucket.",
+)
+@click.option(
+    "max_age", "-max-age", type=int, help="Keep at most N days (0: no limit)."
+)
+@click.option(
+    "max_count", "-max-count", type=int, help="Keep at most N items (0: no limit)."
+)
+@click.option("run", "-run", is_flag=True, help="Archive expired items now.")
+@click.option(
+    "vacuum",
+    "-vacuum",
+    is_flag=True,
+    help="Enable incremental vacuum (one-time full VACUUM).",
+)
+@click.option("force", "-force", is_flag=True, help="Allow policies on my buckets.")
+@click.pass_context
+def archive(
+    ctx: click.Context,
+    show_list: bool,
+    feed_id: str,
+    bucket: str,
+    max_age: int,
+    max_count: int,
+    run: bool,
+    vacuum: bool,
+    force: bool,
+):
+    """Retention policies and archive. (保留策略与归档)
+
+    超出保留策略的消息会被移动到归档数据库，
+
+    执行 'ago news -u all' 后会自动归档，也可以使用 'ago archive -run' 立即归档。
+
+    Public, Private, Fav 默认不受保留策略影响。
+
+    Examples:
+
+    ago archive -bucket news -max-age 30   (订阅消息最多保留 30 天)
+
+    ago archive -feed sspai -max-count 100 (源 sspai 最多保留 100 条消息)
+
+    ago archive -feed sspai -max-count 0   (取消限制)
+    """
+    check_init(ctx)
+
+    with db.connect_db() as conn:
+        if feed_id:
+            r = retention.set_feed_policy(feed_id, max_age, max_count, conn)
+            check(ctx, r, False)
+            util.print_retention(conn)
+        elif bucket:
+            r = retention.set_bucket_policy(bucket, max_age, max_count, force, conn)
+            check(ctx, r, False)
+            util.print_retention(conn)
+        elif run:
+            util.archive_expired(conn)
+        elif vacuum:
+            click.echo("Running VACUUM ...")
+            retention.enable_incremental_vacuum(conn)
+            click.echo("OK.")
+        else:
+            util.print_retention(conn)
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS, name="db")
+@click.option(
+    "explain",
+    "-explain",
+    is_flag=True,
+    help="Check the query plan of every SQL statement on a synthetic database.",
+)
+@click.option(
+    "n",
+    "-n",
+    type=int,
+    help="How many entries in the synthetic database (default: 100000).",
+)
+@click.option("verbose", "-verbose", is_flag=True, help="Show all query plans.")
+@click.option(
+    "train_dict",
+    "-train-dict",
+    is_flag=True,
+    help="Train (or retrain) the dictionary and compress news content.",
+)
+@click.option(
+    "no_compress", "-no-compress", is_flag=True, help="Decompress all news content."
+)
+@click.option(
+    "bench_compress",
+    "-bench-compress",
+    is_flag=True,
+    help="Compare DB size and read latency with/without compression.",
+)
+@click.option(
+    "bench_atom",
+    "-bench-atom",
+    is_flag=True,
+    help="Compare two ways of fitting atom.xml into the size limit.",
+)
+@click.option(
+    "bench_publish",
+    "-bench-publish",
+    is_flag=True,
+    help="Time publishing a synthetic timeline of N public entries.",
+)
+@click.option(
+    "backup_dest",
+    "-backup",
+    "--backup",
+    metavar="DEST",
+    help="Back up the databases into a new folder under DEST (safe while running).",
+)
+@click.option(
+    "keep",
+    "-keep",
+    type=int,
+    default=0,
+    help="Used with -backup, keep only the latest N backups (0: keep all).",
+)
+@click.pass_context
+def db_command(
+    ctx: click.Context,
+    explain: bool,
+    n: int | None,
+    verbose: bool,
+    train_dict: bool,
+    no_compress: bool,
+    bench_compress: bool,
+    bench_atom: bool,
+    bench_publish: bool,
+    backup_dest: str,
+    keep: int,
+):
+    """Database maintenance. (数据库维护)
+
+    Examples:
+
+    ago db -explain (在临时生成的测试数据库中检查每条 SQL 是否利用了索引，并计时)
+
+    ago db -train-dict (用已有的订阅消息训练字典，压缩全部订阅消息，以后的新消息也会压缩)
+
+    ago db -no-compress (解压全部订阅消息，以后不再压缩)
+
+    ago db -bench-compress (比较压缩前后的数据库体积与读取速度)
+
+    ago db -bench-atom (比较生成 atom.xml 时挑选消息的两种方法)
+
+    ago db -bench-publish (分别用 1 万、10 万、100 万条公开消息测试发布的耗时、写入量及内存峰值)
+
+    ago db -bench-publish -n 10000 (只测试 1 万条公开消息)
+
+    ago db -backup ~/backup -keep 7 (在线备份，只保留最近 7 次备份)
+    """
+    if explain or bench_compress or bench_atom or bench_publish:
+        # bench 只用于测试，用到时才导入，以免拖慢其他命令的启动。
+        from . import bench
+
+        if explain:
+            failed = bench.run_explain(n or bench.DefaultEntries, verbose)
+            ctx.exit(1 if failed else 0)
+
+        if bench_compress:
+            bench.run_compress(n or bench.DefaultEntries)
+            ctx.exit()
+
+        if bench_atom:
+            bench.run_atom()
+            ctx.exit()
+
+        if bench_publish:
+            # 未指定 -n 时依次测试 bench.PublishSizes 中的各种数量
+            if n is None:
+                bench.run_publish()
+            else:
+                bench.run_publish([n])
+            ctx.exit()
+
+    if backup_dest:
+        check_init(ctx)
+        r = backup.backup_all(backup_dest, keep, verbose=True)
+        check(ctx, r, False)
+        click.echo(f"OK. Backup saved to {r.unwrap()}")
+        ctx.exit()
+
+    if train_dict or no_compress:
+        check_init(ctx)
+        with db.connect_db() as conn:
+            if train_dict:
+                r = compress.new_dict(conn)
+                check(ctx, r, False)
+                click.echo(f"OK. New dictionary id: {r.unwrap()}")
+                n = compress.repack_all(conn, verbose=True)
+            else:
+                n = compress.disable(conn, verbose=True)
+        click.echo(f"OK. {n} news entries updated.")
+        ctx.exit()
+
+    click.echo(ctx.get_help())
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS, name="export")
+@click.argument("filename", nargs=1, type=click.Path(dir_okay=False))
+@click.option("force", "-force", is_flag=True, help="Confirm overwrite.")
+@click.pass_context
+def export_command(ctx: click.Context, filename: str, force: bool):
+    """Export all data to a JSONL file. (导出全部数据)
+
+    包括消息、订阅源、标签及设置，每行一条记录。
+
+    Example: ago export ./pypelago.jsonl
+    """
+    check_init(ctx)
+    if Path(filename).exists() and not force:
+        click.echo(f"Error: {filename} exists, require '-force' to overwrite.")
+        ctx.exit()
+
+    with db.connect_db() as conn:
+        n = export.export_jsonl(conn, filename)
+    click.echo(f"OK. Exported {n} rows to {filename}")
+
+
+@cli.command(context_settings=CONTEXT_SETTINGS, name="import")
+@click.argument("filename", nargs=1, type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def import_command(ctx: click.Context, filename: str):
+    """Import data from a JSONL file. (导入数据)
+
+    文件格式与 'ago export' 导出的文件相同，ID 保持不变，
+
+    数据库中已存在的同 ID 记录会被覆盖。
+
+    Example: ago import ./pypelago.jsonl
+    """
+    check_init(ctx)
+    with db.connect_db() as conn:
+        r = export.import_jsonl(conn, filename)
+        check(ctx, r, False)
+    click.echo(f"OK. Imported {r.unwrap()} rows from {filename}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""数据库版本与迁移
+
+数据库版本记录在 metadata 表的 'schema-version' 中，旧版本的数据库没有该记录，视为版本 0.
+每次 connect_db 都会检查版本，如有需要则按顺序执行迁移，每个迁移的 schema 部分在一个事务中完成。
+
+有些迁移需要填充大量数据 (比如给新增的列补上数据)，这部分采用分批执行，
+每批一个事务，因此不会长时间锁住数据库，中途中断后下次连接时会从中断处继续
+(schema 部分已完成的迁移记录在 'schema-pending' 中，不会重复执行)。
+全部数据填充完毕后才更新版本号。
+
+news 数据库只有 entry 相关的表，迁移时只执行 news_schema (见 db.attach_news),
+订阅消息的数据填充由附加了 news 数据库的 main 数据库负责。
+"""
+
+from dataclasses import dataclass, field
+import sqlite3
+from typing import Callable, Final
+from . import compress
+from . import stmt
+from .model import story_keys
+
+Conn = sqlite3.Connection
+
+schema_version_name: Final[str] = "schema-version"
+# schema 部分已完成、数据尚未填充完的版本
+schema_pending_name: Final[str] = "schema-pending"
+
+BackfillBatchSize: Final[int] = 5000
+ProgressThreshold: Final[int] = 50_000  # 超过这个数量才显示进度
+
+
+@dataclass
+class Backfill:
+    """分批填充数据。
+
+    count 用于统计待处理的行数，step 每次处理最多 limit 行并返回处理的行数，
+    两者都必须只选中尚未处理的行，这样才能重复执行直至完成。
+    news_only 为 True 时只对附加了 news 数据库的 main 数据库有效。
+    """
+
+    label: str
+    count: str
+    step: Callable[[Conn, int], int]
+    news_only: bool = False
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    schema: list[str]  # 在同一个事务中执行
+    # news 数据库执行的部分，None 表示与 schema 相同
+    news_schema: list[str] | None = None
+    backfill: list[Backfill] = field(default_factory=list)
+    after: Callable[[Conn], None] | None = None  # 填充数据后执行，与版本号更新在同一个事务中
+
+
+def script_to_list(script: str) -> list[str]:
+    return [s.strip() + ";" for s in script.split(";") if s.strip()]
+
+
+def is_attached(name: str, conn: Conn) -> bool:
+    return any(row[1] == name for row in conn.execute(stmt.Get_database_list))
+
+
+def move_news_entries(conn: Conn, limit: int) -> int:
+    """把订阅消息从 main 数据库移动到 news 数据库。
+
+    只对 main 数据库有效 (connect_db 会先 ATTACH news 数据库再执行迁移)，
+    news 与 archive 数据库本身执行迁移时跳过。
+    """
+    n = conn.execute(stmt.Move_news_entries, {"limit": limit}).rowcount
+    conn.execute(stmt.Delete_main_news_entries, {"limit": limit})
+    return n
+
+
+def assign_feed_keys(conn: Conn, limit: int) -> int:
+    """给没有 key 的订阅源分配 key."""
+    key = conn.execute(stmt.Get_max_feed_key).fetchone()[0]
+    rows = conn.execute(stmt.Get_feeds_without_key, {"limit": limit}).fetchall()
+    for row in rows:
+        key += 1
+        conn.execute(stmt.Set_feed_key, {"key": key, "id": row[0]})
+    return len(rows)
+
+
+def fill_news_feed_keys(conn: Conn, limit: int) -> int:
+    """让订阅消息引用 key (只对 main 数据库有效)。"""
+    return conn.execute(stmt.Fill_news_feed_key, {"limit": limit}).rowcount
+
+
+MoveNews: Final = Backfill(
+    "move news entries", stmt.Count_main_news_entries, move_news_entries, True
+)
+FeedKeys: Final = Backfill("feed.key", stmt.Count_feeds_without_key, assign_feed_keys)
+NewsFeedKeys: Final = Backfill(
+    "entry.feed_key", stmt.Count_news_without_feed_key, fill_news_feed_keys, True
+)
+
+
+def run_all(backfill: Backfill, conn: Conn) -> None:
+    """不分事务，一次填充完毕 (用于导入，由调用者 commit)。"""
+    if backfill.news_only and not is_attached("news", conn):
+        return
+    while backfill.step(conn, BackfillBatchSize) > 0:
+        pass
+
+
+def fill_feed_keys(conn: Conn) -> None:
+    """给没有 key 的订阅源分配 key, 然后让订阅消息引用 key."""
+    run_all(FeedKeys, conn)
+    run_all(NewsFeedKeys, conn)
+
+
+def fill_news_story_keys(conn: Conn, limit: int) -> int:
+    """计算订阅消息的链接哈希与内容指纹 (已有的消息都作为主消息)。"""
+    rows = conn.execute(stmt.Get_news_without_story, {"limit": limit}).fetchall()
+    params = [
+        story_keys(row[1], compress.unpack(row[2]), row[3]) | {"rowid": row[0]}
+        for row in rows
+    ]
+    conn.executemany(stmt.Update_news_story, params)
+    return len(rows)
+
+
+StoryKeys: Final = Backfill(
+    "link_hash, fingerprint, story",
+    stmt.Count_news_without_story,
+    fill_news_story_keys,
+    True,
+)
+
+
+def fill_story_keys(conn: Conn) -> None:
+    run_all(StoryKeys, conn)
+
+
+Migrations: Final[list[Migration]] = [
+    Migration(
+        version=1,
+        description="tag_dict (标签字典)",
+        schema=script_to_list(stmt.Create_tag_dict) + [stmt.Fill_tag_dict],
+        news_schema=[],
+    ),
+    Migration(
+        version=2,
+        description="idx_entry_feed_id_published",
+        schema=script_to_list(stmt.Create_idx_entry_feed_published),
+    ),
+    Migration(
+        version=3,
+        description="move news entries to pypelago-news.db",
+        schema=[],
+        backfill=[MoveNews],
+    ),
+    Migration(
+        version=4,
+        description="content_dict (订阅消息压缩字典)",
+        schema=script_to_list(stmt.Create_content_dict),
+    ),
+    Migration(
+        version=5,
+        description="feed.key, entry.feed_key (订阅消息不再保存源的 ID 与名称)",
+        schema=script_to_list(stmt.Create_feed_key + stmt.Create_entry_feed_key),
+        news_schema=script_to_list(stmt.Create_entry_feed_key),
+        backfill=[FeedKeys, NewsFeedKeys],
+    ),
+    Migration(
+        version=6,
+        description="entry.unread, feed.unread (已读/未读)",
+        schema=script_to_list(stmt.Create_read_state + stmt.Create_feed_read_state),
+        news_schema=script_to_list(stmt.Create_read_state),
+    ),
+    Migration(
+        version=7,
+        description="link_hash, fingerprint, story (重复消息)",
+        schema=script_to_list(stmt.Create_story),
+        backfill=[StoryKeys],
+    ),
+    Migration(
+        version=8,
+        description="idx_entry_bucket_published_id",
+        schema=script_to_list(stmt.Create_idx_entry_bucket_published_id),
+    ),
+]
+
+LatestVersion: Final[int] = Migrations[-1].version
+
+
+def get_schema_version(conn: Conn, schema: str = "main") -> int | None:
+    """Return None if the database is not initialized.
+
+    schema 是数据库名，比如 'news' 表示附加的 news 数据库。
+    """
+    query = stmt.Get_table_name.format(schema=schema)
+    if not conn.execute(query, ("metadata",)).fetchone():
+        return None
+    query = stmt.Get_schema_metadata.format(schema=schema)
+    row = conn.execute(query, (schema_version_name,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def set_schema_version(version: int, conn: Conn) -> None:
+    conn.execute(stmt.Upsert_metadata, {"name": schema_version_name, "value": version})
+
+
+def get_schema_pending(conn: Conn) -> int:
+    row = conn.execute(stmt.Get_metadata, (schema_pending_name,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def run_backfill(backfill: Backfill, conn: Conn) -> None:
+    """每批一个事务，中断后再次执行时从未处理的行继续。"""
+    if backfill.news_only and not is_attached("news", conn):
+        return
+    total = conn.execute(backfill.count).fetchone()[0]
+    verbose = total >= ProgressThreshold
+    done = 0
+    while True:
+        with conn:
+            n = backfill.step(conn, BackfillBatchSize)
+        if n <= 0:
+            break
+        done += n
+        if verbose:
+            print(f"[migrate] {backfill.label}: {done}/{total}")
+
+
+def apply_migration(migration: Migration, conn: Conn, news: bool = False) -> None:
+    """schema 部分与 schema-pending 在同一个事务中，因此中断后不会重复执行。
+
+    news 为 True 时只执行 news_schema, 不填充数据。
+    """
+    schema = migration.schema
+    if news and migration.news_schema is not None:
+        schema = migration.news_schema
+    if get_schema_pending(conn) != migration.version:
+        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            for query in schema:
+                conn.execute(query)
+            name, value = schema_pending_name, migration.version
+            conn.execute(stmt.Upsert_metadata, {"name": name, "value": value})
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    for backfill in [] if news else migration.backfill:
+        run_backfill(backfill, conn)
+
+    with conn:
+        if migration.after and not news:
+            migration.after(conn)
+        set_schema_version(migration.version, conn)
+        conn.execute(stmt.Delete_metadata, (schema_pending_name,))
+
+
+def migrate(conn: Conn, verbose: bool = True, news: bool = False) -> None:
+    """把数据库升级到最新版本，未初始化的数据库不做任何处理。
+
+    news 为 True 表示 conn 是 news 数据库 (只有 entry 相关的表)。
+    """
+    version = get_schema_version(conn)
+    if version is None or version >= LatestVersion:
+        return
+
+    for migration in Migrations:
+        if migration.version <= version:
+            continue
+        if verbose:
+            print(f"[migrate] schema v{migration.version}: {migration.description}")
+        apply_migration(migration, conn, news)
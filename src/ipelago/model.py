@@ -1,11 +1,14 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum, auto
+import hashlib
 import re
 from typing import Final, Pattern, TypedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 import arrow
 
 from result import Err, Ok, Result
 
+from ipelago import compress
 from ipelago.shortid import base_repr
 
 
@@ -57,6 +60,8 @@ class FeedEntry:
     feed_id: str  # (不用于 xml)
     feed_name: str  # (不用于 xml)
     bucket: str  # Bucket.name  # (不用于 xml)
+    short_id: str = ""  # 最短唯一前缀 (不保存到数据库, 只用于显示)
+    sources: list[str] = field(default_factory=list)  # 重复消息的其他来源 (只用于显示)
 
     def to_dict(self) -> dict:
         return dict(
@@ -89,14 +94,23 @@ def new_my_msg(entry_id: str, content: str, bucket: Bucket) -> Result[FeedEntry,
     return Ok(entry)
 
 
+# 订阅源缓存 {feed.key: (feed.id, feed.title)}, 由 db.load_feed_cache 加载。
+# 订阅消息只保存 feed_key, 源的 ID 与名称从这里获取。
+feed_cache: dict[int, tuple[str, str]] = {}
+
+
 def new_entry_from(row: dict) -> FeedEntry:
+    feed_id, feed_name = row["feed_id"], row["feed_name"]
+    feed_key = row["feed_key"] if "feed_key" in row.keys() else None
+    if feed_key in feed_cache:
+        feed_id, feed_name = feed_cache[feed_key]
     return FeedEntry(
         entry_id=row["id"],
-        content=row["content"],
+        content=compress.unpack(row["content"]),
         link=row["link"],
         published=row["published"],
-        feed_id=row["feed_id"],
-        feed_name=row["feed_name"],
+        feed_id=feed_id,
+        feed_name=feed_name,
         bucket=row["bucket"],
     )
 
@@ -111,6 +125,7 @@ class Feed:
     updated: str  # RFC3339
     notes: str = ""  # (不用于 xml)
     parser: str = ""  # (不用于 xml)
+    unread: int = 0  # 未读消息数量 (不用于 xml, 不直接写入数据库)
 
     def to_dict(self) -> dict:
         return dict(
@@ -135,6 +150,7 @@ def new_feed_from(row: dict) -> Feed:
         updated=row["updated"],
         notes=row["notes"],
         parser=row["parser"],
+        unread=row["unread"],
     )
 
 
@@ -197,4 +213,109 @@ def extract_tags(s: str) -> list[str]:
     """标签必须以“井号”开头，以空格结尾，并且不超过 TagSizeLimit"""
     s = s + " " # 因为标签必须以空格结尾
     tags = TagsPattern.findall(s)
-    return [tag for tag in tags if byte_len(tag) <= TagSizeLimit]
+    tags = [tag for tag in tags if byte_len(tag) <= TagSizeLimit]
+    # 去除重复的标签 (不分大小写)
+    unique: dict[str, str] = {}
+    for tag in tags:
+        unique.setdefault(tag.lower(), tag)
+    return list(unique.values())
+
+
+@dataclass
+class TagClause:
+    """一组用 AND 连接的标签条件，include 为必须包含的标签，exclude 为必须排除的标签。"""
+
+    include: list[str]
+    exclude: list[str]
+
+
+def parse_tag_query(query: str) -> Result[list[TagClause], str]:
+    """解析标签查询语句，返回用 OR 连接的多个 TagClause.
+
+    语法: 标签之间默认是 AND 关系，可使用 AND, OR, NOT (必须大写)，
+    标签名前面的 '#' 可省略，'-tag' 等同于 'NOT tag'。
+
+    例: "#python AND #perf NOT #draft", "python perf -draft OR rust"
+    """
+    clauses: list[TagClause] = []
+    clause = TagClause(include=[], exclude=[])
+    negative = False
+    for word in query.split():
+        match word:
+            case "AND":
+                continue
+            case "OR":
+                if negative:
+                    return Err("NOT 后面缺少标签")
+                clauses.append(clause)
+                clause = TagClause(include=[], exclude=[])
+                continue
+            case "NOT":
+                negative = True
+                continue
+        if word.startswith("-") and len(word) > 1:
+            negative = True
+            word = word[1:]
+        tag = word.removeprefix("#")
+        if not tag:
+            return Err(f"Invalid tag: {word}")
+        if byte_len(tag) > TagSizeLimit:
+            return Err(f"Tag too long: {tag}")
+        if negative:
+            clause.exclude.append(tag)
+        else:
+            clause.include.append(tag)
+        negative = False
+
+    if negative:
+        return Err("NOT 后面缺少标签")
+    clauses.append(clause)
+    for c in clauses:
+        if not c.include:
+            return Err("每组条件至少需要一个不带 NOT 的标签")
+    return Ok(clauses)
+
+
+# 这些链接参数只用于统计来源，比较链接时忽略。
+TrackingParams: Final[tuple[str, ...]] = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+MinFingerprintLen: Final[int] = 20  # 内容太短 (比如只有标题) 则不计算指纹
+
+
+def short_hash(s: str) -> str:
+    return hashlib.blake2b(s.encode(), digest_size=8).hexdigest()
+
+
+def normalize_link(link: str) -> str:
+    """忽略 http/https, www., 结尾的斜杠, fragment 及跟踪参数，参数按名称排序。"""
+    parts = urlsplit(link.strip())
+    if not parts.netloc:
+        return ""
+    host = parts.netloc.lower().removeprefix("www.")
+    path = parts.path.rstrip("/")
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TrackingParams)
+    ]
+    return urlunsplit(("", host, path, urlencode(sorted(query)), ""))
+
+
+def link_hash(link: str) -> str:
+    """Return "" if the link is not a valid URL."""
+    link = normalize_link(link)
+    return short_hash(link) if link else ""
+
+
+def content_fingerprint(content: str) -> str:
+    """忽略大小写、空白及标点，内容太短则返回 ""."""
+    text = re.sub(r"[\W_]+", "", content.lower())
+    return short_hash(text) if len(text) >= MinFingerprintLen else ""
+
+
+def story_keys(entry_id: str, content: str, link: str) -> dict:
+    """Return {link_hash, fingerprint, story}, 作为主消息时 story 由自身决定。"""
+    lhash = link_hash(link) or None
+    fingerprint = content_fingerprint(content) or None
+    return dict(
+        link_hash=lhash, fingerprint=fingerprint, story=lhash or fingerprint or entry_id
+    )
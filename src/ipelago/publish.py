@@ -1,13 +1,26 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cache
+import gzip
 import hashlib
+from itertools import chain, groupby, islice
+import json
+import os
 from pathlib import Path
-import shutil
+import re
 import sqlite3
-from typing import Final, TypedDict
+from typing import Any, Final, Iterable, Iterator, TypedDict
 import jinja2
 from result import Result, Err
 from ipelago import stmt
 
-from ipelago.db import get_feed_by_id, get_public_limit, get_recent_entries
+try:
+    import brotli  # 可选: pip install ipelago[brotli]
+except ImportError:
+    brotli = None
+
+from ipelago.db import app_dirs, get_feed_by_id, get_recent_entries
+from ipelago.search_index import SearchIndex, search_html
 from ipelago.model import (
     OK,
     Bucket,
@@ -15,6 +28,9 @@ from ipelago.model import (
     FeedEntry,
     FeedSizeLimit,
     PublicBucketID,
+    byte_len,
+    new_entry_from,
+    short_hash,
 )
 
 Conn = sqlite3.Connection
@@ -23,7 +39,21 @@ default_output_folder: Final[str] = "public"
 
 index_html: Final[str] = "index.html"
 atom_xml: Final[str] = "atom.xml"
+feed_json: Final[str] = "feed.json"
+json_feed_version: Final[str] = "https://jsonfeed.org/version/1.1"
+archive_html: Final[str] = "archive.html"
 atom_entries_limit: Final[int] = 30  # RSS 最多包含多少条信息
+manifest_name: Final[str] = ".publish-manifest.json"
+ParallelMinPages: Final[int] = 8  # 需要渲染的页面少于此数时不使用进程池
+PagesPerTask: Final[int] = 16  # 每次交给进程池多少页，减少进程间通信的次数
+
+# 预压缩: 为这些文件生成 .gz (及 .br) 文件，方便静态网站服务器直接使用。
+CompressSuffixes: Final[tuple[str, ...]] = (".html", ".css", ".xml", ".json")
+GzipLevel: Final[int] = 9
+BrotliQuality: Final[int] = 11
+
+# 编译后的模板保存在这里，下次运行时不必重新编译 (模板修改后会自动重新编译)。
+bytecode_cache_dir = Path(app_dirs.user_cache_dir).joinpath("jinja")
 
 
 class Link(TypedDict):
@@ -40,6 +70,7 @@ class Links(TypedDict):
     next_page: Link
     prev_page: Link
     footer: Link
+    search_page: Link
 
 
 def new_links():
@@ -48,27 +79,226 @@ def new_links():
         next_page=new_link(),
         prev_page=new_link(),
         footer=new_link(),
+        search_page=new_link(),
     )
 
 
+class ArchiveInfo(TypedDict):
+    title: str  # 归档页面的标题 (比如 "2022-03" 或 "#python"), 主页面为空
+    href: str  # 归档目录 (archive_html)
+
+
+def new_archive_info(title: str = "") -> ArchiveInfo:
+    return ArchiveInfo(title=title, href=archive_html)
+
+
+class ArchiveItem(TypedDict):
+    name: str
+    count: int
+    href: str
+
+
+@dataclass
+class Page:
+    output_name: str
+    entries: list[FeedEntry]
+    index_name: str  # 本组页面的首页
+    prev_name: str = ""  # 较新的一页
+    next_name: str = ""  # 较旧的一页
+
+    def links(self) -> Links:
+        return Links(
+            index_page=Link(name="", href=self.index_name),
+            prev_page=Link(name="Prev", href=self.prev_name),
+            next_page=Link(name="Next", href=self.next_name),
+            footer=new_link(),
+            search_page=new_link(),
+        )
+
+
+class Paginator:
+    """把从旧到新的消息分页，每页 limit 条 (主页面及归档页面都使用这种分页方式):
+
+    最新的一页 (1 至 limit 条) 是本组的首页 index_name, 其余是 p1, p2 ... (p1 最旧)。
+    不需要预先知道消息总数，只缓存最后两页，内存占用与消息总数无关。
+    """
+
+    def __init__(self, index_name: str, page_prefix: str, limit: int) -> None:
+        self.index_name = index_name
+        self.page_prefix = page_prefix
+        self.limit = limit
+        self.n = 0  # 已生成的页数 (不含首页)
+        # 已满的一页，等待确定其后一页的名称
+        self.pending: list[FeedEntry] | None = None
+        self.current: list[FeedEntry] = []
+
+    def page_name(self, n: int) -> str:
+        return f"{self.page_prefix}{n}.html" if n > 0 else ""
+
+    def add(self, entry: FeedEntry) -> list[Page]:
+        """返回可以渲染的页面 (0 或 1 页)。"""
+        pages = []
+        if len(self.current) == self.limit:
+            # current 之后还有消息，因此 current 不是首页，pending 的后一页就是 current.
+            if self.pending is not None:
+                pages.append(self._pop_pending(self.page_name(self.n + 2)))
+            self.pending, self.current = self.current, []
+        self.current.append(entry)
+        return pages
+
+    def finish(self) -> list[Page]:
+        pages = []
+        if self.pending is not None:
+            pages.append(self._pop_pending(self.index_name))
+        index = Page(self.index_name, self.current, self.index_name)
+        index.next_name = self.page_name(self.n)
+        pages.append(index)
+        return pages
+
+    def _pop_pending(self, prev_name: str) -> Page:
+        assert self.pending is not None
+        self.n += 1
+        page = Page(
+            output_name=self.page_name(self.n),
+            entries=self.pending,
+            index_name=self.index_name,
+            prev_name=prev_name,
+            next_name=self.page_name(self.n - 1),
+        )
+        self.pending = None
+        return page
+
+
+@dataclass
+class ArchiveIndex:
+    """归档目录，扫描消息时统计。"""
+
+    months: list[ArchiveItem] = field(default_factory=list)
+    tags: dict[str, ArchiveItem] = field(default_factory=dict)  # {小写标签名: item}
+
+
 try:
     loader = jinja2.PackageLoader("ipelago")
 except ValueError:
     loader = jinja2.FileSystemLoader("src/ipelago/templates")
 
-default_env = jinja2.Environment(loader=loader, autoescape=jinja2.select_autoescape())
 
+@dataclass
+class Manifest:
+    """增量发布
+
+    记录每个输出文件的输入 (消息 ID、发布时间、内容、链接、模板等) 的 hash,
+    保存在输出文件夹的 manifest_name 中。再次发布时，输入不变的文件不重新渲染，
+    也不写入，文件的修改时间保持不变 (方便 rsync 及 CDN 只上传有变化的文件)。
+    """
+
+    tmpl_hash: str
+    old: dict[str, str]  # {输出文件名: 输入的 hash}, 上次发布的记录
+    new: dict[str, str] = field(default_factory=dict)
+    rendered: int = 0
+    skipped: int = 0
+    written: list[str] = field(default_factory=list)  # 内容有变化、实际写入的文件
+
+    def changed(self, dst_dir: Path, output_name: str, *inputs: Any) -> bool:
+        h = hashlib.sha1(self.tmpl_hash.encode())
+        h.update(json.dumps(inputs, ensure_ascii=False, default=vars).encode())
+        self.new[output_name] = h.hexdigest()
+        if (
+            self.old.get(output_name) == self.new[output_name]
+            and dst_dir.joinpath(output_name).exists()
+        ):
+            self.skipped += 1
+            return False
+        self.rendered += 1
+        return True
+
+
+def load_manifest(tmpl_folder: str, dst_dir: Path, full: bool) -> Manifest:
+    """full 为 True 时忽略上次的记录，全部重新渲染。"""
+    old: dict[str, str] = {}
+    manifest_file = dst_dir.joinpath(manifest_name)
+    if not full and manifest_file.exists():
+        try:
+            old = json.loads(manifest_file.read_text(encoding="utf-8"))["files"]
+        except (ValueError, KeyError):
+            pass
+    return Manifest(tmpl_hash=templates_hash(tmpl_folder), old=old)
+
+
+def save_manifest(manifest: Manifest, dst_dir: Path) -> None:
+    """保存本次的记录，并删除上次发布而本次不再需要的页面 (比如消息减少时)。"""
+    for name in manifest.old.keys() - manifest.new.keys():
+        dst_dir.joinpath(name).unlink(missing_ok=True)
+        for f in compressed_files(dst_dir.joinpath(name)):
+            f.unlink(missing_ok=True)
+    data = json.dumps({"files": manifest.new}, ensure_ascii=False, indent=0)
+    write_file(dst_dir.joinpath(manifest_name), data.encode())
+
+
+def write_file(output_file: Path, data: bytes) -> bool:
+    """内容不变时不写入 (保留修改时间), 返回 False.
+
+    否则先写入同一文件夹中的临时文件再改名，改名是原子操作，
+    因此即使发布中途出错，每个文件也只会是旧的或新的完整内容。
+    """
+    if (
+        output_file.exists()
+        and output_file.stat().st_size == len(data)
+        and output_file.read_bytes() == data
+    ):
+        return False
+    tmp = output_file.with_name(f".{output_file.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, output_file)
+    return True
 
-def get_fs_env(tmpl_folder: str) -> jinja2.Environment:
-    loader = jinja2.FileSystemLoader(tmpl_folder)
-    return jinja2.Environment(loader=loader, autoescape=jinja2.select_autoescape())
 
+def write_text(output_file: Path, text: str) -> bool:
+    """与 Path.write_text 相同，按操作系统转换换行符。"""
+    return write_file(output_file, text.replace("\n", os.linesep).encode("utf-8"))
 
+
+def templates_hash(tmpl_folder: str) -> str:
+    """模板文件夹中全部文件的 hash, 修改任何模板都会导致全部重新渲染。"""
+    h = hashlib.sha1()
+    for f in sorted(get_src_dir(tmpl_folder).iterdir()):
+        if f.is_file():
+            h.update(f.name.encode())
+            h.update(f.read_bytes())
+    return h.hexdigest()
+
+
+def page_inputs(feed: Feed, entries: list[FeedEntry], is_index: bool) -> tuple:
+    """只有 index.html 显示 feed.updated (月份与标签页面的首页也不显示),
+    因此其他页面不受其影响 (否则每次发布都要全部重新渲染)。
+    """
+    feed_info = feed.to_dict()
+    if not is_index:
+        del feed_info["updated"]
+    entries_info = [(e.entry_id, e.published, e.content) for e in entries]
+    return feed_info, entries_info
+
+
+def get_bytecode_cache() -> jinja2.BytecodeCache | None:
+    try:
+        bytecode_cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return jinja2.FileSystemBytecodeCache(str(bytecode_cache_dir))
+
+
+@cache
 def get_jinja_env(tmpl_folder: str) -> jinja2.Environment:
-    if not tmpl_folder:
-        return default_env
-    else:
-        return get_fs_env(tmpl_folder)
+    """每个模板文件夹只创建一个 Environment, 这样每个模板只解析、编译一次。
+
+    tmpl_folder 为空时使用自带的模板。
+    """
+    env_loader = jinja2.FileSystemLoader(tmpl_folder) if tmpl_folder else loader
+    return jinja2.Environment(
+        loader=env_loader,
+        autoescape=jinja2.select_autoescape(),
+        bytecode_cache=get_bytecode_cache(),
+    )
 
 
 def get_src_dir(tmpl_folder: str) -> Path:
@@ -78,11 +308,69 @@ def get_src_dir(tmpl_folder: str) -> Path:
     return Path(tmpl.filename).parent
 
 
-def copy_static_files(tmpl_folder: str, dst_dir: Path) -> None:
-    static_files = get_src_dir(tmpl_folder).glob("*.css")
-    for src in static_files:
-        dst = dst_dir.joinpath(src.name)
-        shutil.copyfile(src, dst)
+def compressed_files(f: Path) -> list[Path]:
+    return [f.with_name(f.name + ".gz"), f.with_name(f.name + ".br")]
+
+
+def need_compress(f: Path, written: set[str]) -> bool:
+    """文件有变化，或者压缩文件不存在、比原文件旧 (比如上次发布时未启用预压缩)。"""
+    if f.name in written:
+        return True
+    gz, br = compressed_files(f)
+    targets = [gz, br] if brotli else [gz]
+    mtime = f.stat().st_mtime
+    return any(not t.exists() or t.stat().st_mtime < mtime for t in targets)
+
+
+def compress_file(f: Path) -> None:
+    """gzip 的 mtime 固定为 0, 这样原文件不变时压缩结果也不变。"""
+    data = f.read_bytes()
+    gz, br = compressed_files(f)
+    write_file(gz, gzip.compress(data, GzipLevel, mtime=0))
+    if brotli:
+        write_file(br, brotli.compress(data, quality=BrotliQuality))
+
+
+def precompress_files(
+    dst_dir: Path, outputs: Iterable[str], written: list[str], jobs: int
+) -> int:
+    """用线程池 (zlib 及 brotli 压缩时会释放 GIL) 压缩有变化的文件，返回压缩的文件数。
+
+    只压缩本次发布输出的文件 (outputs), 输出文件夹中的其他文件及隐藏文件
+    (比如 manifest_name) 不压缩。
+    """
+    written_set = set(written)
+    files = [
+        f
+        for f in map(dst_dir.joinpath, outputs)
+        if not f.name.startswith(".")
+        and f.suffix in CompressSuffixes
+        and f.exists()
+        and need_compress(f, written_set)
+    ]
+    with ThreadPoolExecutor(jobs or None) as executor:
+        list(executor.map(compress_file, files))
+    return len(files)
+
+
+def remove_stale_compressed(dst_dir: Path, written: list[str]) -> None:
+    """未启用预压缩时，删除有变化的文件的旧压缩文件，以免服务器提供过时的内容。"""
+    for name in written:
+        for f in compressed_files(dst_dir.joinpath(name)):
+            f.unlink(missing_ok=True)
+
+
+def static_files(tmpl_folder: str) -> list[Path]:
+    return sorted(get_src_dir(tmpl_folder).glob("*.css"))
+
+
+def copy_static_files(tmpl_folder: str, dst_dir: Path) -> list[str]:
+    """只复制有变化的文件，返回复制的文件名。"""
+    written = []
+    for src in static_files(tmpl_folder):
+        if write_file(dst_dir.joinpath(src.name), src.read_bytes()):
+            written.append(src.name)
+    return written
 
 
 def ensure_dst_dir(dst_dir: Path, force: bool) -> bool:
@@ -108,8 +396,23 @@ def print_tmpl_folder(tmpl_folder: str) -> None:
 
 
 def publish_html_rss(
-    conn: Conn, limit: int, output: str, tmpl_folder: str, force: bool
+    conn: Conn,
+    limit: int,
+    output: str,
+    tmpl_folder: str,
+    force: bool,
+    full: bool,
+    jobs: int = 0,
+    precompress: bool = False,
+    archives: bool = False,
+    search: bool = False,
 ) -> None:
+    """jobs 是同时渲染页面的进程数，0 表示 CPU 核数，1 表示不使用进程池。
+
+    precompress 为 True 时为 HTML, CSS, atom.xml 等生成 .gz (及 .br) 文件。
+    archives 为 True 时生成按月份及按标签的归档页面。
+    search 为 True 时生成站内搜索页面及索引 (见 search_index.py)。
+    """
     print_tmpl_folder(tmpl_folder)
     dst_dir = Path(output) if output else Path(default_output_folder)
     dst_dir = dst_dir.resolve()
@@ -119,88 +422,231 @@ def publish_html_rss(
         return
 
     feed = get_feed_by_id(PublicBucketID, conn).unwrap()
-    publish_html(conn, feed, limit, tmpl_folder, dst_dir)
-    publish_rss(conn, feed, tmpl_folder, dst_dir)
+    manifest = load_manifest(tmpl_folder, dst_dir, full)
+    publish_html(
+        conn, feed, limit, tmpl_folder, dst_dir, manifest, jobs, archives, search
+    )
+    publish_rss(conn, feed, tmpl_folder, dst_dir, manifest)
+    save_manifest(manifest, dst_dir)
+    print(
+        f"{manifest.rendered} files rendered, {len(manifest.written)} written,"
+        f" {manifest.skipped} unchanged."
+    )
+    if precompress:
+        outputs = [*manifest.new, *(f.name for f in static_files(tmpl_folder))]
+        n = precompress_files(dst_dir, outputs, manifest.written, jobs)
+        formats = ".gz/.br" if brotli else ".gz"
+        print(f"{n} files compressed ({formats}).")
+    else:
+        remove_stale_compressed(dst_dir, manifest.written)
+    print("OK.\n")
 
 
-def publish_rss(conn: Conn, feed: Feed, tmpl_folder: str, dst_dir: Path) -> None:
+def publish_rss(
+    conn: Conn, feed: Feed, tmpl_folder: str, dst_dir: Path, manifest: Manifest
+) -> None:
+    """atom.xml 及 feed.json (JSON Feed), 两者包含相同的消息。"""
     entries = get_recent_entries(Bucket.Public.name, atom_entries_limit, conn)
-    rss = render_atom_rss(tmpl_folder, atom_xml, feed, entries)
-    output_file = dst_dir.joinpath(atom_xml)
-    output_file.write_text(rss, encoding="utf-8")
+    inputs = page_inputs(feed, entries, True)
+    if manifest.changed(dst_dir, atom_xml, inputs):
+        rss = render_atom_rss(tmpl_folder, atom_xml, feed, entries)
+        if write_text(dst_dir.joinpath(atom_xml), rss):
+            manifest.written.append(atom_xml)
+    if manifest.changed(dst_dir, feed_json, inputs):
+        data = json.dumps(json_feed(feed, entries), ensure_ascii=False, indent=2)
+        if write_text(dst_dir.joinpath(feed_json), data):
+            manifest.written.append(feed_json)
+
+
+def json_feed(feed: Feed, entries: list[FeedEntry]) -> dict:
+    """https://www.jsonfeed.org/version/1.1/"""
+    data: dict[str, Any] = dict(version=json_feed_version, title=feed.title)
+    if feed.website:
+        data["home_page_url"] = feed.website
+    if feed_url := get_json_feed_url(feed):
+        data["feed_url"] = feed_url
+    data["authors"] = [dict(name=feed.author_name)]
+    data["items"] = [
+        dict(
+            id=f"{e.entry_id}-{e.published}",
+            content_text=e.content,
+            date_published=e.published,
+        )
+        for e in entries
+    ]
+    return data
+
+
+def get_json_feed_url(feed: Feed) -> str:
+    """feed.json 与 atom.xml 在同一个文件夹中，因此 RSS 链接不是 atom.xml 时无法得知。"""
+    base, _, name = feed.feed_link.rpartition("/")
+    return f"{base}/{feed_json}" if base and name == atom_xml else ""
 
 
 def publish_html(
-    conn: Conn, feed: Feed, limit: int, tmpl_folder: str, dst_dir: Path
+    conn: Conn,
+    feed: Feed,
+    limit: int,
+    tmpl_folder: str,
+    dst_dir: Path,
+    manifest: Manifest,
+    jobs: int,
+    archives: bool,
+    search: bool,
+) -> None:
+    index = ArchiveIndex() if archives else None
+    search_index = SearchIndex() if search else None
+    tasks = iter_page_tasks(
+        dst_dir, tmpl_folder, feed, limit, conn, manifest, index, search_index
+    )
+    manifest.written += render_pages(tasks, jobs)
+    if index is not None:
+        render_archive_index(dst_dir, tmpl_folder, feed, manifest, index)
+    if search_index is not None:
+        pages = max(search_index.total - 1, 0) // limit
+        write_json_files(dst_dir, manifest, search_index.finish(limit, pages))
+        render_search_page(dst_dir, tmpl_folder, feed, manifest)
+    manifest.written += copy_static_files(tmpl_folder, dst_dir)
+
+
+def write_json_files(
+    dst_dir: Path, manifest: Manifest, files: Iterable[tuple[str, Any]]
 ) -> None:
-    total = conn.execute(stmt.Count_by_feed_id, (PublicBucketID,)).fetchone()[0]
-    if total <= limit:
-        entries = get_public_limit("", limit, conn)
-        render_index_page(dst_dir, tmpl_folder, feed, entries)
+    for name, data in files:
+        if manifest.changed(dst_dir, name, data):
+            text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+            if write_file(dst_dir.joinpath(name), text.encode()):
+                manifest.written.append(name)
+
+
+def main_page_links(page: Page, feed: Feed, single: bool) -> Links:
+    """主页面的首页底部显示网站链接。只有一页时没有翻页链接，首页链接指向网站。"""
+    if single:
+        links = new_links()
+        links["index_page"] = Link(name="", href=feed.website)
     else:
-        render_all_pages(dst_dir, tmpl_folder, feed, total, limit, conn)
+        links = page.links()
+    if page.output_name == index_html:
+        links["footer"] = Link(name=feed.website, href=feed.website)
+    return links
 
-    copy_static_files(tmpl_folder, dst_dir)
-    print("OK.\n")
 
+def iter_page_tasks(
+    dst_dir: Path,
+    tmpl_folder: str,
+    feed: Feed,
+    limit: int,
+    conn: Conn,
+    manifest: Manifest,
+    index: ArchiveIndex | None,
+    search: SearchIndex | None,
+) -> Iterator[tuple]:
+    """按 (published, id) 的顺序扫描一次全部公开消息，生成需要渲染的页面
+    (render_write_page 的参数)。index 不为 None 时同时生成按月份及按标签的归档页面，
+    search 不为 None 时同时建立搜索索引。
+
+    只有一个查询，每条消息只读取一次，边读取边分页、边渲染，
+    每组页面最多缓存两页，因此内存占用与消息总数无关。
+    同一个月的消息是连续的，用 groupby 分组，标签则为每个标签保持一个 Paginator.
+    """
+
+    def tasks(
+        pages: list[Page], archive: ArchiveInfo | None, single: bool | None = None
+    ) -> Iterator[tuple]:
+        """single 不为 None 时是主页面。"""
+        for page in pages:
+            if single is None:
+                links = page.links()
+            else:
+                links = main_page_links(page, feed, single)
+            if search is not None:
+                links["search_page"] = Link(name="Search", href=search_html)
+            is_index = page.output_name == index_html
+            inputs = page_inputs(feed, page.entries, is_index)
+            if manifest.changed(dst_dir, page.output_name, inputs, links, archive):
+                yield (
+                    dst_dir,
+                    tmpl_folder,
+                    index_html,
+                    page.output_name,
+                    feed,
+                    links,
+                    page.entries,
+                    archive,
+                )
+
+    with_tags = index is not None
+    main_archive = new_archive_info() if with_tags else None
+    main_pages = Paginator(index_html, "p", limit)
+    tag_pages: dict[str, Paginator] = {}
+    query = stmt.Get_public_with_tags if with_tags else stmt.Get_public_entries
+    rows = conn.execute(query)
+    items = (
+        (new_entry_from(row), (row["tags"] or "") if with_tags else "") for row in rows
+    )
+    for month, group in groupby(items, key=lambda item: item[0].published[:7]):
+        prefix = f"month-{month}"
+        month_pages = Paginator(f"{prefix}.html", f"{prefix}-p", limit)
+        month_archive = new_archive_info(month)
+        count = 0
+        for entry, tags in group:
+            count += 1
+            yield from tasks(main_pages.add(entry), main_archive, single=False)
+            if search is not None:
+                write_json_files(dst_dir, manifest, search.add(entry))
+            if index is None:
+                continue
+            yield from tasks(month_pages.add(entry), month_archive)
+            for tag in tags.split():
+                key = tag.lower()
+                if key not in tag_pages:
+                    prefix = tag_page_name(tag)
+                    href = f"{prefix}.html"
+                    tag_pages[key] = Paginator(href, f"{prefix}-p", limit)
+                    index.tags[key] = ArchiveItem(name=tag, count=0, href=href)
+                index.tags[key]["count"] += 1
+                archive = new_archive_info(f"#{tag}")
+                yield from tasks(tag_pages[key].add(entry), archive)
+        if index is not None:
+            yield from tasks(month_pages.finish(), month_archive)
+            index.months.append(
+                ArchiveItem(name=month, count=count, href=month_pages.index_name)
+            )
 
-def get_output_names(current_page: int, total: int, page_limit: int) -> dict:
-    names: dict = {}
-    if current_page > 1:
-        names["next"] = f"p{current_page-1}.html"
+    pages = main_pages.finish()
+    yield from tasks(pages, main_archive, single=main_pages.n == 0)
+    if index is not None:
+        for key, paginator in tag_pages.items():
+            archive = new_archive_info(f"#{index.tags[key]['name']}")
+            yield from tasks(paginator.finish(), archive)
 
-    if total - current_page * page_limit < page_limit:
-        names["prev"] = index_html
-    else:
-        names["prev"] = f"p{current_page+1}.html"
 
-    if total - current_page * page_limit <= 0:
-        names["output"] = index_html
-        names["prev"] = ""
-    else:
-        names["output"] = f"p{current_page}.html"
+def render_pages(tasks: Iterable[tuple], jobs: int) -> list[str]:
+    """页面较多时使用进程池并行渲染 (每个进程渲染并写入文件)，返回实际写入的文件名。
 
-    return names
+    结果与逐页渲染完全相同。同时提交的页面数有上限，以免一次读取全部消息。
+    """
+    jobs = jobs or os.cpu_count() or 1
+    tasks = iter(tasks)
+    first = list(islice(tasks, ParallelMinPages))
+    if jobs == 1 or len(first) < ParallelMinPages:
+        return render_write_pages(chain(first, tasks))
 
+    written = []
+    with ProcessPoolExecutor(jobs) as executor:
+        pending: list[Future] = []
+        tasks = chain(first, tasks)
+        while chunk := list(islice(tasks, PagesPerTask)):
+            pending.append(executor.submit(render_write_pages, chunk))
+            if len(pending) >= jobs * 2:
+                written += pending.pop(0).result()
+        for f in pending:
+            written += f.result()
+    return written
 
-def render_all_pages(
-    dst_dir: Path, tmpl_folder: str, feed: Feed, total: int, limit: int, conn: Conn
-) -> None:
-    page = 0
-    cursor: str = ""
-
-    while True:
-        page += 1
-        names = get_output_names(page, total, limit)
-        footer = (
-            Link(name=feed.website, href=feed.website)
-            if names["output"] == index_html
-            else new_link()
-        )
-        links = Links(
-            index_page=Link(name="", href=index_html),
-            prev_page=Link(name="Prev", href=names.get("prev", "")),
-            next_page=Link(name="Next", href=names.get("next", "")),
-            footer=footer,
-        )
-        entries = get_public_limit(cursor, limit, conn)
-        cursor = entries[-1].published
-        render_write_page(
-            dst_dir, tmpl_folder, index_html, names["output"], feed, links, entries
-        )
-        if names["output"] == index_html:
-            break
 
-
-def render_index_page(
-    dst_dir: Path, tmpl_folder: str, feed: Feed, entries: list[FeedEntry]
-) -> None:
-    links = new_links()
-    links["index_page"] = Link(name="", href=feed.website)
-    links["footer"] = Link(name=feed.website, href=feed.website)
-    render_write_page(
-        dst_dir, tmpl_folder, index_html, index_html, feed, links, entries
-    )
+def render_write_pages(tasks: Iterable[tuple]) -> list[str]:
+    return [task[3] for task in tasks if render_write_page(*task)]
 
 
 def render_write_page(
@@ -211,7 +657,9 @@ def render_write_page(
     feed: Feed,
     links: Links,
     entries: list[FeedEntry],
-) -> None:
+    archive: ArchiveInfo | None = None,
+) -> bool:
+    """Return False if the file is unchanged (not written)."""
     tmpl = get_jinja_env(tmpl_folder).get_template(tmpl_name)
     if not tmpl.filename:
         raise ValueError(f"NotFound: {tmpl_name}")
@@ -221,10 +669,56 @@ def render_write_page(
             feed=feed,
             entries=entries,
             links=links,
+            archive=archive,
         )
     )
-    output_file = dst_dir.joinpath(output_name)
-    output_file.write_text(html, encoding="utf-8")
+    return write_text(dst_dir.joinpath(output_name), html)
+
+
+def tag_page_name(name: str) -> str:
+    """标签名可能包含不适合做文件名的字符，这种情况改用 hash."""
+    key = name.lower()
+    slug = key if re.fullmatch(r"[\w-]+", key) else short_hash(key)
+    return f"tag-{slug}"
+
+
+def get_template(tmpl_folder: str, tmpl_name: str) -> jinja2.Template:
+    """自定义模板文件夹中没有该模板时 (比如旧的模板文件夹没有 archive.html), 使用自带的模板。"""
+    try:
+        return get_jinja_env(tmpl_folder).get_template(tmpl_name)
+    except jinja2.exceptions.TemplateNotFound:
+        return get_jinja_env("").get_template(tmpl_name)
+
+
+def render_archive_index(
+    dst_dir: Path,
+    tmpl_folder: str,
+    feed: Feed,
+    manifest: Manifest,
+    index: ArchiveIndex,
+) -> None:
+    """归档目录: 月份从新到旧，标签按消息数量从多到少。"""
+    months = list(reversed(index.months))
+    tags = sorted(index.tags.values(), key=lambda t: (-t["count"], t["name"].lower()))
+    feed_info = page_inputs(feed, [], False)[0]
+    if not manifest.changed(dst_dir, archive_html, feed_info, months, tags):
+        return
+    html = get_template(tmpl_folder, archive_html).render(
+        dict(feed=feed, months=months, tags=tags)
+    )
+    if write_text(dst_dir.joinpath(archive_html), html):
+        manifest.written.append(archive_html)
+
+
+def render_search_page(
+    dst_dir: Path, tmpl_folder: str, feed: Feed, manifest: Manifest
+) -> None:
+    feed_info = page_inputs(feed, [], False)[0]
+    if not manifest.changed(dst_dir, search_html, feed_info):
+        return
+    html = get_template(tmpl_folder, search_html).render(dict(feed=feed))
+    if write_text(dst_dir.joinpath(search_html), html):
+        manifest.written.append(search_html)
 
 
 def render_atom_rss(
@@ -233,34 +727,55 @@ def render_atom_rss(
     feed: Feed,
     entries: list[FeedEntry],
 ) -> str:
+    """RSS 的体积 (UTF-8 字节) 不超过 FeedSizeLimit, 超出时去掉较旧的消息。"""
     tmpl = get_jinja_env(tmpl_folder).get_template(tmpl_name)
     if not tmpl.filename:
         raise ValueError(f"NotFound: {tmpl_name}")
 
-    while True:
-        rss = tmpl.render(
-            dict(
-                feed_uuid=hashlib.sha1(feed.feed_link.encode()).hexdigest(),
-                feed=feed,
-                entries=entries,
-            )
-        )
-        if len(rss) <= FeedSizeLimit:
-            return rss
-        else:
-            entries = entries[: len(entries) // 2]
+    feed_uuid = get_feed_uuid(feed)
+
+    def render(items: list[FeedEntry]) -> str:
+        return tmpl.render(dict(feed_uuid=feed_uuid, feed=feed, entries=items))
+
+    rss = render(entries)
+    if byte_len(rss) <= FeedSizeLimit:
+        return rss
+
+    # 每条消息单独渲染一次，得到其体积，从而算出最多可包含多少条消息。
+    base = byte_len(render([]))
+    sizes = [byte_len(render([entry])) - base for entry in entries]
+    n = max_entries_fit(base, sizes, FeedSizeLimit)
+    rss = render(entries[:n])
+
+    # 如果模板的输出不是各条消息简单相加 (比如使用了 loop.index), 可能仍超出一点。
+    while n > 0 and byte_len(rss) > FeedSizeLimit:
+        n -= 1
+        rss = render(entries[:n])
+    return rss
+
+
+def get_feed_uuid(feed: Feed) -> str:
+    return hashlib.sha1(feed.feed_link.encode()).hexdigest()
+
+
+def max_entries_fit(base: int, sizes: list[int], limit: int) -> int:
+    """base 是不含消息时的体积，sizes 是每条消息的体积，返回不超过 limit 的最长前缀。"""
+    total = base
+    for i, size in enumerate(sizes):
+        total += size
+        if total > limit:
+            return i
+    return len(sizes)
 
 
 def check_before_publish(conn: sqlite3.Connection) -> Result[str, str]:
     feed = get_feed_by_id(PublicBucketID, conn).unwrap()
     if feed.feed_link == "" or feed.title == "" or feed.author_name == "":
-        return Err(
-            """
+        return Err("""
 第一次发布需要使用 'ago publish -g' 命令录入作者名称等信息。
 另外也可使用 'ago publish --set-author' 等命令。
 如有疑问可使用 'ago publish -h' 获取帮助。
-"""
-        )
+""")
     return OK
 
 
@@ -271,4 +786,7 @@ def publish_show_info(conn: sqlite3.Connection) -> None:
     print(f"[RSS Link] {feed.feed_link}")
     print(f"[Author] {feed.author_name}")
     print(f"[Website] {feed.website}")
-    print(f"\n其中 Link 是指 RSS feed 本身的链接, " "Website 可以填写任意网址，通常是你的个人网站或博客的网址。")
+    print(
+        f"\n其中 Link 是指 RSS feed 本身的链接, "
+        "Website 可以填写任意网址，通常是你的个人网站或博客的网址。"
+    )
@@ -0,0 +1,239 @@
+"""保留策略与归档
+
+可以为某个源或某个 bucket 设置最长保留天数与最多保留条数，
+超出的消息会被批量移动到归档数据库 (pypelago-archive.db), 使主数据库保持小巧。
+
+默认没有任何策略，另外 Public, Private, Fav 需要明确指定才会受策略影响。
+"""
+
+import json
+import sqlite3
+from typing import Final, TypedDict
+import arrow
+from result import Err, Ok, Result
+from . import compress
+from . import db
+from . import stmt
+from .migrate import migrate
+from .model import RFC3339, Bucket
+
+Conn = sqlite3.Connection
+
+archive_filename: Final[str] = "pypelago-archive.db"
+archive_path = db.app_config_dir.joinpath(archive_filename)
+retention_name: Final[str] = "retention"
+
+AutoVacuumIncremental: Final[int] = 2  # PRAGMA auto_vacuum 的返回值
+
+# 这几个 bucket 是我的消息，默认不受保留策略影响。
+ExemptBuckets: Final[list[str]] = [
+    Bucket.Public.name,
+    Bucket.Private.name,
+    Bucket.Fav.name,
+]
+
+
+class Policy(TypedDict):
+    max_age: int  # 最长保留天数，0 表示不限
+    max_count: int  # 最多保留条数，0 表示不限
+
+
+class Retention(TypedDict):
+    buckets: dict[str, Policy]  # key: Bucket.name
+    feeds: dict[str, Policy]  # key: feed_id
+
+
+def new_retention() -> Retention:
+    return Retention(buckets={}, feeds={})
+
+
+def get_retention(conn: Conn) -> Retention:
+    row = conn.execute(stmt.Get_metadata, (retention_name,)).fetchone()
+    if row is None:
+        return new_retention()
+    return json.loads(row[0])
+
+
+def update_retention(retention: Retention, conn: Conn) -> None:
+    value = json.dumps(retention)
+    if conn.execute(stmt.Get_metadata, (retention_name,)).fetchone() is None:
+        conn.execute(stmt.Insert_metadata, (retention_name, value))
+    else:
+        conn.execute(stmt.Update_metadata, {"value": value, "name": retention_name})
+
+
+def set_policy(
+    policies: dict[str, Policy], key: str, max_age: int | None, max_count: int | None
+) -> None:
+    """max_age 或 max_count 为 None 表示不修改，两者都为 0 表示删除该策略。"""
+    policy = policies.get(key, Policy(max_age=0, max_count=0))
+    if max_age is not None:
+        policy["max_age"] = max(max_age, 0)
+    if max_count is not None:
+        policy["max_count"] = max(max_count, 0)
+
+    if policy["max_age"] or policy["max_count"]:
+        policies[key] = policy
+    else:
+        policies.pop(key, None)
+
+
+def set_feed_policy(
+    feed_id: str, max_age: int | None, max_count: int | None, conn: Conn
+) -> Result[Retention, str]:
+    feeds = db.get_subs_list(conn, feed_id)
+    if not feeds:
+        return Err(f"Not Found: {feed_id}")
+    feed_id = feeds[0].feed_id
+    retention = get_retention(conn)
+    set_policy(retention["feeds"], feed_id, max_age, max_count)
+    update_retention(retention, conn)
+    return Ok(retention)
+
+
+def set_bucket_policy(
+    bucket: str, max_age: int | None, max_count: int | None, force: bool, conn: Conn
+) -> Result[Retention, str]:
+    bucket = bucket.capitalize()
+    if bucket in ExemptBuckets and not force:
+        return Err(
+            f"[{bucket}] 是我的消息，默认不受保留策略影响，如确需设置请使用 '-force' 参数。"
+        )
+    retention = get_retention(conn)
+    set_policy(retention["buckets"], bucket, max_age, max_count)
+    update_retention(retention, conn)
+    return Ok(retention)
+
+
+def rename_feed(newid: str, oldid: str, conn: Conn) -> None:
+    """源改 ID 后，该源的保留策略跟着改。"""
+    retention = get_retention(conn)
+    for feed_id in list(retention["feeds"]):
+        if feed_id.upper() == oldid.upper():
+            retention["feeds"][newid] = retention["feeds"].pop(feed_id)
+            update_retention(retention, conn)
+
+
+def delete_feed(feed_id: str, conn: Conn) -> None:
+    """删除源时，同时删除该源的保留策略。"""
+    retention = get_retention(conn)
+    for key in list(retention["feeds"]):
+        if key.upper() == feed_id.upper():
+            del retention["feeds"][key]
+            update_retention(retention, conn)
+
+
+def ensure_archive_db() -> None:
+    """auto_vacuum 只能在建表之前设置 (与 db.attach_news 相同)，因此只对新数据库设置。"""
+    is_new = not archive_path.exists()
+    with sqlite3.connect(archive_path) as conn:
+        if is_new:
+            conn.execute(stmt.Set_auto_vacuum_incremental)
+        conn.executescript(stmt.Create_tables)
+        migrate(conn, verbose=False)
+    conn.close()
+
+
+def attach_archive(conn: Conn) -> None:
+    """ATTACH 不可在事务中执行，因此会先 commit."""
+    ensure_archive_db()
+    conn.commit()
+    conn.execute(stmt.Attach_archive, (str(archive_path),))
+
+
+def detach_archive(conn: Conn) -> None:
+    conn.execute(stmt.Detach_archive)
+
+
+def connect_archive() -> Conn | None:
+    """用于搜索归档消息，如果还没有归档数据库则返回 None."""
+    if not archive_path.exists():
+        return None
+    conn = sqlite3.connect(archive_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(stmt.Attach_empty_news)
+    conn.execute(stmt.Create_empty_news_entry)
+    compress.register_unpack(conn)
+    return conn
+
+
+def cutoff_date(days: int) -> str:
+    return arrow.now().shift(days=-days).format(RFC3339)
+
+
+def collect_expired(retention: Retention, conn: Conn) -> int:
+    """把过期消息的 id 放进临时表 expired, 返回过期消息的数量。"""
+    conn.execute(stmt.Create_temp_expired)
+    conn.execute(stmt.Delete_temp_expired)
+    for feed_id, policy in retention["feeds"].items():
+        if policy["max_age"]:
+            published = cutoff_date(policy["max_age"])
+            conn.execute(
+                stmt.Expire_by_feed_age, {"feed_id": feed_id, "published": published}
+            )
+        if policy["max_count"]:
+            conn.execute(
+                stmt.Expire_by_feed_count,
+                {"feed_id": feed_id, "count": policy["max_count"]},
+            )
+    for bucket, policy in retention["buckets"].items():
+        # 订阅消息保存在 news 数据库中
+        if bucket == Bucket.News.name:
+            by_age, by_count = stmt.Expire_news_by_age, stmt.Expire_news_by_count
+        else:
+            by_age, by_count = stmt.Expire_by_bucket_age, stmt.Expire_by_bucket_count
+        if policy["max_age"]:
+            published = cutoff_date(policy["max_age"])
+            conn.execute(by_age, {"bucket": bucket, "published": published})
+        if policy["max_count"]:
+            conn.execute(by_count, {"bucket": bucket, "count": policy["max_count"]})
+    return conn.execute(stmt.Count_temp_expired).fetchone()[0]
+
+
+def incremental_vacuum(conn: Conn) -> bool:
+    """Return False if the database is not in incremental auto_vacuum mode."""
+    if conn.execute(stmt.Get_auto_vacuum).fetchone()[0] != AutoVacuumIncremental:
+        return False
+    conn.execute(stmt.Incremental_vacuum).fetchall()
+    return True
+
+
+def enable_incremental_vacuum(conn: Conn) -> None:
+    """旧版本的数据库需要执行一次完整的 VACUUM 才能启用 incremental auto_vacuum."""
+    conn.commit()
+    conn.execute(stmt.Set_auto_vacuum_incremental)
+    conn.execute(stmt.Vacuum)
+
+
+def archive_expired(conn: Conn) -> Result[int, str]:
+    """把过期消息批量移动到归档数据库，返回移动的消息条数。"""
+    retention = get_retention(conn)
+    if not retention["feeds"] and not retention["buckets"]:
+        return Ok(0)
+
+    attach_archive(conn)
+    try:
+        with conn:
+            n = collect_expired(retention, conn)
+            if n:
+                conn.execute(stmt.Archive_expired_entries)
+                conn.execute(stmt.Archive_expired_tags)
+                conn.execute(stmt.Archive_expired_tag_dict)
+                conn.execute(stmt.Decrease_tag_dict_expired)
+                conn.execute(stmt.Delete_unused_tags)
+                conn.execute(stmt.Delete_expired_tags)
+                conn.execute(stmt.Delete_expired_entries)
+                conn.execute(stmt.Archive_expired_news)
+                conn.execute(stmt.Delete_expired_news)
+                conn.execute(stmt.Promote_orphan_duplicates)
+                conn.execute(stmt.Refresh_all_unread)
+            conn.execute(stmt.Delete_temp_expired)
+    except sqlite3.Error as e:
+        return Err(str(e))
+    finally:
+        detach_archive(conn)
+
+    if n:
+        incremental_vacuum(conn)
+        conn.execute(stmt.Incremental_vacuum_news).fetchall()
+    return Ok(n)
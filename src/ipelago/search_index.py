@@ -0,0 +1,120 @@
+"""静态网站的站内搜索索引
+
+发布时为公开消息建立倒排索引 (词 -> 消息编号)，保存为若干个小的 JSON 文件，
+网页 (search.html) 中的脚本按需下载，因此不需要服务器也能搜索。
+
+- 分词: 英文、数字等按单词切分 (转为小写，至少 MinWordLen 个字符)，
+  中日韩文字没有空格，采用二元切分 (bigram)，比如 "你好世界" -> 你好, 好世, 世界。
+- 消息编号: 按 (published, id) 排序的序号，与主页面的分页顺序相同，
+  因此网页可以从编号算出消息所在的页面 (第 n // limit + 1 页，超出页数的在 index.html)。
+- 索引分片: 按词的前缀分成多个文件 (shard_name), 搜索时只下载用到的分片。
+  同一个前缀的词都在同一个分片中，因此网页可以做前缀匹配 (边输入边搜索)。
+  每个词的消息编号从小到大排列，保存相邻编号之差，使文件更小。
+- 消息内容: 每 DocsPerShard 条保存为一个文件，只在显示搜索结果时下载。
+
+新消息的编号最大，因此发布新消息时通常只有少数几个文件有变化，
+其余文件内容不变，不会被写入 (与 HTML 页面一样由 Manifest 记录)。
+"""
+
+from array import array
+import re
+from typing import Any, Final, Iterator
+from .model import FeedEntry
+
+MinWordLen: Final[int] = 2
+MaxWordLen: Final[int] = 32
+DocsPerShard: Final[int] = 200
+AsciiPrefixLen: Final[int] = 2  # 英文按前两个字母分片
+CJKShardBits: Final[int] = 6  # 中日韩文字按 Unicode 码位分片，每片 64 个字
+
+meta_json: Final[str] = "search-meta.json"
+search_html: Final[str] = "search.html"
+
+# 平假名、片假名、中日韩统一表意文字 (含扩展 A)、谚文、兼容表意文字
+CJK: Final[str] = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+Token: Final = re.compile(f"[{CJK}]+|[^\\W_{CJK}]+")
+CJKChar: Final = re.compile(f"[{CJK}]")
+
+
+def tokenize(text: str) -> set[str]:
+    tokens: set[str] = set()
+    for word in Token.findall(text.lower()):
+        if CJKChar.match(word):
+            if len(word) == 1:
+                tokens.add(word)
+            else:
+                tokens.update(word[i : i + 2] for i in range(len(word) - 1))
+        elif len(word) >= MinWordLen:
+            tokens.add(word[:MaxWordLen])
+    return tokens
+
+
+def shard_name(token: str) -> str:
+    """英文 (及数字) 按前缀命名，其他文字按码位范围命名，比如 "search-py.json", "search-u13d.json"."""
+    if token.isascii():
+        return f"search-{token[:AsciiPrefixLen]}.json"
+    return f"search-u{ord(token[0]) >> CJKShardBits:x}.json"
+
+
+def delta_encode(docs: array) -> list[int]:
+    return [docs[0]] + [b - a for a, b in zip(docs, docs[1:])]
+
+
+def docs_name(n: int) -> str:
+    return f"search-docs-{n}.json"
+
+
+class SearchIndex:
+    """发布时逐条加入消息 (按 published, id 的顺序)。
+
+    消息内容每满 DocsPerShard 条就交给调用者写入文件，不必保存全部消息;
+    倒排索引则要等全部消息加入后才能生成，内存占用与索引的大小成正比
+    (每个词、每条消息 4 字节)，因此是可选的。
+    """
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.postings: dict[str, array] = {}
+        self.docs: list[list[str]] = []  # 尚未写入的消息内容
+
+    def add(self, entry: FeedEntry) -> list[tuple[str, Any]]:
+        """返回可以写入的文件 (文件名, 内容)，0 或 1 个。"""
+        doc = self.total
+        self.total += 1
+        for token in tokenize(entry.content):
+            if token not in self.postings:
+                self.postings[token] = array("I")
+            self.postings[token].append(doc)
+        self.docs.append([entry.entry_id, entry.published, entry.content])
+        if len(self.docs) < DocsPerShard:
+            return []
+        return [self._pop_docs()]
+
+    def finish(self, limit: int, pages: int) -> Iterator[tuple[str, Any]]:
+        """返回其余的文件。limit 是每页消息数，pages 是主页面除首页外的页数。"""
+        if self.docs:
+            yield self._pop_docs()
+
+        shards: dict[str, list[str]] = {}
+        for token in self.postings:
+            shards.setdefault(shard_name(token), []).append(token)
+        for name in sorted(shards):
+            tokens = sorted(shards[name])
+            yield name, {t: delta_encode(self.postings[t]) for t in tokens}
+
+        meta = dict(
+            total=self.total,
+            limit=limit,
+            pages=pages,
+            docs_per_shard=DocsPerShard,
+            min_word_len=MinWordLen,
+            max_word_len=MaxWordLen,
+            ascii_prefix_len=AsciiPrefixLen,
+            cjk_shard_bits=CJKShardBits,
+        )
+        yield meta_json, meta
+
+    def _pop_docs(self) -> tuple[str, Any]:
+        name = docs_name((self.total - 1) // DocsPerShard)
+        docs, self.docs = self.docs, []
+        return name, docs
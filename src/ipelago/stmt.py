@@ -1,27 +1,14 @@
 from typing import Final
 
 
-Create_tables: Final = """
+# news 数据库 (见 db.attach_news) 只有 metadata 与 entry 表 (以及 migrate 添加的 content_dict)。
+Create_news_tables: Final = """
 CREATE TABLE IF NOT EXISTS metadata
 (
     name    text   NOT NULL UNIQUE,
     value   text   NOT NULL
 );
 
-CREATE TABLE IF NOT EXISTS feed
-(
-    id            text   PRIMARY KEY COLLATE NOCASE,
-    feed_link     text   NOT NULL UNIQUE,
-    website       text   NOT NULL,
-    title         text   NOT NULL,
-    author_name   text   NOT NULL,
-    updated       text   NOT NULL,
-    notes         text   NOT NULL,
-    parser        text   NOT NULL
-);
-
-CREATE INDEX IF NOT EXISTS idx_feed_updated ON feed(updated);
-
 CREATE TABLE IF NOT EXISTS entry
 (
     id          text   PRIMARY KEY COLLATE NOCASE,
@@ -37,6 +24,22 @@ CREATE INDEX IF NOT EXISTS idx_entry_feed_id ON entry(feed_id);
 CREATE INDEX IF NOT EXISTS idx_entry_published ON entry(published);
 CREATE INDEX IF NOT EXISTS idx_entry_bucket ON entry(bucket);
 CREATE INDEX IF NOT EXISTS idx_entry_bucket_published ON entry(bucket, published);
+"""
+
+Create_tables: Final = Create_news_tables + """
+CREATE TABLE IF NOT EXISTS feed
+(
+    id            text   PRIMARY KEY COLLATE NOCASE,
+    feed_link     text   NOT NULL UNIQUE,
+    website       text   NOT NULL,
+    title         text   NOT NULL,
+    author_name   text   NOT NULL,
+    updated       text   NOT NULL,
+    notes         text   NOT NULL,
+    parser        text   NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_feed_updated ON feed(updated);
 
 CREATE TABLE IF NOT EXISTS tag
 (
@@ -49,14 +52,144 @@ CREATE INDEX IF NOT EXISTS idx_tag_entry_id ON tag(entry_id);
 CREATE UNIQUE INDEX IF NOT EXISTS idx_tag_entry_name_id ON tag(name, entry_id);
 """
 
+# tag_dict 是标签字典，每个标签名只有一行，记录使用次数及最近使用时间，
+# 由 insert_tags 与删除消息时维护，避免每次都对整个 tag 表进行 GROUP BY.
+Create_tag_dict: Final = """
+CREATE TABLE IF NOT EXISTS tag_dict
+(
+    name        text   PRIMARY KEY COLLATE NOCASE,
+    count       int    NOT NULL,
+    last_used   text   NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_tag_dict_count ON tag_dict(count DESC, name);
+CREATE INDEX IF NOT EXISTS idx_tag_dict_last_used ON tag_dict(last_used DESC, name);
+"""
+
+# 按源读取消息时需要按 published 排序，该索引可代替 idx_entry_feed_id.
+Create_idx_entry_feed_published: Final = """
+CREATE INDEX IF NOT EXISTS idx_entry_feed_id_published ON entry(feed_id, published);
+DROP INDEX IF EXISTS idx_entry_feed_id;
+"""
+
+# 订阅消息内容压缩所用的字典 (只用于 news 数据库), id 最大的是当前使用的字典。
+Create_content_dict: Final = """
+CREATE TABLE IF NOT EXISTS content_dict
+(
+    id        INTEGER   PRIMARY KEY,
+    zdict     blob      NOT NULL,
+    created   text      NOT NULL
+);
+"""
+
+# 订阅源的整数主键 (schema v5)，订阅消息通过 feed_key 引用订阅源，
+# 这样修改源的 ID 或名称时只需要更新 feed 表的一行。
+Create_feed_key: Final = """
+ALTER TABLE feed ADD COLUMN key integer;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_feed_key ON feed(key);
+"""
+Create_entry_feed_key: Final = """
+ALTER TABLE entry ADD COLUMN feed_key integer;
+CREATE INDEX IF NOT EXISTS idx_entry_feed_key_published ON entry(feed_key, published);
+"""
+
+# 以下几条用于分批填充 feed_key (见 migrate.py), 每次最多 :limit 行。
+Count_news_without_feed_key: Final = """
+    SELECT count(*) FROM news.entry
+    WHERE feed_key IS NULL and feed_id IN (SELECT id FROM main.feed);
+    """
+Fill_news_feed_key: Final = """
+    UPDATE news.entry SET
+        feed_key=(SELECT key FROM main.feed WHERE feed.id=entry.feed_id),
+        feed_id=NULL,
+        feed_name=''
+    WHERE rowid IN (
+        SELECT rowid FROM news.entry
+        WHERE feed_key IS NULL and feed_id IN (SELECT id FROM main.feed)
+        LIMIT :limit
+    );
+    """
+
+# 订阅消息的已读/未读状态 (schema v6)，未读消息很少，因此采用部分索引，
+# feed.unread 是各个源的未读消息数量。
+Create_read_state: Final = """
+ALTER TABLE entry ADD COLUMN unread integer NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_entry_unread ON entry(published) WHERE unread=1;
+CREATE INDEX IF NOT EXISTS idx_entry_feed_unread
+    ON entry(feed_key, published) WHERE unread=1;
+"""
+Create_feed_read_state: Final = """
+ALTER TABLE feed ADD COLUMN unread integer NOT NULL DEFAULT 0;
+"""
+
+# 重复消息 (schema v7): 同一篇文章可能来自多个源，以规范化链接的哈希 (link_hash)
+# 与内容指纹 (fingerprint) 判断。同一篇文章的消息 story 相同，其中一条是主消息 (dup=0),
+# 其他的是重复消息 (dup=1), 重复消息不单独显示，也不参与搜索。
+Create_story: Final = """
+ALTER TABLE entry ADD COLUMN link_hash text;
+ALTER TABLE entry ADD COLUMN fingerprint text;
+ALTER TABLE entry ADD COLUMN story text;
+ALTER TABLE entry ADD COLUMN dup integer NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_entry_link_hash ON entry(link_hash) WHERE dup=0;
+CREATE INDEX IF NOT EXISTS idx_entry_fingerprint ON entry(fingerprint) WHERE dup=0;
+CREATE INDEX IF NOT EXISTS idx_entry_story ON entry(story) WHERE dup=0;
+CREATE INDEX IF NOT EXISTS idx_entry_dup ON entry(story) WHERE dup=1;
+"""
+
+# 公开消息按 (published, id) 排序 (schema v8)，发布时以此作为游标，
+# 发布时间相同的消息也不会被跳过。该索引可代替 idx_entry_bucket_published.
+Create_idx_entry_bucket_published_id: Final = """
+CREATE INDEX IF NOT EXISTS idx_entry_bucket_published_id
+    ON entry(bucket, published, id);
+DROP INDEX IF EXISTS idx_entry_bucket_published;
+"""
+
+Fill_tag_dict: Final = """
+    INSERT OR REPLACE INTO tag_dict (name, count, last_used)
+    SELECT tag.name, count(*), coalesce(max(entry.published), '')
+    FROM tag LEFT JOIN entry ON tag.entry_id=entry.id
+    GROUP BY tag.name;
+    """
+
+# 用于检查查询计划 (见 bench.py), {schema} 是 PRAGMA database_list 中的数据库名。
+Get_partial_indexes: Final = """
+    SELECT name FROM {schema}.sqlite_master WHERE type='index' and sql LIKE '% WHERE %';
+    """
+
+# {schema} 是数据库名 (main, news 等)。
+Get_table_name: Final = """
+    SELECT name FROM {schema}.sqlite_master WHERE type='table' and name=?;
+    """
+Get_schema_metadata: Final = "SELECT value FROM {schema}.metadata WHERE name=?;"
+
 Insert_metadata: Final = "INSERT INTO metadata (name, value) VALUES (?, ?);"
 Get_metadata: Final = "SELECT value FROM metadata WHERE name=?;"
 Update_metadata: Final = "UPDATE metadata SET value=:value WHERE name=:name;"
+Upsert_metadata: Final = """
+    INSERT INTO metadata (name, value) VALUES (:name, :value)
+    ON CONFLICT(name) DO UPDATE SET value=excluded.value;
+    """
+Delete_metadata: Final = "DELETE FROM metadata WHERE name=?;"
 
 Insert_tag: Final = """
     INSERT INTO tag (name, entry_id) VALUES (:name, :entry_id);
     """
 
+Upsert_tag_dict: Final = """
+    INSERT INTO tag_dict (name, count, last_used) VALUES (:name, 1, :last_used)
+    ON CONFLICT(name) DO UPDATE SET
+    count=count+1, last_used=max(last_used, excluded.last_used);
+    """
+
+Decrease_tag_dict_by_entry_id: Final = """
+    UPDATE tag_dict SET count=count-1
+    WHERE name IN (SELECT name FROM tag WHERE entry_id=?);
+    """
+
+Delete_unused_tags: Final = """
+    DELETE FROM tag_dict WHERE count<=0;
+    """
+
 Get_by_tag: Final = """
     SELECT id, content, link, published, feed_id, feed_name, bucket
     FROM tag, entry
@@ -69,13 +202,43 @@ Count_by_tag: Final = """
     ORDER BY entry.published;
     """
 
+# 以下几条用于多标签查询 (AND/OR/NOT)，由 db.get_by_tag_query 拼接成一条 SQL.
+# 每组条件从最少使用的标签 (t0) 开始，通过 CROSS JOIN 固定连接顺序，
+# 每个连接都是对 idx_tag_entry_name_id 的一次查找。
+Tag_query_clause: Final = """
+    SELECT t0.entry_id FROM tag AS t0{joins}
+    WHERE t0.name=:{name}{excludes}
+    """
+Tag_query_join: Final = """
+    CROSS JOIN tag AS t{i} ON t{i}.name=:{name} and t{i}.entry_id=t0.entry_id"""
+Tag_query_exclude: Final = """
+    and NOT EXISTS (
+        SELECT 1 FROM tag WHERE tag.name=:{name} and tag.entry_id=t0.entry_id
+    )"""
+Tag_query_bucket: Final = """
+    WHERE entry.bucket=:bucket"""
+Get_by_tag_query: Final = """
+    WITH matched(entry_id) AS ({clauses})
+    SELECT id, content, link, published, feed_id, feed_name, bucket,
+           count(*) OVER () AS total
+    FROM matched CROSS JOIN entry ON entry.id=matched.entry_id{bucket}
+    ORDER BY entry.published DESC LIMIT :limit;
+    """
+
+Get_tag_count: Final = """
+    SELECT count FROM tag_dict WHERE name=?;
+    """
+
 Search_entry_content: Final = """
-    SELECT * FROM entry WHERE content LIKE :content
+    SELECT * FROM main.entry WHERE content LIKE :content
+    UNION ALL
+    SELECT * FROM news.entry WHERE dup=0 and unpack_content(content) LIKE :content
     ORDER BY published DESC LIMIT :limit;
     """
 Count_entry_content: Final = """
-    SELECT count(*) FROM entry WHERE content LIKE :content
-    ORDER BY published;
+    SELECT (SELECT count(*) FROM main.entry WHERE content LIKE :content)
+         + (SELECT count(*) FROM news.entry
+            WHERE dup=0 and unpack_content(content) LIKE :content);
     """
 
 Get_by_tag_bucket: Final = """
@@ -99,12 +262,67 @@ Count_entry_content_bucket: Final = """
     ORDER BY published;
     """
 
+Search_news_content: Final = """
+    SELECT * FROM news.entry
+    WHERE bucket='News' and dup=0 and unpack_content(content) LIKE :content
+    ORDER BY published DESC LIMIT :limit;
+    """
+Count_news_content: Final = """
+    SELECT count(*) FROM news.entry
+    WHERE bucket='News' and dup=0 and unpack_content(content) LIKE :content;
+    """
+
 Get_all_tags: Final = """
-    SELECT name FROM tag GROUP BY name;
+    SELECT name, count FROM tag_dict ORDER BY name LIMIT :limit OFFSET :offset;
+    """
+Get_all_tags_by_count: Final = """
+    SELECT name, count FROM tag_dict ORDER BY count DESC, name
+    LIMIT :limit OFFSET :offset;
     """
-Get_one_tag: Final = """
-    SELECT name FROM tag WHERE name LIKE ?
-    GROUP BY name;
+Get_all_tags_by_recent: Final = """
+    SELECT name, count FROM tag_dict ORDER BY last_used DESC, name
+    LIMIT :limit OFFSET :offset;
+    """
+Count_all_tags: Final = """
+    SELECT count(*) FROM tag_dict;
+    """
+
+# 前缀查找，采用 [lower, upper) 区间，可利用 tag_dict 主键索引。
+Get_tags_by_prefix: Final = """
+    SELECT name, count FROM tag_dict WHERE name >= :lower and name < :upper
+    ORDER BY name LIMIT :limit OFFSET :offset;
+    """
+Get_tags_by_prefix_by_count: Final = """
+    SELECT name, count FROM tag_dict WHERE name >= :lower and name < :upper
+    ORDER BY count DESC, name LIMIT :limit OFFSET :offset;
+    """
+Get_tags_by_prefix_by_recent: Final = """
+    SELECT name, count FROM tag_dict WHERE name >= :lower and name < :upper
+    ORDER BY last_used DESC, name LIMIT :limit OFFSET :offset;
+    """
+Count_tags_by_prefix: Final = """
+    SELECT count(*) FROM tag_dict WHERE name >= :lower and name < :upper;
+    """
+
+# 包含 name 但不以 name 开头的标签 (前缀匹配的标签由 Get_tags_by_prefix 获取)。
+Get_tags_contain: Final = """
+    SELECT name, count FROM tag_dict
+    WHERE name LIKE :name and (name < :lower or name >= :upper)
+    ORDER BY name LIMIT :limit OFFSET :offset;
+    """
+Get_tags_contain_by_count: Final = """
+    SELECT name, count FROM tag_dict
+    WHERE name LIKE :name and (name < :lower or name >= :upper)
+    ORDER BY count DESC, name LIMIT :limit OFFSET :offset;
+    """
+Get_tags_contain_by_recent: Final = """
+    SELECT name, count FROM tag_dict
+    WHERE name LIKE :name and (name < :lower or name >= :upper)
+    ORDER BY last_used DESC, name LIMIT :limit OFFSET :offset;
+    """
+Count_tags_contain: Final = """
+    SELECT count(*) FROM tag_dict
+    WHERE name LIKE :name and (name < :lower or name >= :upper);
     """
 
 Get_feed_by_id: Final = """
@@ -119,17 +337,10 @@ Update_feed_id: Final = """
     UPDATE feed SET id=:newid WHERE id=:oldid;
     """
 
-Update_entry_feed_id: Final = """
-    UPDATE entry SET feed_id=:newid WHERE feed_id=:oldid;
-    """
 Update_feed_title: Final = """
     UPDATE feed SET title=:title WHERE id=:id;
     """
 
-Update_entry_feed_name: Final = """
-    UPDATE entry SET feed_name=:feed_name WHERE feed_id=:feed_id;
-    """
-
 Get_feed_id: Final = """
     SELECT id FROM feed WHERE id=?;
     """
@@ -140,16 +351,36 @@ Get_feed_link: Final = """
 
 Insert_feed: Final = """
     INSERT INTO feed (
-        id, feed_link, website, title, author_name, updated, notes, parser
+        id, feed_link, website, title, author_name, updated, notes, parser, key
     ) VALUES (
-        :id, :feed_link, :website, :title, :author_name, :updated, :notes, :parser
+        :id, :feed_link, :website, :title, :author_name, :updated, :notes, :parser,
+        (SELECT coalesce(max(key), 0) + 1 FROM feed)
     );
     """
 
 Insert_my_feed: Final = """
     INSERT INTO feed (
-        id, feed_link, website, title, author_name, updated, notes, parser
-    ) VALUES (:id, :feed_link, "", :title, '', '', '', '');
+        id, feed_link, website, title, author_name, updated, notes, parser, key
+    ) VALUES (
+        :id, :feed_link, "", :title, '', '', '', '',
+        (SELECT coalesce(max(key), 0) + 1 FROM feed)
+    );
+    """
+
+Get_feed_keys: Final = """
+    SELECT key, id, title FROM main.feed WHERE key IS NOT NULL;
+    """
+Count_feeds_without_key: Final = """
+    SELECT count(*) FROM feed WHERE key IS NULL;
+    """
+Get_feeds_without_key: Final = """
+    SELECT id FROM feed WHERE key IS NULL ORDER BY rowid LIMIT :limit;
+    """
+Get_max_feed_key: Final = """
+    SELECT coalesce(max(key), 0) FROM feed;
+    """
+Set_feed_key: Final = """
+    UPDATE feed SET key=:key WHERE id=:id;
     """
 
 Update_feed_parser: Final = """
@@ -193,6 +424,17 @@ Insert_entry: Final = """
         :id, :content, :link, :published, :feed_id, :feed_name, :bucket
     );
     """
+# 订阅消息只保存 feed_key, 源的 ID 与名称从 feed 表获取 (见 model.feed_cache)。
+Insert_news_entry: Final = """
+    INSERT INTO news.entry (
+        id, content, link, published, feed_id, feed_name, bucket, feed_key, unread,
+        link_hash, fingerprint, story, dup
+    ) VALUES (
+        :id, :content, :link, :published, NULL, '', :bucket,
+        (SELECT key FROM main.feed WHERE id=:feed_id), :unread,
+        :link_hash, :fingerprint, :story, :dup
+    );
+    """
 
 Insert_my_entry: Final = """
     INSERT INTO entry (
@@ -203,14 +445,19 @@ Insert_my_entry: Final = """
     """
 
 # first 是指按照消息发布时间最新的信息。
+# 我的消息分布在两个 bucket 中，采用 UNION ALL 使两边都能利用
+# idx_entry_bucket_published_id 并按顺序合并 (用 OR 或 IN 则会扫描整个索引)。
 Get_my_first_entry: Final = """
-    SELECT * FROM entry WHERE bucket='Public' or bucket='Private'
+    SELECT * FROM entry WHERE bucket='Public'
+    UNION ALL
+    SELECT * FROM entry WHERE bucket='Private'
     ORDER BY published DESC LIMIT 1;
     """
 
 Get_my_next_entry: Final = """
-    SELECT * FROM entry
-    WHERE (bucket='Public' or bucket='Private') and published < :published
+    SELECT * FROM entry WHERE bucket='Public' and published < :published
+    UNION ALL
+    SELECT * FROM entry WHERE bucket='Private' and published < :published
     ORDER BY published DESC LIMIT 1;
     """
 
@@ -220,8 +467,8 @@ My_cursor_goto: Final = """
     ORDER BY published LIMIT 1;
     """
 News_cursor_goto: Final = """
-    SELECT * FROM entry
-    WHERE bucket='News' and published > :published
+    SELECT * FROM news.entry
+    WHERE bucket='News' and dup=0 and published > :published
     ORDER BY published LIMIT 1;
     """
 
@@ -229,59 +476,98 @@ Get_entries_limit: Final = """
     SELECT * FROM entry WHERE bucket=:bucket
     ORDER BY published DESC LIMIT :limit;
     """
+Get_news_limit: Final = """
+    SELECT * FROM news.entry WHERE bucket='News' and dup=0
+    ORDER BY published DESC LIMIT :limit;
+    """
 
 Get_news_next_entry: Final = """
-    SELECT * FROM entry
-    WHERE bucket='News' and published < :published
+    SELECT * FROM news.entry
+    WHERE bucket='News' and dup=0 and published < :published
     ORDER BY published DESC LIMIT 1;
     """
 
-Get_entry_by_id: Final = """
-    SELECT * FROM entry WHERE id=?;
-    """
-
+# 前缀查找采用 [lower, upper) 区间，可利用主键索引 (id LIKE 'x%' 不一定能利用索引)。
 Get_entry_by_id_prefix: Final = """
-    SELECT * FROM entry WHERE id LIKE ?;
+    SELECT * FROM entry WHERE id >= :lower and id < :upper LIMIT :limit;
     """
+Get_news_by_id_prefix: Final = """
+    SELECT * FROM news.entry WHERE id >= :lower and id < :upper LIMIT :limit;
+    """
+# '+bucket' 使 SQLite 不采用 idx_entry_bucket, 而是采用主键索引。
 Get_entry_in_bucket: Final = """
-    SELECT * FROM entry WHERE bucket=:bucket and id LIKE :id;
+    SELECT * FROM entry WHERE id >= :lower and id < :upper and +bucket=:bucket
+    LIMIT :limit;
     """
 
-Count_by_feed_id: Final = """
-    SELECT count(*) FROM entry WHERE feed_id=?;
+# 用于计算最短唯一前缀，需要同时检查 main 与 news 两个数据库。
+Get_prev_entry_id: Final = """
+    SELECT max(id) FROM (
+        SELECT max(id) AS id FROM main.entry WHERE id < :id
+        UNION ALL
+        SELECT max(id) AS id FROM news.entry WHERE id < :id
+    );
+    """
+Get_next_entry_id: Final = """
+    SELECT min(id) FROM (
+        SELECT min(id) AS id FROM main.entry WHERE id > :id
+        UNION ALL
+        SELECT min(id) AS id FROM news.entry WHERE id > :id
+    );
     """
 
-Get_public_limit: Final = """
-    SELECT * FROM entry
-    WHERE bucket='Public' and published > :published
-    ORDER BY published LIMIT :limit;
+Count_news_by_feed_id: Final = """
+    SELECT count(*) FROM news.entry
+    WHERE feed_key=(SELECT key FROM main.feed WHERE id=?);
     """
 
+# 用于发布，按 (published, id) 排序，即使发布时间相同也不会遗漏或重复。
+Get_public_entries: Final = """
+    SELECT * FROM entry WHERE bucket='Public' ORDER BY published, id;
+    """
+
+# 同上，同时生成归档页面时使用，tags 是以空格分隔的标签。
+Get_public_with_tags: Final = """
+    SELECT entry.*,
+        (SELECT group_concat(tag.name, ' ') FROM tag WHERE tag.entry_id=entry.id)
+        AS tags
+    FROM entry WHERE bucket='Public' ORDER BY published, id;
+    """
+
+# 按日期前缀查找，采用 [lower, upper) 区间 (见 db.date_range)，可利用索引。
 Get_by_date: Final = """
     SELECT * FROM entry
-    WHERE bucket=:bucket and published LIKE :published
+    WHERE bucket=:bucket and published >= :lower and published < :upper
     ORDER BY published DESC LIMIT :limit;
     """
 
 Get_by_date_my_buckets: Final = """
     SELECT * FROM entry
-    WHERE (bucket='Public' or bucket='Private') and published LIKE :published
+    WHERE bucket='Public' and published >= :lower and published < :upper
+    UNION ALL
+    SELECT * FROM entry
+    WHERE bucket='Private' and published >= :lower and published < :upper
     ORDER BY published DESC LIMIT :limit;
     """
 
 Count_by_date: Final = """
     SELECT count(*) FROM entry
-    WHERE bucket=:bucket and published LIKE :published;
+    WHERE bucket=:bucket and published >= :lower and published < :upper;
     """
 
 Count_all_entries: Final = """
     SELECT count(*) FROM entry WHERE bucket=?;
     """
 
-Move_entry_to_fav: Final = """
-    UPDATE entry SET
-    id=:newid, feed_id='Fav', bucket='Fav'
-    WHERE id=:oldid;
+# 从 news 数据库复制到 main 数据库，然后删除 (在同一个事务中)。
+Copy_news_to_fav: Final = """
+    INSERT INTO main.entry (
+        id, content, link, published, feed_id, feed_name, bucket
+    )
+    SELECT :newid, unpack_content(content), link, published, 'Fav',
+        coalesce(feed.title, entry.feed_name), 'Fav'
+    FROM news.entry LEFT JOIN main.feed ON feed.key=entry.feed_key
+    WHERE entry.id=:oldid;
     """
 
 Update_entry_bucket: Final = """
@@ -299,12 +585,302 @@ Delete_tag_entry: Final = """
 Delete_entry: Final = """
     DELETE FROM entry WHERE id=?;
     """
+Delete_news_entry: Final = """
+    DELETE FROM news.entry WHERE id=?;
+    """
 
 Delete_entries: Final = """
-    DELETE FROM entry WHERE feed_id=?;
+    DELETE FROM news.entry WHERE feed_key=(SELECT key FROM main.feed WHERE id=?);
     """
 
 Get_news_by_feed: Final = """
-    SELECT * FROM entry WHERE feed_id=:feed_id
+    SELECT * FROM news.entry
+    WHERE feed_key=(SELECT key FROM main.feed WHERE id=:feed_id)
     ORDER BY published DESC LIMIT :limit;
     """
+
+# 以下几条用于导出/导入 (见 export.py), 其中 {table} 只能是 export.ExportTables 之一。
+Export_table: Final = """
+    SELECT * FROM {table} ORDER BY rowid;
+    """
+
+Table_info: Final = """
+    PRAGMA table_info({table});
+    """
+
+Import_row: Final = """
+    INSERT OR REPLACE INTO {table} ({names}) VALUES ({values});
+    """
+
+# 订阅源已存在时保留其 key, 以免该源的订阅消息失去关联。
+Import_feed_row: Final = """
+    INSERT INTO feed ({names}) VALUES ({values})
+    ON CONFLICT(id) DO UPDATE SET {updates};
+    """
+
+# 订阅消息导出时带上源的 ID 与名称，导入时再根据源的 ID 找到 feed_key.
+Export_news_entries: Final = """
+    SELECT entry.id, content, link, published,
+        coalesce(feed.id, entry.feed_id) AS feed_id,
+        coalesce(feed.title, entry.feed_name) AS feed_name,
+        bucket, entry.unread, link_hash, fingerprint, story, dup
+    FROM news.entry LEFT JOIN main.feed ON feed.key=entry.feed_key
+    ORDER BY entry.rowid;
+    """
+
+Delete_tag_dict: Final = """
+    DELETE FROM tag_dict;
+    """
+
+# 以下几条用于归档 (见 retention.py), 过期消息的 id 先放进临时表 expired.
+Create_temp_expired: Final = """
+    CREATE TEMP TABLE IF NOT EXISTS expired (id text PRIMARY KEY COLLATE NOCASE);
+    """
+Delete_temp_expired: Final = """
+    DELETE FROM temp.expired;
+    """
+Count_temp_expired: Final = """
+    SELECT count(*) FROM temp.expired;
+    """
+
+Expire_by_feed_age: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM news.entry
+    WHERE feed_key=(SELECT key FROM main.feed WHERE id=:feed_id)
+    and published < :published;
+    """
+Expire_by_feed_count: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM news.entry
+    WHERE feed_key=(SELECT key FROM main.feed WHERE id=:feed_id)
+    ORDER BY published DESC LIMIT -1 OFFSET :count;
+    """
+Expire_by_bucket_age: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM main.entry WHERE bucket=:bucket and published < :published;
+    """
+Expire_by_bucket_count: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM main.entry WHERE bucket=:bucket
+    ORDER BY published DESC LIMIT -1 OFFSET :count;
+    """
+Expire_news_by_age: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM news.entry WHERE bucket='News' and published < :published;
+    """
+Expire_news_by_count: Final = """
+    INSERT OR IGNORE INTO temp.expired (id)
+    SELECT id FROM news.entry WHERE bucket='News'
+    ORDER BY published DESC LIMIT -1 OFFSET :count;
+    """
+
+Archive_expired_entries: Final = """
+    INSERT OR REPLACE INTO archive.entry
+    SELECT * FROM main.entry WHERE id IN (SELECT id FROM temp.expired);
+    """
+Archive_expired_news: Final = """
+    INSERT OR REPLACE INTO archive.entry (
+        id, content, link, published, feed_id, feed_name, bucket
+    )
+    SELECT entry.id, unpack_content(content), link, published,
+        coalesce(feed.id, entry.feed_id), coalesce(feed.title, entry.feed_name), bucket
+    FROM news.entry LEFT JOIN main.feed ON feed.key=entry.feed_key
+    WHERE entry.id IN (SELECT id FROM temp.expired);
+    """
+Archive_expired_tags: Final = """
+    INSERT OR IGNORE INTO archive.tag
+    SELECT * FROM main.tag WHERE entry_id IN (SELECT id FROM temp.expired);
+    """
+Archive_expired_tag_dict: Final = """
+    INSERT INTO archive.tag_dict (name, count, last_used)
+    SELECT tag.name, count(*), max(entry.published)
+    FROM main.tag AS tag, main.entry AS entry
+    WHERE tag.entry_id IN (SELECT id FROM temp.expired) and tag.entry_id=entry.id
+    GROUP BY tag.name
+    ON CONFLICT(name) DO UPDATE SET
+    count=count+excluded.count, last_used=max(last_used, excluded.last_used);
+    """
+Decrease_tag_dict_expired: Final = """
+    UPDATE main.tag_dict SET count=count-(
+        SELECT count(*) FROM main.tag
+        WHERE tag.name=tag_dict.name and tag.entry_id IN (SELECT id FROM temp.expired)
+    )
+    WHERE name IN (
+        SELECT name FROM main.tag WHERE entry_id IN (SELECT id FROM temp.expired)
+    );
+    """
+Delete_expired_tags: Final = """
+    DELETE FROM main.tag WHERE entry_id IN (SELECT id FROM temp.expired);
+    """
+Delete_expired_entries: Final = """
+    DELETE FROM main.entry WHERE id IN (SELECT id FROM temp.expired);
+    """
+Delete_expired_news: Final = """
+    DELETE FROM news.entry WHERE id IN (SELECT id FROM temp.expired);
+    """
+
+Attach_archive: Final = """
+    ATTACH DATABASE ? AS archive;
+    """
+Attach_news: Final = """
+    ATTACH DATABASE ? AS news;
+    """
+Detach_news: Final = """
+    DETACH DATABASE news;
+    """
+# 归档数据库的订阅消息也保存在 main.entry 中，附加一个空的 news 数据库，
+# 使涉及 news.entry 的 SQL (比如搜索全部消息) 也可以在归档数据库中执行。
+Attach_empty_news: Final = """
+    ATTACH DATABASE ':memory:' AS news;
+    """
+Create_empty_news_entry: Final = """
+    CREATE TABLE news.entry AS SELECT * FROM main.entry WHERE 0;
+    """
+Set_journal_wal: Final = """
+    PRAGMA {schema}.journal_mode=WAL;
+    """
+
+# aiodb 的写入线程把多个写请求合并在一个事务中，每个请求一个保存点，
+# 出错时只回滚该请求。
+Begin_request: Final = """
+    BEGIN;
+    """
+Savepoint_request: Final = """
+    SAVEPOINT request;
+    """
+Rollback_request: Final = """
+    ROLLBACK TO request;
+    """
+Release_request: Final = """
+    RELEASE request;
+    """
+Get_database_list: Final = """
+    PRAGMA database_list;
+    """
+
+# 订阅消息从 main 数据库移动到 news 数据库 (schema v3)
+# 分批移动订阅消息 (见 migrate.py), 两条 SQL 选中相同的 :limit 行，在同一个事务中执行。
+Count_main_news_entries: Final = """
+    SELECT count(*) FROM main.entry WHERE bucket='News';
+    """
+Move_news_entries: Final = """
+    INSERT OR REPLACE INTO news.entry (
+        id, content, link, published, feed_id, feed_name, bucket
+    )
+    SELECT id, content, link, published, feed_id, feed_name, bucket
+    FROM main.entry WHERE bucket='News' ORDER BY rowid LIMIT :limit;
+    """
+Delete_main_news_entries: Final = """
+    DELETE FROM main.entry WHERE rowid IN (
+        SELECT rowid FROM main.entry WHERE bucket='News' ORDER BY rowid LIMIT :limit
+    );
+    """
+Detach_archive: Final = """
+    DETACH DATABASE archive;
+    """
+
+Get_auto_vacuum: Final = """
+    PRAGMA main.auto_vacuum;
+    """
+Set_auto_vacuum_incremental: Final = """
+    PRAGMA main.auto_vacuum=INCREMENTAL;
+    """
+Incremental_vacuum: Final = """
+    PRAGMA main.incremental_vacuum;
+    """
+Incremental_vacuum_news: Final = """
+    PRAGMA news.incremental_vacuum;
+    """
+Vacuum: Final = """
+    VACUUM;
+    """
+
+Get_content_dicts: Final = """
+    SELECT id, zdict FROM news.content_dict ORDER BY id;
+    """
+Insert_content_dict: Final = """
+    INSERT INTO news.content_dict (zdict, created) VALUES (:zdict, :created);
+    """
+Delete_content_dicts_except: Final = """
+    DELETE FROM news.content_dict WHERE id != :id;
+    """
+Get_news_content_sample: Final = """
+    SELECT content FROM news.entry WHERE bucket='News'
+    ORDER BY published DESC LIMIT :limit;
+    """
+Get_news_content_batch: Final = """
+    SELECT rowid, content FROM news.entry WHERE rowid > :rowid
+    ORDER BY rowid LIMIT :limit;
+    """
+Update_news_content: Final = """
+    UPDATE news.entry SET content=:content WHERE rowid=:rowid;
+    """
+
+Get_unread_news: Final = """
+    SELECT * FROM news.entry WHERE unread=1 ORDER BY published LIMIT :limit;
+    """
+Get_unread_news_by_feed: Final = """
+    SELECT * FROM news.entry
+    WHERE unread=1 and feed_key=(SELECT key FROM main.feed WHERE id=:feed_id)
+    ORDER BY published LIMIT :limit;
+    """
+Mark_news_read: Final = """
+    UPDATE news.entry SET unread=0 WHERE id=?;
+    """
+Decrease_feed_unread: Final = """
+    UPDATE main.feed SET unread=max(unread - :n, 0) WHERE key=:key;
+    """
+Get_read_links: Final = """
+    SELECT link FROM news.entry
+    WHERE unread=0 and feed_key=(SELECT key FROM main.feed WHERE id=?);
+    """
+Refresh_feed_unread: Final = """
+    UPDATE main.feed SET unread=(
+        SELECT count(*) FROM news.entry WHERE feed_key=feed.key and unread=1
+    ) WHERE id=?;
+    """
+Refresh_all_unread: Final = """
+    UPDATE main.feed SET unread=(
+        SELECT count(*) FROM news.entry WHERE feed_key=feed.key and unread=1
+    );
+    """
+Count_all_unread: Final = """
+    SELECT coalesce(sum(unread), 0) FROM main.feed;
+    """
+
+Get_story_by_hash: Final = """
+    SELECT coalesce(
+        (SELECT story FROM news.entry WHERE dup=0 and link_hash=:link_hash LIMIT 1),
+        (SELECT story FROM news.entry WHERE dup=0 and fingerprint=:fingerprint LIMIT 1)
+    ) AS story;
+    """
+Get_story_sources: Final = """
+    SELECT feed_key, link FROM news.entry
+    WHERE dup=1 and story=(SELECT story FROM news.entry WHERE id=:id) and id<>:id
+    UNION ALL
+    SELECT feed_key, link FROM news.entry
+    WHERE dup=0 and story=(SELECT story FROM news.entry WHERE id=:id) and id<>:id;
+    """
+# 主消息被删除后，从剩下的重复消息中选一条作为新的主消息。
+Promote_orphan_duplicates: Final = """
+    UPDATE news.entry SET dup=0 WHERE rowid IN (
+        SELECT min(d.rowid) FROM news.entry AS d
+        WHERE d.dup=1 and NOT EXISTS (
+            SELECT 1 FROM news.entry AS c WHERE c.story=d.story and c.dup=0
+        )
+        GROUP BY d.story
+    );
+    """
+# 未计算 story 的消息都是 dup=0, 这样可以利用部分索引 idx_entry_story.
+Count_news_without_story: Final = """
+    SELECT count(*) FROM news.entry WHERE dup=0 and story IS NULL;
+    """
+Get_news_without_story: Final = """
+    SELECT rowid, id, content, link FROM news.entry
+    WHERE dup=0 and story IS NULL LIMIT :limit;
+    """
+Update_news_story: Final = """
+    UPDATE news.entry
+    SET link_hash=:link_hash, fingerprint=:fingerprint, story=:story
+    WHERE rowid=:rowid;
+    """
@@ -1,5 +1,7 @@
+import json
+from pathlib import Path
 import sqlite3
-from typing import Callable, Final
+from typing import Callable, Final, Iterator
 import arrow
 import pyperclip
 import requests
@@ -7,14 +9,19 @@ import feedparser
 from feedparser import FeedParserDict
 from result import Err, Ok, Result
 from . import db
+from . import retention
 from . import stmt
 from .model import (
+    RFC3339,
     Bucket,
     Feed,
     FeedEntry,
     ShortStrSizeLimit,
+    TagClause,
     extract_tags,
+    my_bucket,
     new_my_msg,
+    parse_tag_query,
     utf8_byte_truncate,
 )
 from ipelago.parser import feed_to_entries
@@ -92,16 +99,19 @@ def news_cursor_goto(date_prefix: str, conn: Conn) -> None:
         case Ok(msg):
             cfg["news_cursor"] = msg.published
             db.update_cfg(cfg, conn)
+            db.fill_short_ids([msg], conn)
             print_news_short_id(msg, cfg["news_show_link"])
 
 
 def print_news(msg: FeedEntry, show_link: bool, short_id: bool) -> None:
-    entry_id = msg.entry_id[:4] if short_id else msg.entry_id
+    entry_id = (msg.short_id or msg.entry_id[:4]) if short_id else msg.entry_id
     date = arrow.get(msg.published).format("YYYY-MM-DD")
     title = f"[{entry_id}] ({date}) {msg.feed_name}"
     print(f"{title}\n{msg.content}")
     if show_link and msg.link:
         print(f"[link] {msg.link}")
+    if msg.sources:
+        print(f"[also in] {', '.join(msg.sources)}")
     print()
 
 
@@ -130,6 +140,7 @@ def print_news_next_msg(conn: Conn) -> None:
         case Ok(msg):
             cfg["news_cursor"] = msg.published
             db.update_cfg(cfg, conn)
+            db.fill_short_ids([msg], conn)
             print_news_short_id(msg, cfg["news_show_link"])
 
 
@@ -206,6 +217,86 @@ def post_msg(msg: str, bucket: Bucket) -> None:
                 db.update_my_feed_date(conn)
 
 
+def new_batch_msg(item: dict, bucket: Bucket) -> Result[FeedEntry, str]:
+    """item 是 JSONL 文件中的一行，例如 {"content": "...", "private": true}"""
+    content = item.get("content")
+    if not isinstance(content, str) or not content.strip():
+        return Err("require 'content'")
+    if "private" in item:
+        bucket = my_bucket(bool(item["private"]))
+
+    match new_my_msg("", content, bucket):
+        case Err(e):
+            return Err(e)
+        case Ok(entry):
+            if item.get("published"):
+                try:
+                    entry.published = arrow.get(item["published"]).format(RFC3339)
+                except (arrow.parser.ParserError, TypeError, ValueError) as e:
+                    return Err(f"published: {e}")
+            return Ok(entry)
+
+
+def read_batch(
+    path: Path, bucket: Bucket
+) -> Iterator[tuple[str, Result[FeedEntry, str]]]:
+    """Yield (position, entry).
+
+    path 可以是 JSONL 文件 (每行一条消息)，也可以是文件夹 (每个文件一条消息)。
+    无法读取或不是 UTF-8 的文件 (或行) 作为错误返回。
+    """
+    if path.is_dir():
+        for file in sorted(path.iterdir()):
+            if file.is_file() and not file.name.startswith("."):
+                try:
+                    content = file.read_text(encoding="utf-8")
+                except (UnicodeDecodeError, OSError) as e:
+                    yield file.name, Err(str(e))
+                    continue
+                yield file.name, new_batch_msg({"content": content}, bucket)
+        return
+
+    with open(path, "rb") as f:
+        for i, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line.decode("utf-8"))
+            except ValueError as e:  # 包括 UnicodeDecodeError
+                yield f"line {i}", Err(str(e))
+                continue
+            if not isinstance(item, dict):
+                item = {}
+            yield f"line {i}", new_batch_msg(item, bucket)
+
+
+def post_batch(path: Path, bucket: Bucket) -> None:
+    """批量发送消息，先检查全部消息，只要有一条不合格就全部不发送。"""
+    entries: list[FeedEntry] = []
+    errors = 0
+    for pos, result in read_batch(path, bucket):
+        match result:
+            case Err(e):
+                print(f"Error: [{pos}] {e}")
+                errors += 1
+            case Ok(entry):
+                entries.append(entry)
+
+    if errors:
+        print(f"\n{errors} error(s), nothing was posted.")
+        return
+    if not entries:
+        print("Not Found. (没有找到消息)")
+        return
+
+    with db.connect_db() as conn:
+        for entry, entry_id in zip(entries, db.reserve_ids(len(entries), conn)):
+            entry.entry_id = entry_id
+        n_tags = db.insert_my_entries(entries, conn)
+        db.update_my_feed_date(conn)
+    print(f"OK. Posted {len(entries)} messages with {n_tags} tags.")
+
+
 def retrieve_feed(feed_url: str, conn: Conn) -> Result[FeedParserDict, str]:
     """每次 retrieve_feed 之前都应该检查更新频率，避免浪费网络资源。"""
 
@@ -270,6 +361,37 @@ def update_all_feeds(conn: Conn) -> None:
                 print(e)
             case Ok():
                 retrieve_and_update(feed, False, conn)
+    archive_expired(conn, verbose=False)
+
+
+def archive_expired(conn: Conn, verbose: bool = True) -> None:
+    match retention.archive_expired(conn):
+        case Err(e):
+            print(f"Error: {e}")
+        case Ok(n):
+            if n or verbose:
+                print(f"Archived {n} expired item(s) to {retention.archive_path}")
+
+
+def print_policy(name: str, policy: retention.Policy) -> None:
+    max_age = f"{policy['max_age']} days" if policy["max_age"] else "unlimited"
+    max_count = policy["max_count"] if policy["max_count"] else "unlimited"
+    print(f"[{name}] max-age: {max_age}, max-count: {max_count}")
+
+
+def print_retention(conn: Conn) -> None:
+    policies = retention.get_retention(conn)
+    print(f"\n[Archive] {retention.archive_path}\n")
+    if not policies["buckets"] and not policies["feeds"]:
+        print("尚未设置保留策略。")
+        print("Try 'ago archive -bucket news -max-age 30' to set a policy.\n")
+        return
+
+    for bucket, policy in policies["buckets"].items():
+        print_policy(f"bucket:{bucket}", policy)
+    for feed_id, policy in policies["feeds"].items():
+        print_policy(f"feed:{feed_id}", policy)
+    print()
 
 
 # 如果指定 feed_id, 则只显示指定的一个源，否则显示全部源的信息。
@@ -285,7 +407,32 @@ def print_subs_list(conn: Conn, feed_id: str = "") -> None:
 
     print()
     for feed in sl:
-        print(f"[{feed.feed_id}] {feed.title}\n{feed.feed_link}\n")
+        unread = f" (unread: {feed.unread})" if feed.unread else ""
+        print(f"[{feed.feed_id}] {feed.title}{unread}\n{feed.feed_link}\n")
+
+
+def print_unread_news(feed_id: str, limit: int, show_link: bool, conn: Conn) -> None:
+    """按时间从旧到新显示未读消息，显示后即标记为已读。"""
+    if feed_id and not db.get_subs_list(conn, feed_id):
+        print(f"Not Found: {feed_id}")
+        return
+
+    entries = db.read_unread_news(feed_id, limit, conn)
+    if not entries:
+        print("没有未读消息。(No unread news.)")
+        return
+
+    db.fill_short_ids(entries, conn)
+    for entry in entries:
+        print_news_short_id(entry, show_link)
+
+    if feed_id:
+        left = db.get_subs_list(conn, feed_id)[0].unread
+    else:
+        left = db.count_unread(conn)
+    print(f"\n{left} unread left. (还有 {left} 条未读消息)")
+    if left:
+        print("Try 'ago news -l' to see unread counts of each feed.")
 
 
 def print_feeds_by_title(conn: Conn, title: str) -> None:
@@ -303,6 +450,10 @@ def get_one_from(entries: list[FeedEntry], prefix: str) -> Result[FeedEntry, str
         return Err(f"Not Found: {prefix}")
 
     if len(entries) > 1:
+        # 完整 ID 也可能是其他 ID 的前缀，例如 '1KA1' 与 '1KA10'
+        for entry in entries:
+            if entry.entry_id.upper() == prefix.upper():
+                return Ok(entry)
         for entry in entries:
             print_news(entry, False, False)
         return Err("Require long-id (需要使用完整ID)")
@@ -366,20 +517,43 @@ def print_recent_fav(limit: int, conn: Conn) -> None:
     print_entries(entries, False, print_fav_entry)
 
 
-def search_by_tag(tag: str, limit: int, bucket: str, conn: Conn) -> bool:
+def search_by_tag(
+    tag: str, limit: int, bucket: str, conn: Conn, tag_query: bool = True
+) -> bool:
+    """tag 也可以是多标签查询语句，例如 '#python AND #perf NOT #draft'
+
+    tag_query 为 False 时 tag 只是一个标签 (用于默认的搜索，普通关键词不当作查询语句)。
+    """
     bucket = bucket.capitalize()
     if bucket == "All":
         print(f"Search Tag [{tag}] in all buckets\n")
     else:
         print(f"Search Tag [{tag}] in bucket[{bucket}]\n")
 
-    n = db.count_by_tag(tag, bucket, conn)
+    if tag_query:
+        match parse_tag_query(tag):
+            case Err(e):
+                print(f"Error: {e}\n")
+                return False
+            case Ok(clauses):
+                pass
+    else:
+        clauses = [TagClause(include=[tag.removeprefix("#")], exclude=[])]
+
+    match clauses:
+        case [TagClause(include=[name], exclude=[])]:
+            # 只有一个标签，不需要多标签查询。
+            n = db.count_by_tag(name, bucket, conn)
+            entries = db.get_by_tag(name, limit, bucket, conn) if n else []
+        case _:
+            n, entries = db.get_by_tag_query(clauses, limit, bucket, conn)
+
     if not n:
         print("Not Found (找不到相关信息)\n")
         return False
     else:
-        entries = db.get_by_tag(tag, limit, bucket, conn)
         print(f"Found {n} items, showing {len(entries)} items.\n")
+        db.fill_short_ids(entries, conn)
         print_entries(entries, False, print_bucket_msg)
         return True
 
@@ -397,10 +571,49 @@ def search_contains(keyword: str, limit: int, bucket: str, conn: Conn) -> None:
     else:
         entries = db.search_entry_content(keyword, limit, bucket, conn)
         print(f"Found {n} items, showing {len(entries)} items.\n")
+        db.fill_short_ids(entries, conn)
         print_entries(entries, False, print_bucket_msg)
 
 
+def search_archive(
+    search: Callable[[str, int, str, Conn], object],
+    keyword: str,
+    limit: int,
+    bucket: str,
+) -> None:
+    """在归档数据库中搜索，search 是 search_by_tag 等搜索函数。"""
+    print("[Archive] (归档消息)\n")
+    aconn = retention.connect_archive()
+    if aconn is None:
+        print("归档消息：空空如也。\n")
+        return
+    with aconn:
+        search(keyword, limit, bucket, aconn)
+    aconn.close()
+
+
 def search_tag_and_contains(keyword: str, limit: int, bucket: str, conn: Conn) -> None:
-    ok = search_by_tag(keyword, limit, bucket, conn)
+    ok = search_by_tag(keyword, limit, bucket, conn, tag_query=False)
     if not ok:
         search_contains(keyword, limit, bucket, conn)
+
+
+def print_tags(keyword: str, sort: str, page: int, limit: int, conn: Conn) -> None:
+    """如果未指定 page, 则列出全部标签 (或全部符合 keyword 的标签)。"""
+    offset = 0
+    if page:
+        offset = (max(page, 1) - 1) * limit
+    else:
+        limit = -1
+
+    if keyword:
+        total, tags = db.get_tags_by_name(keyword, conn, sort, limit, offset)
+    else:
+        total, tags = db.get_all_tags(conn, sort, limit, offset)
+
+    tags_str = " ".join(f"#{name}({count})" for name, count in tags)
+    if page:
+        print(f"Found {total} tags, page {page}, showing {len(tags)} tags:")
+        print(f"{tags_str}\n")
+    else:
+        print(f"Found {total} tags: {tags_str}\n")
@@ -0,0 +1,20 @@
+"""批量发送 (ago post -batch): 读取失败的文件或行作为错误返回，不影响其他消息。"""
+
+from ipelago.model import Bucket
+from ipelago.util import read_batch
+
+
+def test_dir_not_utf8(tmp_path):
+    tmp_path.joinpath("a.txt").write_text("你好", encoding="utf-8")
+    tmp_path.joinpath("b.txt").write_bytes(b"\xff\xfe")
+    results = dict(read_batch(tmp_path, Bucket.Public))
+    assert results["a.txt"].unwrap().content == "你好"
+    assert results["b.txt"].is_err()
+
+
+def test_jsonl_not_utf8(tmp_path):
+    path = tmp_path.joinpath("batch.jsonl")
+    path.write_bytes('{"content": "你好"}\n'.encode("utf-8") + b"\xff\n")
+    results = dict(read_batch(path, Bucket.Public))
+    assert results["line 1"].unwrap().content == "你好"
+    assert results["line 2"].is_err()
@@ -0,0 +1,161 @@
+"""用旧版本的数据库 (tests/fixtures) 测试 migrate.
+
+- v0: 最初的版本 (没有 schema-version), 订阅消息还在 main.entry 中。
+- v4: 订阅消息已移到 pypelago-news.db, 但 feed 还没有 key.
+
+两者都由当时版本的代码生成，测试时复制到临时目录，然后用 connect_db 升级。
+"""
+
+from pathlib import Path
+import shutil
+import sqlite3
+import pytest
+from ipelago import db
+from ipelago import migrate as migrate_module
+from ipelago.compress import unpack
+from ipelago.migrate import LatestVersion, migrate, schema_version_name
+
+Fixtures = Path(__file__).parent / "fixtures"
+
+# 各版本的测试数据相同
+NewsFeeds = {"feedA": "Feed A", "feedB": "Feed B"}
+NewsPerFeed = 5
+MyEntries = {"Public": 6, "Private": 2}
+TagCounts = {"python": 4, "sqlite": 4, "日记": 1}
+
+
+def use_fixture(version, tmp_path, monkeypatch):
+    for f in (Fixtures / version).iterdir():
+        shutil.copy(f, tmp_path)
+    monkeypatch.setattr(db, "db_path", tmp_path / db.db_filename)
+    monkeypatch.setattr(db, "news_path", tmp_path / db.news_filename)
+
+
+@pytest.fixture(params=["v0", "v4"])
+def conn(request, tmp_path, monkeypatch):
+    use_fixture(request.param, tmp_path, monkeypatch)
+    conn = db.connect_db()
+    yield conn
+    conn.close()
+
+
+def get_version(conn, schema="main"):
+    query = f"SELECT value FROM {schema}.metadata WHERE name=?;"
+    return int(conn.execute(query, (schema_version_name,)).fetchone()[0])
+
+
+def test_schema_version(conn):
+    assert get_version(conn) == LatestVersion
+    assert get_version(conn, "news") == LatestVersion
+
+    migrate(conn)  # 已是最新版本，再次执行不做任何处理
+    assert get_version(conn) == LatestVersion
+
+
+def test_news_moved(conn):
+    rows = conn.execute("SELECT bucket, count(*) FROM main.entry GROUP BY bucket;")
+    assert dict(rows.fetchall()) == MyEntries
+
+    rows = conn.execute("SELECT bucket, content FROM news.entry;").fetchall()
+    assert len(rows) == len(NewsFeeds) * NewsPerFeed
+    assert {row["bucket"] for row in rows} == {"News"}
+    assert all(unpack(row["content"]).startswith("Feed ") for row in rows)
+
+
+def test_feed_key(conn):
+    keys = [row[0] for row in conn.execute("SELECT key FROM feed;")]
+    assert None not in keys
+    assert len(set(keys)) == len(keys)
+
+    rows = conn.execute(
+        """SELECT feed.id, feed.title, entry.feed_id, entry.feed_name, count(*)
+        FROM news.entry JOIN main.feed ON feed.key=entry.feed_key
+        GROUP BY feed.id;"""
+    ).fetchall()
+    assert {row[0]: row[1] for row in rows} == NewsFeeds
+    assert all(row[4] == NewsPerFeed for row in rows)
+    assert all(row[2] is None and row[3] == "" for row in rows)
+
+    no_key = conn.execute("SELECT count(*) FROM news.entry WHERE feed_key IS NULL;")
+    assert no_key.fetchone()[0] == 0
+
+
+def test_tag_dict(conn):
+    rows = conn.execute("SELECT name, count FROM tag_dict;")
+    assert dict(rows.fetchall()) == TagCounts
+
+    last_used = conn.execute(
+        """SELECT tag_dict.name FROM tag_dict WHERE last_used != (
+            SELECT max(entry.published) FROM tag JOIN entry ON tag.entry_id=entry.id
+            WHERE tag.name=tag_dict.name);"""
+    )
+    assert last_used.fetchall() == []
+
+
+def get_pending(conn):
+    query = "SELECT value FROM metadata WHERE name=?;"
+    row = conn.execute(query, (migrate_module.schema_pending_name,)).fetchone()
+    return int(row[0]) if row else None
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("backfill", ["MoveNews", "NewsFeedKeys", "StoryKeys"])
+def test_resume_backfill(backfill, tmp_path, monkeypatch):
+    """第三批时中断，已完成的两批保留，下次连接时从中断处继续。"""
+    use_fixture("v0", tmp_path, monkeypatch)
+    monkeypatch.setattr(migrate_module, "BackfillBatchSize", 3)
+    target = getattr(migrate_module, backfill)
+    step = target.step
+    calls = []
+
+    def interrupted_step(conn, limit):
+        if len(calls) == 2:
+            raise Interrupted
+        calls.append(limit)
+        return step(conn, limit)
+
+    monkeypatch.setattr(target, "step", interrupted_step)
+    with pytest.raises(Interrupted):
+        db.connect_db()
+
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("ATTACH DATABASE ? AS news;", (str(db.news_path),))
+    version = {"MoveNews": 3, "NewsFeedKeys": 5, "StoryKeys": 7}[backfill]
+    assert get_pending(conn) == version
+    assert get_version(conn) == version - 1
+    query = {
+        "MoveNews": "SELECT count(*) FROM news.entry;",
+        "NewsFeedKeys": "SELECT count(*) FROM news.entry WHERE feed_key IS NOT NULL;",
+        "StoryKeys": "SELECT count(*) FROM news.entry WHERE story IS NOT NULL;",
+    }[backfill]
+    assert conn.execute(query).fetchone()[0] == 6
+    conn.close()
+
+    monkeypatch.setattr(target, "step", step)
+    conn = db.connect_db()
+    assert get_version(conn) == LatestVersion
+    assert get_pending(conn) is None
+    test_news_moved(conn)
+    test_feed_key(conn)
+    test_tag_dict(conn)
+    no_story = conn.execute("SELECT count(*) FROM news.entry WHERE story IS NULL;")
+    assert no_story.fetchone()[0] == 0
+    conn.close()
+
+
+def test_news_tables(tmp_path, monkeypatch):
+    """新建的 news 数据库只有 entry 相关的表，已是最新版本时不再执行迁移。"""
+    use_fixture("v0", tmp_path, monkeypatch)
+    db.connect_db().close()
+    news = sqlite3.connect(db.news_path)
+    rows = news.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    assert {row[0] for row in rows} == {"metadata", "entry", "content_dict"}
+    news.close()
+
+    calls = []
+    monkeypatch.setattr(db, "migrate", lambda conn, **kwargs: calls.append(kwargs))
+    db.connect_db().close()
+    assert calls == [{}]  # 只有 main 数据库
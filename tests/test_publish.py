@@ -0,0 +1,86 @@
+"""RSS (atom.xml) 的体积上限: 按 UTF-8 字节计算，保留不超出上限的最新消息。"""
+
+import pytest
+from ipelago import publish
+from ipelago.model import (
+    Bucket,
+    EntrySizeLimit,
+    Feed,
+    FeedEntry,
+    FeedSizeLimit,
+    PublicBucketID,
+    byte_len,
+)
+
+MyFeed = Feed(
+    feed_id=PublicBucketID,
+    feed_link="https://example.com/atom.xml",
+    website="https://example.com",
+    title="测试",
+    author_name="ipelago",
+    updated="2026-10-19T00:00:00Z",
+)
+
+
+def new_entries(n: int, content: str) -> list[FeedEntry]:
+    """从新到旧排列，与 get_recent_entries 相同。"""
+    return [
+        FeedEntry(
+            entry_id=f"E{i:02}",
+            content=content,
+            link="",
+            published=f"2026-10-{30 - i:02}T00:00:00Z",
+            feed_id=PublicBucketID,
+            feed_name="",
+            bucket=Bucket.Public.name,
+        )
+        for i in range(n)
+    ]
+
+
+def render(entries: list[FeedEntry]) -> str:
+    return publish.render_atom_rss("", publish.atom_xml, MyFeed, entries)
+
+
+def render_all(entries: list[FeedEntry]) -> str:
+    """不限体积，直接渲染全部消息。"""
+    tmpl = publish.get_jinja_env("").get_template(publish.atom_xml)
+    feed_uuid = publish.get_feed_uuid(MyFeed)
+    return tmpl.render(dict(feed_uuid=feed_uuid, feed=MyFeed, entries=entries))
+
+
+@pytest.mark.parametrize(
+    "base, sizes, limit, n",
+    [
+        (5, [10, 20, 30], 35, 2),  # 恰好等于上限
+        (5, [10, 20, 30], 34, 1),
+        (5, [10, 20, 30], 65, 3),  # 全部放得下
+        (5, [10, 20, 30], 14, 0),
+        (5, [], 10, 0),
+        (5, [10, 100, 1], 30, 1),  # 是前缀，不跳过较大的消息
+    ],
+)
+def test_max_entries_fit(base, sizes, limit, n):
+    assert publish.max_entries_fit(base, sizes, limit) == n
+
+
+def test_cjk_measured_in_bytes():
+    """每个汉字占 3 个字节，按字符数计算则不会超出上限。"""
+    content = "微" * (EntrySizeLimit // 3)
+    entries = new_entries(publish.atom_entries_limit, content)
+    rss = render(entries)
+    assert len(render_all(entries)) < FeedSizeLimit < byte_len(render_all(entries))
+
+    n = rss.count("<entry>")
+    assert 0 < n < len(entries)
+    assert byte_len(rss) <= FeedSizeLimit
+    # 保留的是最新的 n 条，并且再多一条就会超出上限。
+    assert rss == render_all(entries[:n])
+    assert byte_len(render_all(entries[: n + 1])) > FeedSizeLimit
+
+
+def test_all_entries_fit():
+    entries = new_entries(5, "hello 你好")
+    rss = render(entries)
+    assert rss.count("<entry>") == len(entries)
+    assert rss == render_all(entries)
@@ -0,0 +1,31 @@
+"""用 bench.explain_all 检查 stmt.py 中全部 SQL 的查询计划。
+
+除 bench.KnownIssues 之外，不允许全表扫描或临时排序 (详见 bench.py)。
+"""
+
+import pytest
+from ipelago import bench, db
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("plans")
+    # 数据太少时 SQLite 可能认为全表扫描更快，因此至少要一万条。
+    conn = bench.new_bench_db(tmp_path / db.db_filename, 10000)
+    yield {r.name: r for r in bench.explain_all(conn, tmp_path)}
+    conn.close()
+
+
+def test_no_unexpected_failures(results):
+    failed = [
+        name
+        for name, r in results.items()
+        if not r.ok and name not in bench.KnownIssues
+    ]
+    assert failed == []
+
+
+def test_known_issues_still_fail(results):
+    """已修复的 SQL 应从 KnownIssues 中删除。"""
+    fixed = [name for name in bench.KnownIssues if results[name].ok]
+    assert fixed == []
@@ -0,0 +1,55 @@
+"""按名称查找标签: 以关键词开头的标签在前，其他包含关键词的标签在后。"""
+
+import pytest
+from ipelago import bench, db
+
+# name: (count, last_used)
+Tags = {
+    "python": (3, "2026-01-01"),
+    "pypy": (1, "2026-03-01"),
+    "Pyramid": (2, "2026-02-01"),
+    "cpython": (5, "2026-04-01"),
+    "mypy": (4, "2026-05-01"),
+    "sqlite": (9, "2026-06-01"),
+}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = bench.init_bench_db(tmp_path / db.db_filename)
+    for name, (count, last_used) in Tags.items():
+        conn.execute(
+            "INSERT INTO tag_dict (name, count, last_used) VALUES (?, ?, ?);",
+            (name, count, last_used),
+        )
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "sort, expected",
+    [
+        ("name", ["pypy", "Pyramid", "python", "cpython", "mypy"]),
+        ("count", ["python", "Pyramid", "pypy", "cpython", "mypy"]),
+        ("recent", ["pypy", "Pyramid", "python", "mypy", "cpython"]),
+    ],
+)
+def test_prefix_first(conn, sort, expected):
+    total, tags = db.get_tags_by_name("py", conn, sort)
+    assert total == len(expected)
+    assert [name for name, _ in tags] == expected
+
+
+def test_pages(conn):
+    expected = ["pypy", "Pyramid", "python", "cpython", "mypy"]
+    names = []
+    for offset in range(0, len(expected), 2):
+        total, tags = db.get_tags_by_name("py", conn, limit=2, offset=offset)
+        assert total == len(expected)
+        names += [name for name, _ in tags]
+    assert names == expected
+
+
+def test_contain_only(conn):
+    total, tags = db.get_tags_by_name("ql", conn)
+    assert (total, tags) == (1, [("sqlite", 9)])